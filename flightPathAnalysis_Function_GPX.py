@@ -0,0 +1,602 @@
+from xml.etree.ElementTree import iterparse
+from pathlib import Path
+import datetime
+import glob
+import gzip
+import hashlib
+import io
+import numpy as np
+import os
+import tarfile
+import threading
+import zipfile
+
+# This module doesn't depend on qgis so that it can be imported by the worker
+# processes of the gpx ingest.
+
+# gpx track point children read into their own column, the other leaf elements
+# of a track point (eg. <extensions><badelf:speed>) are read as vendor fields
+trackPointFields = ['ele', 'time', 'hdop']
+
+# archive extensions read without extracting them, with the GDAL virtual file system prefix that
+# lets OGR read their members
+archiveTypes = {'.zip': '/vsizip/', '.tar': '/vsitar/', '.tar.gz': '/vsitar/', '.tgz': '/vsitar/'}
+
+# archive last opened by openGPX in each thread, kept open so the members read in the order
+# gpxSources lists them are read in one pass over the archive
+openArchives = threading.local()
+
+
+def gpxSources(gpxFolder):
+    """
+    (string) -> list
+    gpxFolder: folder of the gpx files
+
+    Purpose:
+    Lists the flights of gpxFolder: the .gpx and .gpx.gz files, and the .gpx and .gpx.gz members
+    of the zip and tar archives. Compressed flights and archive members are given as GDAL virtual
+    file system paths, eg. /vsizip/C:/gpx/march.zip/flight1.gpx or /vsigzip//vsizip/C:/gpx/march.zip/flight2.gpx.gz,
+    that OGR reads like files and openGPX streams without extracting them.
+    Returns the sorted gpx and .gpx.gz files, then the members of every archive in the order they
+    are stored in, so a .tar.gz is decompressed once when its members are read in turn
+    """
+    gpxFolder = os.path.abspath(gpxFolder)
+    sources = glob.glob(os.path.join(gpxFolder, "*.gpx"))
+    sources += ['/vsigzip/' + gzFile for gzFile in glob.glob(os.path.join(gpxFolder, "*.gpx.gz"))]
+    sources.sort()
+    archives = []
+    for archiveExt, prefix in archiveTypes.items():
+        archives += [(archive, prefix) for archive in glob.glob(os.path.join(gpxFolder, '*' + archiveExt))]
+    for archive, prefix in sorted(archives):
+        for member in archiveMembers(archive):
+            source = f'{prefix}{archive}/{member}'
+            sources.append('/vsigzip/' + source if member.lower().endswith('.gz') else source)
+    return sources
+
+
+def archiveMembers(archive):
+    """
+    Names of the .gpx and .gpx.gz members of a zip or tar archive, in archive order
+    """
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zipArchive:
+            names = [info.filename for info in zipArchive.infolist() if not info.is_dir()]
+    else:
+        with tarfile.open(archive) as tarArchive:
+            names = [info.name for info in tarArchive.getmembers() if info.isfile()]
+    return [name for name in names if name.lower().endswith(('.gpx', '.gpx.gz'))]
+
+
+def splitArchive(path):
+    """
+    Splits archive/member/path into the archive path and the member name
+    """
+    lowerPath = path.lower()
+    for archiveExt in archiveTypes:
+        end = lowerPath.find(archiveExt + '/')
+        if end >= 0:
+            end += len(archiveExt)
+            return path[:end], path[end + 1:]
+    raise ValueError(f'No archive in {path}')
+
+
+def openGPX(source):
+    """
+    (string) -> file object
+    source: gpx file or GDAL virtual file system path listed by gpxSources
+
+    Purpose:
+    Opens a flight for streaming. Gzip files and archive members are decompressed while read.
+    The archive of a member stays open in the thread for its next members, see tarMember.
+    Returns a binary file object. The object of a tar member can only be read until the next
+    member of the archive is opened in the same thread.
+    """
+    if source.startswith('/vsigzip/'):
+        return gzip.GzipFile(fileobj=openGPX(source[len('/vsigzip/'):]))
+    if source.startswith('/vsizip/'):
+        archive, member = splitArchive(source[len('/vsizip/'):])
+        zipArchive = getattr(openArchives, 'zip', None)
+        if zipArchive is None or zipArchive.filename != archive:
+            if zipArchive is not None:
+                zipArchive.close()
+            zipArchive = openArchives.zip = zipfile.ZipFile(archive)
+        return zipArchive.open(member)
+    if source.startswith('/vsitar/'):
+        return tarMember(*splitArchive(source[len('/vsitar/'):]))
+    return open(source, 'rb')
+
+
+def tarMember(archive, member):
+    """
+    (string, string) -> file object
+    Purpose:
+    Opens a member of a tar archive. The archive is read as a stream, forward from the member
+    opened last in this thread, so reading the members in archive order decompresses a .tar.gz
+    once rather than once per member. The archive is read again from the start for a member
+    behind the last one.
+    Returns a binary file object, read it before opening the next member
+    """
+    cached = getattr(openArchives, 'tar', None)
+    if cached is not None and cached[0] == archive:
+        memberStream = nextTarMember(cached[1], member)
+        if memberStream is not None:
+            return memberStream
+    if cached is not None:
+        cached[1].close()
+    tarArchive = tarfile.open(archive, mode='r|*')
+    openArchives.tar = (archive, tarArchive)
+    memberStream = nextTarMember(tarArchive, member)
+    if memberStream is None:
+        raise KeyError(f'{member} not found in {archive}')
+    return memberStream
+
+
+def nextTarMember(tarArchive, member):
+    """
+    Reads a tar archive opened as a stream forward to a member, None if it isn't ahead
+    """
+    info = tarArchive.next()
+    while info is not None:
+        if info.name == member and info.isfile():
+            return tarArchive.extractfile(info)
+        info = tarArchive.next()
+    return None
+
+
+def sourceFile(source):
+    """
+    File on disk holding a flight: the gpx file itself or the archive it's in
+    """
+    path = source
+    for prefix in ('/vsigzip/', '/vsizip/', '/vsitar/'):
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+    try:
+        return splitArchive(path)[0]
+    except ValueError:
+        return path
+
+
+def flightName(source):
+    """
+    Name of a flight: the gpx file name without the .gpx and .gz extensions, prefixed with the
+    archive name for an archive member so flights of different archives don't get the same name
+    """
+    name = Path(source).name
+    for ext in ('.gz', '.gpx'):
+        if name.lower().endswith(ext):
+            name = name[:-len(ext)]
+    container = sourceFile(source)
+    if container.lower().endswith(tuple(archiveTypes)):
+        archiveName = Path(container).name
+        for archiveExt in sorted(archiveTypes, key=len, reverse=True):
+            if archiveName.lower().endswith(archiveExt):
+                archiveName = archiveName[:-len(archiveExt)]
+                break
+        name = archiveName + '_' + name
+    return name
+
+
+def sourceHash(source):
+    """
+    sha1 of the content of a flight, decompressed
+    """
+    contentHash = hashlib.sha1()
+    with openGPX(source) as gpxStream:
+        for block in iter(lambda: gpxStream.read(1 << 20), b''):
+            contentHash.update(block)
+    return contentHash.hexdigest()
+
+
+def localName(tag):
+    """
+    Element name without the {namespace} part
+    """
+    return tag[tag.rfind('}') + 1:]
+
+
+def parseGPXTime(timeText):
+    """
+    (string) -> float
+    Purpose:
+    Converts a gpx ISO 8601 time, eg. 2021-03-04T18:22:05Z or 2021-03-04T10:22:05.5-08:00,
+    to seconds since epoch. Times without a timezone are taken as UTC.
+    """
+    timeText = timeText.strip()
+    if timeText.endswith('Z'):
+        timeText = timeText[:-1] + '+00:00'
+    gpxTime = datetime.datetime.fromisoformat(timeText)
+    if gpxTime.tzinfo is None:
+        gpxTime = gpxTime.replace(tzinfo=datetime.timezone.utc)
+    return gpxTime.timestamp()
+
+
+def parseGPXTimes(timeTexts):
+    """
+    (list) -> numpy array
+    timeTexts: gpx ISO 8601 times of a track, None for a missing time
+
+    Purpose:
+    Converts the times of a whole track to seconds since epoch in one call. UTC times (ending with Z)
+    and times without a timezone, with or without fractional seconds, are parsed together as a
+    numpy datetime64[ms] array. Times with a UTC offset, eg. -08:00, are parsed one at a time by
+    parseGPXTime.
+    Returns the times, nan for a missing or unreadable time
+    """
+    texts = np.char.strip(np.array(['' if text is None else text for text in timeTexts], dtype=str))
+    if len(texts) == 0:
+        return np.array([], dtype=np.float64)
+    texts = np.where(np.char.endswith(texts, 'Z'), np.char.rstrip(texts, 'Z'), texts)
+    timePart = np.char.partition(texts, 'T')[:, 2]
+    hasOffset = (np.char.find(timePart, '+') >= 0) | (np.char.find(timePart, '-') >= 0)
+    texts = np.where(hasOffset | (texts == ''), 'NaT', texts)
+
+    try:
+        stamps = texts.astype('datetime64[ms]')
+    except ValueError:
+        stamps = np.array([parseGPXTimeOrNaT(text) for text in texts], dtype='datetime64[ms]')
+    times = stamps.astype(np.int64) / 1000
+    times[np.isnat(stamps)] = np.nan
+
+    for index in np.flatnonzero(hasOffset):
+        try:
+            times[index] = parseGPXTime(timeTexts[index])
+        except ValueError:
+            pass
+    return times
+
+
+def parseGPXTimeOrNaT(text):
+    """
+    Single time parsed as datetime64[ms], NaT if it isn't a time
+    """
+    try:
+        return np.datetime64(text, 'ms')
+    except ValueError:
+        return np.datetime64('NaT')
+
+
+def toFloat(text):
+    """
+    Number of an element text, nan if it isn't a number
+    """
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def readFlightBytes(source):
+    """
+    Decompressed content of a flight, read in one go
+    """
+    with openGPX(source) as gpxStream:
+        return gpxStream.read()
+
+
+def parseFlight(content):
+    """
+    (bytes) -> dict
+    Purpose:
+    Reads the track points of the content of a gpx file with readGPX.
+    Returns the track, with the 'sha1' of the content so the file isn't read again to hash it
+    """
+    track = readGPX(io.BytesIO(content))
+    track['sha1'] = hashlib.sha1(content).hexdigest()
+    return track
+
+
+def loadFlight(source):
+    """
+    Track of a flight read by parseFlight, used by the worker processes of the gpx ingest
+    """
+    return parseFlight(readFlightBytes(source))
+
+
+def readGPX(gpxFile):
+    """
+    (string or file object) -> dict
+    gpxFile: gpx file or source listed by gpxSources to read
+
+    Purpose:
+    Reads all the track points of a gpx file in one streaming pass. Elements are cleared once
+    read so only the columns are kept in memory.
+    Returns {'name': name of the last track, 'lon', 'lat', 'ele', 'time', 'hdop': numpy arrays,
+    'vendor': {field name: numpy array}}. Time is in seconds since epoch, missing values are nan.
+    Vendor fields are named prefix_element like OGR, eg. badelf_speed.
+    """
+    namespaces = {}
+    columns = {'lon': [], 'lat': [], 'ele': [], 'time': [], 'hdop': []}
+    vendor = {}
+    trackName = None
+    segment = None
+    pointCount = 0
+    inTrack = False
+    inPoint = False
+
+    if isinstance(gpxFile, str):
+        with openGPX(gpxFile) as gpxStream:
+            return readGPX(gpxStream)
+
+    for event, item in iterparse(gpxFile, events=('start-ns', 'start', 'end')):
+        if event == 'start-ns':
+            prefix, uri = item
+            namespaces[uri] = prefix
+            continue
+
+        name = localName(item.tag)
+        if event == 'start':
+            if name == 'trk':
+                inTrack = True
+            elif name == 'trkseg':
+                segment = item
+            elif name == 'trkpt':
+                inPoint = True
+            continue
+
+        # ==============================================================
+        # end of an element
+        # ==============================================================
+        if name == 'trkpt':
+            columns['lon'].append(toFloat(item.get('lon')))
+            columns['lat'].append(toFloat(item.get('lat')))
+            values = {}
+            for child in item.iter():
+                if child is item or len(child):
+                    continue
+                childName = localName(child.tag)
+                if childName not in trackPointFields:
+                    uri = child.tag[1:child.tag.find('}')] if child.tag.startswith('{') else ''
+                    prefix = namespaces.get(uri, '')
+                    childName = f'{prefix}_{childName}' if prefix else childName
+                values[childName] = child.text
+            columns['ele'].append(toFloat(values.pop('ele', None)))
+            columns['hdop'].append(toFloat(values.pop('hdop', None)))
+            columns['time'].append(values.pop('time', None))
+            for field, text in values.items():
+                vendor.setdefault(field, [np.nan] * pointCount).append(toFloat(text))
+            pointCount += 1
+            for field in vendor:
+                if len(vendor[field]) < pointCount:
+                    vendor[field].append(np.nan)
+            inPoint = False
+            # drop the points already read from the track segment
+            if segment is not None:
+                segment.clear()
+        elif name == 'name' and inTrack and not inPoint:
+            trackName = item.text
+        elif name == 'trk':
+            inTrack = False
+            item.clear()
+
+    timeTexts = columns.pop('time')
+    track = {field: np.array(values, dtype=np.float64) for field, values in columns.items()}
+    track['time'] = parseGPXTimes(timeTexts)
+    track['name'] = trackName
+    track['vendor'] = {field: np.array(values, dtype=np.float64) for field, values in vendor.items()}
+    return track
+
+
+def isoTimes(times):
+    """
+    (numpy array) -> list
+    Purpose:
+    Converts seconds since epoch to ISO 8601 UTC text, eg. 2021-03-04T18:22:05Z.
+    Returns the texts, None for a missing time
+    """
+    missing = np.isnan(times)
+    stamps = np.where(missing, 0, np.round(times)).astype('int64').astype('datetime64[s]')
+    texts = np.datetime_as_string(stamps, unit='s', timezone='UTC')
+    return [None if isMissing else str(text) for isMissing, text in zip(missing, texts)]
+
+
+def pointDurations(track, maxGap=0):
+    """
+    (dict, float) -> numpy array
+    track: columns returned by readGPX
+    maxGap: longest time (s) between two points counted as flight time, 0 for no limit
+
+    Purpose:
+    Time (s) flown from every point to the next one, from the differences of consecutive timestamps.
+    Gaps longer than maxGap, eg. logger dropouts, are capped to maxGap. The last point gets 0 so the
+    durations of a flight add up to its flight time. Points without a time and time steps going
+    backwards get 0.
+    Returns None if the flight has less than two points with a time.
+    """
+    times = track['time']
+    timed = ~np.isnan(times)
+    if np.count_nonzero(timed) < 2:
+        return None
+    timedTimes = times[timed]
+    steps = np.clip(np.diff(timedTimes, append=timedTimes[-1]), 0, maxGap if maxGap > 0 else None)
+    durations = np.zeros(len(times))
+    durations[timed] = steps
+    return durations
+
+
+def trackFingerprint(track, sampleCount=32, timeQuantum=60):
+    """
+    (dict, int, float) -> dict
+    track: columns returned by readGPX
+    sampleCount: number of positions sampled along the flight
+    timeQuantum: start and end times are rounded to it (s) in the hash
+
+    Purpose:
+    Fingerprint of a flight to find the flights uploaded twice. 'hash' is made of the start and
+    end times rounded to timeQuantum and of the sampled positions rounded to about 10 m, so exact
+    copies of a flight have the same hash. 'start', 'end' and the [time, lon, lat] 'samples'
+    taken evenly along the flight are used by findDuplicate to find trimmed copies.
+    Returns the fingerprint, None if the flight has less than two points with a time and a position.
+    """
+    located = ~(np.isnan(track['time']) | np.isnan(track['lon']) | np.isnan(track['lat']))
+    if np.count_nonzero(located) < 2:
+        return None
+    order = np.argsort(track['time'][located], kind='stable')
+    times = track['time'][located][order]
+    lons = track['lon'][located][order]
+    lats = track['lat'][located][order]
+    indices = np.unique(np.linspace(0, len(times) - 1, sampleCount).round().astype(int))
+
+    key = f'{round(times[0] / timeQuantum)}|{round(times[-1] / timeQuantum)}|'
+    key += ','.join(f'{lon:.4f} {lat:.4f}' for lon, lat in zip(lons[indices], lats[indices]))
+    return {'hash': hashlib.sha1(key.encode()).hexdigest(),
+            'start': float(times[0]),
+            'end': float(times[-1]),
+            'samples': [[float(times[i]), float(lons[i]), float(lats[i])] for i in indices]}
+
+
+def findDuplicate(track, fingerprint, fingerprints, tolerance=0.0005, minOverlap=0.9):
+    """
+    (dict, dict, dict, float, float) -> string
+    track: columns returned by readGPX of the flight to check
+    fingerprint: trackFingerprint of the flight to check
+    fingerprints: {flight: trackFingerprint} of the flights already in the season
+    tolerance: largest distance (degrees) between the positions of two copies of a flight
+    minOverlap: share of the shorter flight the two flights have to be flown at the same time
+
+    Purpose:
+    Finds the flight the track is a copy of. An exact copy has the same fingerprint hash. A trimmed
+    copy is flown at the same time as the other flight for most of the shorter one, and the track,
+    interpolated at the times of the samples of the other flight, is within tolerance of them.
+    Returns the flight the track is a copy of, None if it isn't a copy.
+    """
+    located = ~(np.isnan(track['time']) | np.isnan(track['lon']) | np.isnan(track['lat']))
+    order = np.argsort(track['time'][located], kind='stable')
+    times = track['time'][located][order]
+    lons = track['lon'][located][order]
+    lats = track['lat'][located][order]
+
+    for flight, other in fingerprints.items():
+        if other['hash'] == fingerprint['hash']:
+            return flight
+        overlapStart = max(fingerprint['start'], other['start'])
+        overlapEnd = min(fingerprint['end'], other['end'])
+        shorter = min(fingerprint['end'] - fingerprint['start'], other['end'] - other['start'])
+        if overlapEnd <= overlapStart or overlapEnd - overlapStart < minOverlap * shorter:
+            continue
+        samples = np.array(other['samples'])
+        samples = samples[(samples[:, 0] >= overlapStart) & (samples[:, 0] <= overlapEnd)]
+        if len(samples) < 3:
+            continue
+        lonOffsets = np.abs(np.interp(samples[:, 0], times, lons) - samples[:, 1])
+        latOffsets = np.abs(np.interp(samples[:, 0], times, lats) - samples[:, 2])
+        if max(lonOffsets.max(), latOffsets.max()) <= tolerance:
+            return flight
+    return None
+
+
+def localCoordinates(track):
+    """
+    (dict) -> numpy array
+    Purpose:
+    Approximate x, y, z in meters of the track points, from an equirectangular projection around
+    the middle of the track. Missing elevations are taken as 0.
+    Returns an array of [x, y, z] rows
+    """
+    midLat = np.nanmedian(track['lat'])
+    x = track['lon'] * 111320 * np.cos(np.radians(midLat))
+    y = track['lat'] * 110540
+    z = np.nan_to_num(track['ele'])
+    return np.column_stack((x, y, z))
+
+
+def collapseStationary(coords, tolerance):
+    """
+    (numpy array, float) -> numpy array
+    Purpose:
+    Keeps the first point of every run of points within tolerance (m) of it, eg. while hovering.
+    The last point is always kept.
+    Returns the indices of the kept points
+    """
+    kept = [0]
+    anchor = coords[0]
+    for index in range(1, len(coords)):
+        if np.linalg.norm(coords[index] - anchor) > tolerance:
+            kept.append(index)
+            anchor = coords[index]
+    if kept[-1] != len(coords) - 1:
+        kept.append(len(coords) - 1)
+    return np.array(kept)
+
+
+def simplifySED(times, coords, tolerance):
+    """
+    (numpy array, numpy array, float) -> numpy array
+    Purpose:
+    Douglas-Peucker simplification with the synchronized euclidean distance: a point is dropped if
+    its position is within tolerance (m) of where the aircraft would be at its time flying straight
+    at constant speed between the kept points around it.
+    Returns a boolean array of the kept points
+    """
+    keep = np.zeros(len(times), dtype=bool)
+    keep[[0, -1]] = True
+    segments = [(0, len(times) - 1)]
+    while segments:
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
+        span = times[last] - times[first]
+        if span > 0:
+            ratios = (times[first + 1:last] - times[first]) / span
+        else:
+            ratios = np.arange(1, last - first) / (last - first)
+        expected = coords[first] + ratios[:, None] * (coords[last] - coords[first])
+        errors = np.linalg.norm(coords[first + 1:last] - expected, axis=1)
+        worst = int(np.argmax(errors))
+        if errors[worst] > tolerance:
+            split = first + 1 + worst
+            keep[split] = True
+            segments += [(first, split), (split, last)]
+    return keep
+
+
+def reduceTrack(track, durations, tolerance, zones=None):
+    """
+    (dict, numpy array, float, numpy array) -> dict, numpy array
+    track: columns returned by readGPX
+    durations: time (s) flown from every point to the next one
+    tolerance: position error (m) allowed by the reduction
+    zones: zone of every point, eg. the uwr rings it's in and its height band, None for one zone
+
+    Purpose:
+    Reduces a dense flight log. Runs of near-stationary points are collapsed into their first point,
+    then straight, constant speed parts of the flight are downsampled with simplifySED. Every kept
+    point carries the durations of the dropped points that follow it. The first point in a new zone
+    is always kept and the reduction doesn't carry time across zones, so the durations still add up
+    to the time flown in every zone. Points without a position are dropped with their time, as they
+    are when the flight isn't reduced.
+    Returns the reduced track and the durations of its points
+    """
+    located = np.flatnonzero(~(np.isnan(track['lon']) | np.isnan(track['lat'])))
+    if len(located) < 3 or tolerance <= 0:
+        return track, durations
+
+    times = track['time'][located]
+    timed = ~np.isnan(times)
+    if np.count_nonzero(timed) >= 2:
+        times = np.interp(np.arange(len(times)), np.flatnonzero(timed), times[timed])
+    else:
+        times = np.arange(len(times), dtype=np.float64)
+    coords = localCoordinates({field: track[field][located] for field in ('lon', 'lat', 'ele')})
+
+    # ==============================================================
+    # Reduce every run of points in the same zone on its own
+    # ==============================================================
+    zoneOf = np.zeros(len(located)) if zones is None else np.asarray(zones)[located]
+    keptPoints = []
+    for run in np.split(np.arange(len(located)), np.flatnonzero(zoneOf[1:] != zoneOf[:-1]) + 1):
+        runStarts = run[collapseStationary(coords[run], tolerance)]
+        keep = simplifySED(times[runStarts], coords[runStarts], tolerance)
+        keptPoints.append(runStarts[keep])
+    keptPoints = np.concatenate(keptPoints)
+    kept = located[keptPoints]
+
+    # ==============================================================
+    # Each kept point carries the time until the next kept point
+    # ==============================================================
+    keptDurations = np.add.reduceat(durations[located], keptPoints)
+
+    reduced = {field: track[field][kept] for field in ('lon', 'lat', 'ele', 'time', 'hdop')}
+    reduced['name'] = track['name']
+    reduced['vendor'] = {field: values[kept] for field, values in track['vendor'].items()}
+    return reduced, keptDurations
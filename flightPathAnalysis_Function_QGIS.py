@@ -13,8 +13,39 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterMultipleLayers,
                        QgsField,
                        QgsFeature,
-                       QgsVectorLayer)
+                       QgsFeatureRequest,
+                       QgsFeatureSource,
+                       QgsCoordinateReferenceSystem,
+                       QgsCoordinateTransform,
+                       QgsExpression,
+                       QgsFields,
+                       QgsGeometry,
+                       QgsPointXY,
+                       QgsProject,
+                       QgsRectangle,
+                       QgsSpatialIndex,
+                       QgsVectorFileWriter,
+                       QgsVectorLayer,
+                       QgsWkbTypes)
+from .flightPathAnalysis_Function_Rings import (makeDonutBuffers, bufferSegmentationReport,
+                                                dissolveUWR, uwrSourceHashes, uwrBufferedHashes,
+                                                ringPrecisionReport, bufferSegmentsDict,
+                                                openRingCache, ringCacheKey, writeCachedRings, evictRingCache,
+                                                hasUWROverlap, writeUWROverlap, deleteUWRBuffered, uwrOverlapGroups,
+                                                processPool)
+from .flightPathAnalysis_Function_GPX import (loadFlight, readFlightBytes, parseFlight, pointDurations, gpxSources,
+                                              sourceFile, sourceHash, flightName, isoTimes, parseGPXTimes,
+                                              trackFingerprint, findDuplicate, reduceTrack)
+from .flightPathAnalysis_Function_Store import (createPointStore, savePointStore, flightSlices, uwrCode, gridWindow,
+                                                sampleGrid, aglHeights, crsTransformer)
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from osgeo import gdal
 import glob
+import hashlib
+import json
+import math
+import numpy as np
 import os
 import processing
 import datetime
@@ -40,153 +71,1154 @@ def convert_timedelta(duration):
     return seconds
 
 
-def rawBuffer(origFCLoc, origFCName, bufferDistanceInput, bufferDist, projectFolder, unit_no, unit_no_id,
-              uwr_unique_Field):
+def readRepairCache(repairCachePath):
     """
-    (string, string, string, int, string) -> string, string
-    origFCLoc: Folder of feature class to be buffered
-    origFCName: name of feature class or shapefile to be buffered
-    bufferDistanceInput: buffer value and unit. example: "1500 Meters"
-    bufferNumber: buffer value. Use for naming output feature class. Assume units in meters. example: 1500
-    unit_no_Field: field of unit number
-    unit_no_id_Field: field of unit number id
-    uwr_unique_Field: field for unique uwr id made from combining unit number and unit number id
+    (string) -> dict
+    Purpose:
+    Reads the {feature id: wkb hash} of the uwr features repaired in the previous run.
+    Returns an empty dict if there is no cache yet.
+    """
+    if not os.path.isfile(repairCachePath):
+        return {}
+    try:
+        with open(repairCachePath) as cacheFile:
+            return {int(fid): wkbHash for fid, wkbHash in json.load(cacheFile).items()}
+    except (ValueError, OSError):
+        return {}
+
 
+def repairGeometry(geometry):
+    """
+    (QgsGeometry) -> QgsGeometry
     Purpose:
-    Buffers given input feature class or dissolved feature class.
-    Returns names of output GDB and buffer fc name.
-
-    Output: buffered feature class
-
-    """
-    if origFCName.find(".shp") >= 0:
-        origName = replaceNonAlphaNum(origFCName[:origFCName.find(".gpkg")],
-                                      "_")  ###deleted +1 in  origFCName.find(".gpkg")+1
-    else:
-        origName = replaceNonAlphaNum(origFCName, "_")
-
-    rawBuffer = "rawBuffer_" + origName + "_" + str(bufferDist)
-
-    tempBufferLyr = processing.run("native:buffer",
-                                   {'INPUT': os.path.join(origFCLoc, origFCName),
-                                    'DISTANCE': bufferDist, 'SEGMENTS': 90, 'END_CAP_STYLE': 0, 'JOIN_STYLE': 0,
-                                    'MITER_LIMIT': 2,
-                                    'DISSOLVE': False, 'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
-
-    tempBufferLyr_fid_removed = processing.run("native:deletecolumn",
-                                               {'COLUMN': ['fid'],
-                                                'INPUT': tempBufferLyr,
-                                                'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
-    # ===========================================================================
-    # Calculate the uwr_unique_id field value
-    # ===========================================================================
-    bufferLyr = processing.run("native:fieldcalculator",
-                               {'FIELD_LENGTH': 100,
-                                'FIELD_NAME': uwr_unique_Field,
-                                'NEW_FIELD': True,
-                                'FIELD_PRECISION': 0,
-                                'FIELD_TYPE': 2,
-                                'FORMULA': f' "{unit_no}" + \'__\' + "{unit_no_id}" ',
-                                'INPUT': tempBufferLyr_fid_removed,
-                                'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
-    bufferLyrDist = processing.run("native:fieldcalculator",
-                                   {'FIELD_LENGTH': 100,
-                                    'FIELD_NAME': 'BUFF_DIST',
-                                    'NEW_FIELD': True,
-                                    'FIELD_PRECISION': 0,
-                                    'FIELD_TYPE': 0,
-                                    'FORMULA': f"'{bufferDist}'",
-                                    'INPUT': bufferLyr,
-                                    'OUTPUT': os.path.join(projectFolder, rawBuffer)})
-    return projectFolder, rawBuffer
-
-
-def findBufferRange(UseToErasePath, ToErasePath, uniqueIDFields, delFolder, bufferDist):
-    useToEraseLyr = processing.run("native:savefeatures",
-                                   {'INPUT': UseToErasePath,
-                                    'OUTPUT': 'TEMPORARY_OUTPUT',
-                                    'LAYER_NAME': '',
-                                    'DATASOURCE_OPTIONS': '',
-                                    'LAYER_OPTIONS': ''})['OUTPUT']
-    useToEraseLyr_saved = QgsVectorLayer((useToEraseLyr), "", "ogr")
-
-    ToEraseLyr = processing.run("native:savefeatures",
-                                {'INPUT': ToErasePath,
-                                 'OUTPUT': 'TEMPORARY_OUTPUT',
-                                 'LAYER_NAME': '', 'DATASOURCE_OPTIONS': '',
-                                 'LAYER_OPTIONS': ''})['OUTPUT']
-    ToEraseLyr_saved = QgsVectorLayer((ToEraseLyr), "", "ogr")
-
-    # count of features
-    out_count = 0
-
-    # list of erased fc to merge together
-    bufferedFeatures = []
-    bufferedFeatures_delPath = []
-
-    # select unique id in each fc and erase area of second fc from first fc. Creates a fc output
-    for feature in useToEraseLyr_saved.getFeatures():
-        useToEraseLyr_fields = useToEraseLyr_saved.fields().names()
-        uniqueIDFields_Index = [useToEraseLyr_fields.index(uniqueIDFields[0]),
-                                useToEraseLyr_fields.index(uniqueIDFields[1])]
-        unit_no_attribute = feature.attributes()[uniqueIDFields_Index[0]]
-        if type(unit_no_attribute) == int:
-            expression = '(\"' + uniqueIDFields[0] + '\" = ' + str(feature.attributes()[uniqueIDFields_Index[0]]) + ')'
+    Makes an invalid polygon valid, keeping only the polygon parts like native:fixgeometries.
+    """
+    fixed = geometry.makeValid()
+    if QgsWkbTypes.flatType(fixed.wkbType()) == QgsWkbTypes.GeometryCollection:
+        fixed = fixed.convertGeometryCollectionToSubclass(QgsWkbTypes.PolygonGeometry)
+    return fixed
+
+
+def lazyRepair(features, repairCache, repaired, feedback):
+    """
+    (iterable, dict, dict, QgsProcessingFeedback) -> generator
+    features: features of the original uwr layer
+    repairCache: {feature id: wkb hash} of the features repaired in the previous run
+    repaired: filled with {feature id: (wkb hash, repaired geometry)}
+
+    Purpose:
+    Streams the uwr features and repairs only the invalid geometries. A feature repaired in
+    the previous run with the same geometry is repaired again without checking it first.
+    The features are yielded unchanged, with their original geometry.
+    """
+    for feature in features:
+        geometry = feature.geometry()
+        wkbHash = hashlib.sha1(bytes(geometry.asWkb())).hexdigest()
+        if repairCache.get(feature.id()) == wkbHash or not geometry.isGeosValid():
+            repaired[feature.id()] = (wkbHash, repairGeometry(geometry))
+        yield feature
+    feedback.setProgressText(f'{len(repaired)} invalid uwr geometries repaired')
+
+
+def flightTrackIndex(gpxFolder, crs, feedback, chunkVertices=100):
+    """
+    (string, QgsCoordinateReferenceSystem, QgsProcessingFeedback, int) -> QgsSpatialIndex
+    gpxFolder: folder of the gpx files
+    crs: crs of the uwr layer, the track extents are transformed to it
+    chunkVertices: number of track vertices in each indexed extent
+
+    Purpose:
+    Builds a coarse index of the flight tracks: every track line is cut into pieces of
+    chunkVertices vertices and the extent of each piece is indexed. Consecutive pieces share
+    a vertex so the extents cover the whole track.
+    Returns the index, None if no track was found.
+    """
+    trackIndex = QgsSpatialIndex()
+    extentCount = 0
+    for gpxFile in gpxSources(gpxFolder):
+        tkLyr = QgsVectorLayer(gpxFile + '|layername=tracks', "", "ogr")
+        if not tkLyr.isValid():
+            continue
+        transform = QgsCoordinateTransform(tkLyr.crs(), crs, QgsProject.instance())
+        for feature in tkLyr.getFeatures():
+            vertices = list(feature.geometry().vertices())
+            if not vertices:
+                continue
+            for start in range(0, max(1, len(vertices) - 1), chunkVertices - 1):
+                extentCount += 1
+                trackIndex.addFeature(extentCount, transform.transformBoundingBox(
+                    trackExtent(vertices[start:start + chunkVertices])))
+    feedback.setProgressText(f'{extentCount} flight track extents indexed')
+    return trackIndex if extentCount > 0 else None
+
+
+def trackExtent(vertices):
+    """
+    Extent of a list of track vertices
+    """
+    xs = [vertex.x() for vertex in vertices]
+    ys = [vertex.y() for vertex in vertices]
+    return QgsRectangle(min(xs), min(ys), max(xs), max(ys))
+
+
+def nearTracks(features, trackIndex, maxBufferDist, unit_no, unit_no_id, nearUWRSet):
+    """
+    (iterable, QgsSpatialIndex, float, string, string, set) -> generator
+    trackIndex: index of the flight track extents from flightTrackIndex
+    maxBufferDist: largest buffer distance
+    nearUWRSet: filled with the uwr_unique_id of the uwr within maxBufferDist of a track extent
+
+    Purpose:
+    Streams the uwr features and finds the uwr that any flight could come near.
+    The features are yielded unchanged.
+    """
+    for feature in features:
+        extent = feature.geometry().boundingBox()
+        extent.grow(maxBufferDist)
+        if trackIndex.intersects(extent):
+            nearUWRSet.add(f'{feature[unit_no]}__{feature[unit_no_id]}')
+        yield feature
+
+
+def createUWRBuffered(origUWR_source, projectFolder, bufferDistList, unit_no, unit_no_id, uwr_unique_Field,
+                      feedback, workers=1, tolerance=0, segmentReport=False, trackIndex=None, gridSize=0,
+                      ringCacheFolder=None, ringCacheSize=500):
+    """
+    (QgsProcessingFeatureSource, string, list, string, string, string, QgsProcessingFeedback, int, float,
+    bool, QgsSpatialIndex, float, string, int) -> string
+    origUWR_source: feature source of the original uwr layer
+    projectFolder: folder of uwrBuffered
+    bufferDistList: buffer distances. example: [500, 1000, 1500]
+    workers: number of worker processes used to create the rings
+    tolerance: max deviation in meters of the buffer arcs from a true circle, 0 to use 90 segments
+    segmentReport: write bufferSegmentationReport.csv comparing the buffers against 90 segments, and
+                   ringPrecisionReport.csv benchmarking the precision grid if gridSize is given
+    trackIndex: index of the flight track extents, only the uwr within the largest buffer
+                distance of a track are buffered if given
+    gridSize: precision grid in meters of the ring differences, 0 for floating point
+    ringCacheFolder: folder of the ring cache shared between projects, not used if not given
+    ringCacheSize: max size in MB of the rings kept in the ring cache
+
+    Purpose:
+    Step 1 of the analysis. Creates or updates uwrBuffered in the project folder. The source
+    geometries of each uwr are hashed with the buffer settings and compared with the hashes stored
+    in uwrBuffered, so only new or changed uwr are dissolved and buffered. The rows of changed uwr
+    are replaced in place in the existing geopackage. Invalid geometries are repaired per
+    feature, the ids of the repaired features are kept in repairedUWR.json for the next run.
+    With a ring cache, the rings of uwr buffered by any project with the same settings are
+    copied from the cache instead of being buffered again. The rows of uwr that are no longer in
+    the input are deleted. The overlap graph of the uwr rings is kept up to date in the
+    uwrOverlap table of uwrBuffered.
+    Returns the path of uwrBuffered.
+    """
+    uwrBufferedPath = os.path.join(projectFolder, 'uwrBuffered')
+
+    # ==============================================================
+    # Hash the source geometry and buffer settings of every uwr while repairing
+    # only the invalid geometries, and compare with the hashes stored in uwrBuffered
+    # ==============================================================
+    repairCachePath = os.path.join(projectFolder, 'repairedUWR.json')
+    repaired = {}
+    uwrFeatures = lazyRepair(origUWR_source.getFeatures(), readRepairCache(repairCachePath), repaired, feedback)
+    nearUWRSet = set()
+    if trackIndex is not None:
+        uwrFeatures = nearTracks(uwrFeatures, trackIndex, max(bufferDistList), unit_no, unit_no_id, nearUWRSet)
+    uwrHashes, uwrFids = uwrSourceHashes(uwrFeatures, unit_no, unit_no_id, bufferDistList, tolerance, gridSize)
+    with open(repairCachePath, 'w') as cacheFile:
+        json.dump({fid: wkbHash for fid, (wkbHash, _) in repaired.items()}, cacheFile)
+
+    createdHashes = uwrBufferedHashes(uwrBufferedPath, uwr_unique_Field)
+    uwrRequireSet = {uwr for uwr in uwrHashes if createdHashes.get(uwr, '') != uwrHashes[uwr]}
+    if trackIndex is not None:
+        feedback.setProgressText(f'{len(nearUWRSet)} of {len(uwrHashes)} uwr are near a flight track')
+        uwrRequireSet &= nearUWRSet
+    uwrChangedSet = uwrRequireSet & set(createdHashes)
+    feedback.setProgressText(f'{len(uwrHashes)} uwr in the input, {len(createdHashes)} in uwrBuffered')
+    feedback.setProgressText(f'{uwrRequireSet - uwrChangedSet} --new uwr')
+    feedback.setProgressText(f'{uwrChangedSet} --changed uwr')
+
+    # ==============================================================
+    # Drop the uwr deleted from the input, their overlap pairs go with the next writeUWROverlap
+    # ==============================================================
+    removedUWRSet = set(createdHashes) - set(uwrHashes)
+    if removedUWRSet:
+        feedback.setProgressText(f'{removedUWRSet} --removed uwr')
+        deleteUWRBuffered(uwrBufferedPath, uwr_unique_Field, removedUWRSet)
+
+    if len(uwrRequireSet) == 0:
+        feedback.setProgressText('No Need to create uwr buffers')
+        if os.path.isfile(uwrBufferedPath + '.gpkg') and (removedUWRSet or not hasUWROverlap(uwrBufferedPath)):
+            writeUWROverlap(uwrBufferedPath, uwr_unique_Field, feedback, set())
+        return uwrBufferedPath + '.gpkg'
+    rebuiltUWRSet = set(uwrRequireSet)
+
+    # ==============================================================
+    # Copy the uwr found in the shared ring cache, and only buffer the others
+    # ==============================================================
+    ringCache = None
+    cacheKeys = None
+    if ringCacheFolder:
+        ringCache = openRingCache(ringCacheFolder)
+        cacheKeys = {uwr: ringCacheKey(uwrHashes[uwr], origUWR_source.sourceCrs()) for uwr in uwrRequireSet}
+        cachedUWRSet = writeCachedRings(origUWR_source, {uwr: uwrFids[uwr] for uwr in uwrRequireSet}, ringCache,
+                                        cacheKeys, uwrHashes, uwrBufferedPath, uwr_unique_Field, uwrChangedSet,
+                                        feedback)
+        if cachedUWRSet:
+            uwrRequireSet -= cachedUWRSet
+            uwrChangedSet = set()
+
+    uwrBuffered = uwrBufferedPath + '.gpkg'
+    if len(uwrRequireSet) > 0:
+        # ==============================================================
+        # Dissolves the required uwr one uwr at a time, by the feature ids found
+        # when hashing. This is to avoid errors for multi-part uwr that have been
+        # split into separate features in the original uwr feature class.
+        # ==============================================================
+        dissolvedOrig_fid_removed = dissolveUWR(origUWR_source, {uwr: uwrFids[uwr] for uwr in uwrRequireSet},
+                                                repaired, os.path.join(projectFolder, 'dissolve'), feedback, workers)
+
+        # ==============================================================
+        # Create the donut buffers of every buffer distance and the 0m uwr polygon
+        # in one pass per uwr, written straight into uwrBuffered
+        # ==============================================================
+        uwrBuffered = makeDonutBuffers(dissolvedOrig_fid_removed, bufferDistList, unit_no, unit_no_id,
+                                       uwr_unique_Field, uwrBufferedPath, feedback, workers, tolerance, uwrHashes,
+                                       uwrChangedSet, gridSize, ringCache, cacheKeys)
+        if segmentReport:
+            bufferSegmentationReport(dissolvedOrig_fid_removed, bufferDistList, tolerance,
+                                     os.path.join(projectFolder, 'bufferSegmentationReport.csv'), feedback)
+            if gridSize:
+                ringPrecisionReport(dissolvedOrig_fid_removed, bufferDistList,
+                                    bufferSegmentsDict(bufferDistList, tolerance), gridSize,
+                                    os.path.join(projectFolder, 'ringPrecisionReport.csv'), feedback)
+
+    if ringCache is not None:
+        evictRingCache(ringCache, ringCacheSize * 1024 * 1024, feedback)
+        ringCache.close()
+
+    # ==============================================================
+    # Store which uwr have overlapping rings in the uwrOverlap table of uwrBuffered
+    # ==============================================================
+    writeUWROverlap(uwrBufferedPath, uwr_unique_Field, feedback, rebuiltUWRSet)
+    return uwrBuffered
+
+
+def uwrTiles(uwrLayer, uwr_unique_Field, tileSize):
+    """
+    (QgsVectorLayer, string, float) -> dict
+    Purpose:
+    Assigns every uwr to the square tile of tileSize that holds the centre of the extent of all
+    its rings, so the rings of an uwr are never split between tiles.
+    Returns {(column, row): [uwr extent, [uwr_unique_id]]}
+    """
+    uwrExtents = {}
+    for feature in uwrLayer.getFeatures():
+        uwr = f'{feature[uwr_unique_Field]}'
+        extent = feature.geometry().boundingBox()
+        if uwr in uwrExtents:
+            uwrExtents[uwr].combineExtentWith(extent)
         else:
-            expression = '(\"' + uniqueIDFields[0] + '\" = \'' + str(
-                feature.attributes()[uniqueIDFields_Index[0]]) + "')"
-        countField = len(uniqueIDFields)
-        if countField > 1:
-            for i in range(1, countField):
-                if type(feature.attributes()[uniqueIDFields_Index[i]]) == int:
-                    expression += 'AND (\"' + uniqueIDFields[i] + '\" = ' + str(
-                        feature.attributes()[uniqueIDFields_Index[i]]) + ')'
-                else:
-                    expression += 'AND (\"' + uniqueIDFields[i] + '\" = \'' + str(
-                        feature.attributes()[uniqueIDFields_Index[i]]) + "')"
+            uwrExtents[uwr] = extent
+
+    tiles = {}
+    for uwr, extent in uwrExtents.items():
+        centre = extent.center()
+        tileKey = (int(centre.x() // tileSize), int(centre.y() // tileSize))
+        if tileKey in tiles:
+            tiles[tileKey][0].combineExtentWith(extent)
+            tiles[tileKey][1].append(uwr)
+        else:
+            tiles[tileKey] = [QgsRectangle(extent), [uwr]]
+    return tiles
 
-        out_count += 1
 
-        useToEraseLyr_selected = processing.run("native:extractbyexpression",
-                                                {'EXPRESSION': expression,
-                                                 'INPUT': useToEraseLyr,
-                                                 'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
+def tiledJoin(pointsLayer, uwrLayerPath, uwr_unique_Field, tileSize, delFolder, outputName, feedback):
+    """
+    (QgsVectorLayer, string, string, float, string, string, QgsProcessingFeedback) -> string
+    pointsLayer: flight points to classify
+    uwrLayerPath: uwr buffer rings to join to the flight points
+    tileSize: size in meters of the square tiles
+    outputName: name of the joined layer in delFolder
 
-        ToEraseLyr_selected = processing.run("native:extractbyexpression",
-                                             {'EXPRESSION': expression,
-                                              'INPUT': ToEraseLyr,
-                                              'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
-        outFCFolder = os.path.join(delFolder, 'out_features')
-        if not os.path.exists(outFCFolder):
-            try:
-                os.mkdir(outFCFolder)
-            except:
+    Purpose:
+    Runs the spatial join of the flight points with the uwr buffer rings tile by tile. Each uwr
+    belongs to one tile, and the points of a tile are taken from the extent of the rings of its
+    uwr, which already includes the largest buffer distance, through the spatial index of the
+    points. Every point and ring pair is joined in exactly one tile, so the stitched result has no
+    duplicates.
+    Returns the path of the joined layer, like native:joinattributesbylocation; the layer is empty
+    when no tile was joined, eg. without uwr or after a cancel.
+    """
+    if isinstance(pointsLayer, str):
+        pointsLayer = QgsVectorLayer(pointsLayer, "", "ogr")
+    uwrLayer = QgsVectorLayer(uwrLayerPath, "", "ogr")
+    tiles = uwrTiles(uwrLayer, uwr_unique_Field, tileSize)
+    feedback.setProgressText(f'Joining flight points in {len(tiles)} tiles of {tileSize}m')
+    if pointsLayer.hasSpatialIndex() != QgsFeatureSource.SpatialIndexPresent:
+        pointsLayer.dataProvider().createSpatialIndex()
+    transform = QgsCoordinateTransform(uwrLayer.crs(), pointsLayer.crs(), QgsProject.instance())
+
+    tileJoins = []
+    for tileNumber, (tileKey, (extent, uwrList)) in enumerate(sorted(tiles.items())):
+        if feedback.isCanceled():
+            break
+        tileUWR = processing.run("native:extractbyexpression",
+                                 {'EXPRESSION': uwr_unique_Field + " in ('" + "','".join(uwrList) + "')",
+                                  'INPUT': uwrLayerPath,
+                                  'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
+        tileRequest = QgsFeatureRequest().setFilterRect(transform.transformBoundingBox(extent))
+        tilePoints = pointsLayer.materialize(tileRequest)
+        if tilePoints.featureCount() == 0:
+            continue
+        tileJoin = processing.run("native:joinattributesbylocation",
+                                  {'INPUT': tilePoints,
+                                   'PREDICATE': [0],
+                                   'JOIN': tileUWR,
+                                   'JOIN_FIELDS': [],
+                                   'METHOD': 0,
+                                   'DISCARD_NONMATCHING': True,
+                                   'PREFIX': '',
+                                   'OUTPUT': os.path.join(delFolder, f'tileJoin_{tileNumber}')})['OUTPUT']
+        tileJoins.append(tileJoin)
+        feedback.setProgressText(f'Tile {tileKey}: {len(uwrList)} uwr joined')
+
+    if not tileJoins:
+        return emptyJoin(pointsLayer, uwrLayer, os.path.join(delFolder, outputName))
+
+    # ==============================================================
+    # Stitch the tiles together, without the layer and path fields added by the merge
+    # ==============================================================
+    tileMerge = processing.run("native:mergevectorlayers",
+                               {'LAYERS': tileJoins,
+                                'CRS': None,
+                                'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
+    return processing.run("native:deletecolumn",
+                          {'COLUMN': ['layer', 'path', 'fid'],
+                           'INPUT': tileMerge,
+                           'OUTPUT': os.path.join(delFolder, outputName)})['OUTPUT']
+
+
+def emptyJoin(pointsLayer, uwrLayer, outputPath):
+    """
+    (QgsVectorLayer, QgsVectorLayer, string) -> string
+    Purpose:
+    Writes a join of the flight points with the uwr rings that has no features, with the fields
+    native:joinattributesbylocation would give it.
+    Returns the path of the geopackage
+    """
+    fields = QgsFields()
+    for field in pointsLayer.fields():
+        if field.name() != 'fid':
+            fields.append(field)
+    for field in uwrLayer.fields():
+        if field.name() == 'fid':
+            continue
+        joinField = QgsField(field)
+        if fields.indexOf(field.name()) >= 0:
+            joinField.setName(field.name() + '_2')
+        fields.append(joinField)
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = 'GPKG'
+    options.layerName = os.path.basename(outputPath)
+    writer = QgsVectorFileWriter.create(outputPath + '.gpkg', fields, pointsLayer.wkbType(), pointsLayer.crs(),
+                                        QgsProject.instance().transformContext(), options)
+    del writer
+    return outputPath + '.gpkg'
+
+
+def groupFlightPoints(uwrBufferedPath, uwrSet, allFlightPoints, uwr_unique_Field, delFolder, feedback):
+    """
+    (string, set, string, string, string, QgsProcessingFeedback) -> dict
+    uwrBufferedPath: uwrBuffered geopackage holding the uwrOverlap table
+    uwrSet: uwr_unique_id of the uwr to analyse
+    allFlightPoints: flight points joined with the uwr rings
+
+    Purpose:
+    Extracts the flight points of each group of overlapping uwr once, so the points of each
+    uwr are then selected from its group instead of from all the flight points.
+    Returns {uwr_unique_id: flight points layer to select the points of the uwr from}
+    """
+    uwrPoints = {}
+    uwrGroups = uwrOverlapGroups(uwrBufferedPath, uwr_unique_Field, uwrSet)
+    feedback.setProgressText(f'{len(uwrSet)} uwr in {len(uwrGroups)} groups of overlapping uwr')
+    for groupNumber, uwrGroup in enumerate(uwrGroups):
+        if len(uwrGroup) == 1:
+            uwrPoints[uwrGroup[0]] = allFlightPoints
+            continue
+        groupPoints = processing.run("native:extractbyexpression",
+                                     {'EXPRESSION': uwr_unique_Field + " in ('" + "','".join(uwrGroup) + "')",
+                                      'INPUT': allFlightPoints,
+                                      'OUTPUT': os.path.join(delFolder, f'groupFlightPoints_{groupNumber}')})['OUTPUT']
+        for uwr in uwrGroup:
+            uwrPoints[uwr] = groupPoints
+    return uwrPoints
+
+
+def uwrRingIndex(uwrBufferedPath):
+    """
+    (string) -> QgsSpatialIndex, dict, dict
+    Purpose:
+    Indexes the uwr buffer rings for the points of the season point store. The ring geometries are
+    transformed from the crs of the layer to EPSG:3005, the crs of the store.
+    Returns the spatial index of the rings, {fid: ring feature} and {fid: EPSG:3005 ring geometry}
+    """
+    ringLayer = QgsVectorLayer(uwrBufferedPath, "", "ogr")
+    transform = QgsCoordinateTransform(ringLayer.crs(), QgsCoordinateReferenceSystem('EPSG:3005'),
+                                       QgsProject.instance())
+    ringIndex = QgsSpatialIndex()
+    rings = {}
+    ringGeometries = {}
+    for feature in ringLayer.getFeatures():
+        if not feature.hasGeometry():
+            continue
+        geometry = QgsGeometry(feature.geometry())
+        geometry.transform(transform)
+        ringIndex.addFeature(feature.id(), geometry.boundingBox())
+        rings[feature.id()] = feature
+        ringGeometries[feature.id()] = geometry
+    return ringIndex, rings, ringGeometries
+
+
+def segmentIncursionTimes(store, uwrBufferedPath, unit_no, unit_no_id, uwr_unique_Field, incursionSeverity,
+                          statsPath, feedback, maxAGL=500):
+    """
+    (dict, string, string, string, string, dict, string, QgsProcessingFeedback, float) -> string
+    store: season point store with the AGL of the points, from sampleStoreDEM
+    uwrBufferedPath: uwr buffer rings, in any crs
+    incursionSeverity: {buffer distance: incursion severity}
+    statsPath: xlsx file of the statistics, without extension
+    maxAGL: only the segments starting below this height above ground are counted
+
+    Purpose:
+    Times the incursions of the flights by segments instead of by points. Every flight is a polyline
+    through its points in time order, the segment from a point to the next one being flown in the
+    duration of the point. The segments are intersected with the uwr rings; the time spent in a ring
+    is the share of the segment length inside it, ie. the time between the ring entry and exit
+    interpolated at constant speed along the segment. A segment without length counts fully in the
+    rings its point is in. This stays exact for sparse logs where counting points doesn't.
+    The points of the store are read a flight at a time. The uwr and ring of the innermost ring the
+    start point of a segment is in are recorded in the store.
+    Returns the path of the statistics, the TotalIncursionTime of every flight, uwr, ring and height range
+    """
+    # ==============================================================
+    # Index the uwr rings, in the EPSG:3005 of the store
+    # ==============================================================
+    ringIndex, rings, ringGeometries = uwrRingIndex(uwrBufferedPath)
+    engines = {}
+
+    # ==============================================================
+    # Segments of every flight, from its points in time order
+    # ==============================================================
+    columns = store['columns']
+    totals = {}
+    segmentCount = 0
+    for flightIndex, points in flightSlices(store):
+        flight = store['flights'][flightIndex]
+        order = np.argsort(columns['time'][points], kind='stable') + points.start
+        x = columns['x'][order]
+        y = columns['y'][order]
+        durations = columns['duration'][order]
+        agls = columns['AGL'][order]
+        for position in range(len(order) - 1):
+            duration = float(durations[position])
+            agl = float(agls[position])
+            if math.isnan(agl) or duration <= 0 or agl >= maxAGL:
                 continue
-        out_features = os.path.join(outFCFolder , 'outFeature' + str(out_count) + '__' + str(bufferDist))
-        processing.run("native:difference", {'INPUT': ToEraseLyr_selected,
-                                             'OVERLAY': useToEraseLyr_selected,
-                                             'OUTPUT': out_features, 'GRID_SIZE': None})
-
-        bufferedFeatures.append(out_features + '.gpkg')
-        #bufferedFeatures_delPath.append(out_features + '.gpkg')
-
-    projectFolder = os.path.split(delFolder)[0]
-    # merge all outputs
-    outputPath = os.path.join(projectFolder, 'rawBuffer_' + str(bufferDist) + 'only')
-    output = processing.run("native:mergevectorlayers", {'LAYERS': bufferedFeatures,
-                                                         'OUTPUT': outputPath})['OUTPUT']
-
-    for fname in os.listdir(outFCFolder):
-        if fname.startswith('outFeature'):
-            try:
-                os.remove(os.path.join(outFCFolder, fname))
-            except:
+            segmentCount += 1
+            startPoint = QgsPointXY(x[position], y[position])
+            segment = QgsGeometry.fromPolylineXY([startPoint, QgsPointXY(x[position + 1], y[position + 1])])
+            segmentLength = segment.length()
+            if segmentLength == 0:
+                segment = QgsGeometry.fromPointXY(startPoint)
+            startGeometry = QgsGeometry.fromPointXY(startPoint)
+            heightRange = '0 to 400m' if agl < 400 else '400 to 500m'
+
+            startRing = None
+            for ringFid in ringIndex.intersects(segment.boundingBox()):
+                ring = rings[ringFid]
+                if ringFid not in engines:
+                    engines[ringFid] = QgsGeometry.createGeometryEngine(ringGeometries[ringFid].constGet())
+                    engines[ringFid].prepareGeometry()
+                if not engines[ringFid].intersects(segment.constGet()):
+                    continue
+                if segmentLength > 0:
+                    share = ringGeometries[ringFid].intersection(segment).length() / segmentLength
+                else:
+                    share = 1
+                key = (flight['FlightName'], flight['NameTkline'], flight['TotalTime'], heightRange,
+                       f'{ring[unit_no]}', f'{ring[unit_no_id]}', f'{ring[uwr_unique_Field]}', ring['BUFF_DIST'],
+                       incursionSeverity.get(int(ring['BUFF_DIST']), ''))
+                totals[key] = totals.get(key, 0) + share * duration
+                if (startRing is None or ring['BUFF_DIST'] < startRing['BUFF_DIST']) and \
+                        engines[ringFid].intersects(startGeometry.constGet()):
+                    startRing = ring
+            if startRing is not None:
+                columns['uwr'][order[position]] = uwrCode(store, f'{startRing[uwr_unique_Field]}')
+                columns['ring'][order[position]] = startRing['BUFF_DIST']
+        if feedback.isCanceled():
+            break
+    savePointStore(store)
+    feedback.setProgressText(f'{segmentCount} flight segments below {maxAGL}m timed against the uwr rings')
+
+    # ==============================================================
+    # Write the statistics
+    # ==============================================================
+    fields = QgsFields()
+    for name, fieldType in (('FlightName', QVariant.String), ('NameTkline', QVariant.String),
+                            ('TotalTime', QVariant.Double), ('HeightRange', QVariant.String),
+                            (unit_no, QVariant.String), (unit_no_id, QVariant.String),
+                            (uwr_unique_Field, QVariant.String), ('BUFF_DIST', QVariant.Double),
+                            ('IncursionSeverity', QVariant.String), ('TotalIncursionTime', QVariant.Double)):
+        fields.append(QgsField(name, fieldType))
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = 'XLSX'
+    writer = QgsVectorFileWriter.create(statsPath + '.xlsx', fields, QgsWkbTypes.NoGeometry,
+                                        QgsCoordinateReferenceSystem(), QgsProject.instance().transformContext(),
+                                        options)
+    for key in sorted(totals, key=str):
+        feature = QgsFeature(fields)
+        feature.setAttributes(list(key) + [round(totals[key], 2)])
+        writer.addFeature(feature)
+    del writer
+    return statsPath + '.xlsx'
+
+
+def iterFlights(gpxFiles, workers, feedback, prefetch=0):
+    """
+    (list, int, QgsProcessingFeedback, int) -> generator
+    gpxFiles: gpx files to read
+    workers: number of worker processes, 1 reads the files in this process, as does a pool that
+    processPool can't start
+    prefetch: number of files read ahead by reader threads when the files are read in this process,
+    0 reads each file when it's needed
+
+    Purpose:
+    Yields [gpxFile, track] for every gpx file in the order of gpxFiles, track being the
+    columns returned by parseFlight. With more than one worker the files are parsed in a process
+    pool; at most workers * 2 files are read ahead of the one yielded.
+    With prefetch, reader threads read the upcoming files while the earlier ones are parsed and
+    written, so reading from a slow disk overlaps the processing. At most prefetch files are held
+    in memory ahead of the one yielded.
+    """
+    pool = processPool(workers, feedback) if workers > 1 else None
+    if pool is None:
+        workers = 1
+
+    if workers <= 1 and prefetch <= 0:
+        for gpxFile in gpxFiles:
+            yield gpxFile, loadFlight(gpxFile)
+        return
+
+    if workers <= 1:
+        feedback.setProgressText(f'Reading {len(gpxFiles)} gpx files with {prefetch} files read ahead')
+        with ThreadPoolExecutor(max_workers=prefetch) as readers:
+            inFlight = deque()
+            for gpxFile in gpxFiles:
+                inFlight.append((gpxFile, readers.submit(readFlightBytes, gpxFile)))
+                if len(inFlight) > prefetch:
+                    readFile, future = inFlight.popleft()
+                    yield readFile, parseFlight(future.result())
+                if feedback.isCanceled():
+                    readers.shutdown(cancel_futures=True)
+                    return
+            while inFlight:
+                readFile, future = inFlight.popleft()
+                yield readFile, parseFlight(future.result())
+        return
+
+    feedback.setProgressText(f'Reading {len(gpxFiles)} gpx files with {workers} workers')
+    with pool:
+        inFlight = deque()
+        for gpxFile in gpxFiles:
+            inFlight.append((gpxFile, pool.submit(loadFlight, gpxFile)))
+            if len(inFlight) >= workers * 2:
+                readFile, future = inFlight.popleft()
+                yield readFile, future.result()
+            if feedback.isCanceled():
+                pool.shutdown(cancel_futures=True)
+                return
+        while inFlight:
+            readFile, future = inFlight.popleft()
+            yield readFile, future.result()
+
+
+def openFlightTables(ingestFolder):
+    """
+    (string) -> QgsVectorLayer, QgsVectorLayer
+    ingestFolder: folder of the season flight tables
+
+    Purpose:
+    Opens the flightPoints and flightLines tables of flightPoints.gpkg, the points and lines of
+    all the flights of the season. The rows of a flight are keyed by the FlightSource field, the gpx
+    file they were converted from. Missing tables, and tables without FlightSource, are created.
+    Returns the flight points and flight lines layers, and if any table was created
+    """
+    tablePath = os.path.join(ingestFolder, 'flightPoints.gpkg')
+    pointFields = QgsFields()
+    pointFields.append(QgsField('ele', QVariant.Double))
+    pointFields.append(QgsField('time', QVariant.String, len=25))
+    pointFields.append(QgsField('hdop', QVariant.Double))
+    pointFields.append(QgsField('NameTkline', QVariant.String, len=30))
+    pointFields.append(QgsField('FlightName', QVariant.String, len=100))
+    pointFields.append(QgsField('TotalTime', QVariant.Double))
+    pointFields.append(QgsField('TInterval', QVariant.Double))
+    pointFields.append(QgsField('FlightSource', QVariant.String))
+    lineFields = QgsFields()
+    lineFields.append(QgsField('Name', QVariant.String, len=100))
+    lineFields.append(QgsField('FlightName', QVariant.String, len=100))
+    lineFields.append(QgsField('FlightSource', QVariant.String))
+
+    layers = []
+    created = False
+    for layerName, fields, wkbType in (('flightPoints', pointFields, QgsWkbTypes.Point),
+                                       ('flightLines', lineFields, QgsWkbTypes.LineString)):
+        layer = QgsVectorLayer(tablePath + f'|layername={layerName}', layerName, "ogr")
+        if not layer.isValid() or layer.fields().indexOf('FlightSource') < 0:
+            created = True
+            options = QgsVectorFileWriter.SaveVectorOptions()
+            options.driverName = 'GPKG'
+            options.layerName = layerName
+            if os.path.isfile(tablePath):
+                options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+            writer = QgsVectorFileWriter.create(tablePath, fields, wkbType, QgsCoordinateReferenceSystem('EPSG:4326'),
+                                                QgsProject.instance().transformContext(), options)
+            del writer
+            layer = QgsVectorLayer(tablePath + f'|layername={layerName}', layerName, "ogr")
+        layers.append(layer)
+    return layers, created
+
+
+def deleteFlight(flightTables, gpxFile):
+    """
+    Deletes the points and line of the flight of a gpx file from the season flight tables
+    """
+    request = QgsFeatureRequest().setFilterExpression(f'"FlightSource" = {QgsExpression.quotedValue(gpxFile)}')
+    request.setFlags(QgsFeatureRequest.NoGeometry).setNoAttributes()
+    for layer in flightTables:
+        layer.dataProvider().deleteFeatures([feature.id() for feature in layer.getFeatures(request)])
+
+
+def writeFlight(flightTables, gpxFile, gpxFormattedName, tkLyrName, track, durations):
+    """
+    (list, string, string, string, dict, numpy array) -> float
+    flightTables: flight points and flight lines layers from openFlightTables
+    gpxFile: gpx file of the flight, written as the FlightSource of its rows
+    track: columns returned by parseFlight
+    durations: time (s) flown from every point to the next one
+
+    Purpose:
+    Appends the points of a flight, with the NameTkline, FlightName, TotalTime, TInterval and
+    FlightSource fields and the vendor fields of the gpx, and the flight line to the season flight tables. The points
+    are added in one batch, which the geopackage writes in a single transaction. Vendor fields not
+    in the points table yet are added to it. Points without a position aren't written, TotalTime is
+    the sum of the TInterval of the written points.
+    Returns the TotalTime of the flight
+    """
+    pointsLayer, linesLayer = flightTables
+    provider = pointsLayer.dataProvider()
+    newFields = [QgsField(field, QVariant.Double) for field in track['vendor'] if provider.fields().indexOf(field) < 0]
+    if newFields:
+        provider.addAttributes(newFields)
+        pointsLayer.updateFields()
+    fields = pointsLayer.fields()
+
+    # ==============================================================
+    # Attribute columns in the order of the table fields, missing values as None
+    # ==============================================================
+    pointCount = len(track['time'])
+    located = ~(np.isnan(track['lon']) | np.isnan(track['lat']))
+    totalTime = float(durations[located].sum())
+    columns = {'ele': track['ele'], 'time': isoTimes(track['time']), 'hdop': track['hdop'],
+               'NameTkline': [tkLyrName] * pointCount, 'FlightName': [gpxFormattedName] * pointCount,
+               'TotalTime': [totalTime] * pointCount, 'TInterval': durations,
+               'FlightSource': [gpxFile] * pointCount}
+    columns.update(track['vendor'])
+    emptyColumn = [None] * pointCount
+    rows = zip(*[columns.get(field.name(), emptyColumn) for field in fields if field.name() != 'fid'])
+    hasFid = fields.indexOf('fid') >= 0
+
+    features = []
+    vertices = []
+    for lon, lat, isLocated, row in zip(track['lon'], track['lat'], located, rows):
+        if not isLocated:
+            continue
+        feature = QgsFeature(fields)
+        feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(lon, lat)))
+        attributes = [None if isinstance(value, float) and math.isnan(value) else value for value in row]
+        feature.setAttributes([None] + attributes if hasFid else attributes)
+        features.append(feature)
+        vertices.append(QgsPointXY(lon, lat))
+    provider.addFeatures(features)
+
+    if len(vertices) > 1:
+        line = QgsFeature(linesLayer.fields())
+        line.setGeometry(QgsGeometry.fromPolylineXY(vertices))
+        line['Name'] = tkLyrName
+        line['FlightName'] = gpxFormattedName
+        line['FlightSource'] = gpxFile
+        linesLayer.dataProvider().addFeatures([line])
+    return totalTime
+
+
+def readManifest(manifestPath):
+    """
+    (string) -> dict
+    Purpose:
+    Reads the {gpx file: flight entry} of the gpx files converted in the previous runs.
+    Returns an empty dict if there is no manifest yet.
+    """
+    if not os.path.isfile(manifestPath):
+        return {}
+    try:
+        with open(manifestPath) as manifestFile:
+            return json.load(manifestFile)
+    except (ValueError, OSError):
+        return {}
+
+
+def unchangedFlight(gpxFile, manifest, settings):
+    """
+    (string, dict, dict) -> dict
+    Purpose:
+    Looks up the manifest entry of a gpx file converted in a previous run. The entry is reused if
+    the file, or the archive it's in, has the same size and mtime, or the flight has the same content
+    hash when only they changed, and it was converted with the same settings.
+    Returns the entry, None if the file has to be converted.
+    """
+    entry = manifest.get(gpxFile)
+    if entry is None or entry.get('settings') != settings or 'flight' not in entry:
+        return None
+    fileStat = os.stat(sourceFile(gpxFile))
+    if fileStat.st_size != entry['size'] or fileStat.st_mtime != entry['mtime']:
+        if sourceHash(gpxFile) != entry['sha1']:
+            return None
+        entry['size'] = fileStat.st_size
+        entry['mtime'] = fileStat.st_mtime
+    return entry
+
+
+def openReduceZones(uwrBufferedPath, demPath):
+    """
+    (string, string) -> dict
+    Purpose:
+    Opens the uwr rings and the DEM that trackZones splits the flights into zones with.
+    Returns the zones: {'ringIndex', 'ringGeometries', 'engines', 'dem', 'settings'}, settings
+    identifying the version of the rings and the DEM for the gpx manifest
+    """
+    ringIndex, rings, ringGeometries = uwrRingIndex(uwrBufferedPath)
+    settings = []
+    for path in (uwrBufferedPath, demPath):
+        filePath = path.split('|')[0]
+        fileStat = os.stat(filePath) if os.path.isfile(filePath) else None
+        settings.append([path, fileStat.st_size if fileStat else None, fileStat.st_mtime if fileStat else None])
+    return {'ringIndex': ringIndex, 'ringGeometries': ringGeometries, 'engines': {}, 'dem': gdal.Open(demPath),
+            'settings': settings}
+
+
+def trackZones(track, reduceZones):
+    """
+    (dict, dict) -> numpy array
+    track: columns returned by parseFlight
+    reduceZones: uwr rings and DEM from openReduceZones
+
+    Purpose:
+    Zone of every point of a flight for reduceTrack: the uwr rings the point is in and its height
+    band, below 400m, 400 to 500m, 500m and more above the DEM or without a DEM value. Reducing the
+    flight inside these zones keeps the incursion time of every uwr, ring and height range.
+    Returns the zone numbers, -1 for the points without a position
+    """
+    x, y = crsTransformer('EPSG:4326', 'EPSG:3005')(track['lon'], track['lat'])
+    agls = aglHeights(track['ele'], demValues(reduceZones['dem'], x, y))
+    heightBands = np.select([np.isnan(agls), agls < 400, agls < 500], [3, 0, 1], 2)
+    engines = reduceZones['engines']
+    zoneNumbers = {}
+    zones = np.full(len(x), -1)
+    for index in np.flatnonzero(~(np.isnan(x) | np.isnan(y))):
+        point = QgsGeometry.fromPointXY(QgsPointXY(x[index], y[index]))
+        ringFids = []
+        for ringFid in reduceZones['ringIndex'].intersects(point.boundingBox()):
+            if ringFid not in engines:
+                engines[ringFid] = QgsGeometry.createGeometryEngine(reduceZones['ringGeometries'][ringFid].constGet())
+                engines[ringFid].prepareGeometry()
+            if engines[ringFid].intersects(point.constGet()):
+                ringFids.append(ringFid)
+        zones[index] = zoneNumbers.setdefault((tuple(sorted(ringFids)), int(heightBands[index])), len(zoneNumbers))
+    return zones
+
+
+def convertGPXFiles(gpxFiles, ingestFolder, feedback, workers=1, maxGap=0, skipDuplicates=True, reduceTolerance=0,
+                    prefetch=0, uwrBufferedPath=None, demPath=None):
+    """
+    (list, string, QgsProcessingFeedback, int, float, bool, float, int, string, string)
+    -> string, string, float, list, list
+    gpxFiles: gpx files of the season
+    ingestFolder: folder of the season flight tables and of the gpxManifest.json, kept between runs
+    workers: number of worker processes reading the gpx files
+    maxGap: longest time (s) between two points counted as flight time, 0 for no limit
+    skipDuplicates: leave the copies of a flight out of the season tables, they are reported either way
+    reduceTolerance: position error (m) allowed when reducing the flight points with reduceTrack,
+    0 keeps every point
+    prefetch: number of gpx files read ahead by reader threads, see iterFlights
+    uwrBufferedPath, demPath: uwr rings and DEM the reduced flights keep their crossings of, see trackZones
+
+    Purpose:
+    Converts every gpx file into flight points with the NameTkline, FlightName, TotalTime and
+    TInterval fields, and a flight line, appended to the season flight tables of flightPoints.gpkg.
+    TInterval is the time flown from the point to the next one, TotalTime is the sum of them.
+    The gpx files are read by iterFlights, the flights are written here one at a time.
+    The converted flights are recorded in the manifest of ingestFolder by path, size, mtime and
+    content hash; the flights of the files unchanged since a previous run are kept in the tables
+    without reading the files, the flights of the files no longer in gpxFiles are deleted.
+    Every flight is fingerprinted, a flight uploaded twice, under another name or trimmed, is
+    found by findDuplicate before it's written; the first flight read is kept.
+    With a reduceTolerance, hovering and straight flight are reduced to fewer points, each carrying
+    the duration of the points it stands for. Given the uwr rings and the DEM, points aren't merged
+    across rings or height ranges, so the incursion times are unchanged; the flights are converted
+    again when the rings or the DEM change.
+    Returns the flight points and flight lines tables, totalSeasonTime - total flight time in
+    the season, checkFilesList - gpx files without times and duplicateList - [gpx file, gpx file
+    it's a copy of] of the duplicate flights
+    """
+    totalSeasonTime = 0
+    checkFilesList = []
+    duplicateList = []
+    fingerprints = {}
+    settings = {'maxGap': maxGap, 'skipDuplicates': skipDuplicates, 'reduceTolerance': reduceTolerance}
+    reduceZones = None
+    if reduceTolerance > 0 and uwrBufferedPath and demPath:
+        reduceZones = openReduceZones(uwrBufferedPath, demPath)
+        settings['reduceZones'] = reduceZones['settings']
+
+    # ==============================================================
+    # Reuse the flights converted in the previous runs, the manifest is only valid with its tables
+    # ==============================================================
+    manifestPath = os.path.join(ingestFolder, 'gpxManifest.json')
+    tablePath = os.path.join(ingestFolder, 'flightPoints.gpkg')
+    flightTables, created = openFlightTables(ingestFolder)
+    manifest = {} if created else readManifest(manifestPath)
+    readFiles = []
+    gpxFileSet = set(gpxFiles)
+    for gpxFile in gpxFiles:
+        entry = unchangedFlight(gpxFile, manifest, settings)
+        if entry is not None and entry.get('duplicateOf') and entry['duplicateOf'] not in gpxFileSet:
+            entry = None
+        if entry is None:
+            readFiles.append(gpxFile)
+            continue
+        if entry.get('duplicateOf'):
+            duplicateList.append([gpxFile, entry['duplicateOf']])
+        if entry['flight'] is not None:
+            totalSeasonTime += entry['totalTime']
+            if entry.get('fingerprint'):
+                fingerprints[gpxFile] = entry['fingerprint']
+        elif not entry.get('duplicateOf'):
+            checkFilesList.append(gpxFile)
+    for gpxFile in set(manifest) - gpxFileSet:
+        if manifest[gpxFile].get('flight'):
+            deleteFlight(flightTables, gpxFile)
+        del manifest[gpxFile]
+    feedback.setProgressText(f'{len(gpxFiles) - len(readFiles)} gpx files unchanged since the last run, '
+                             f'{len(readFiles)} to convert')
+
+    for flightCount, (gpxFile, track) in enumerate(iterFlights(readFiles, workers, feedback, prefetch), 1):
+        feedback.setProgressText(f'{str(flightCount)}: {str(gpxFile)}')
+        gpxFormattedName = replaceNonAlphaNum(flightName(gpxFile), '_')
+        feedback.setProgressText(f'{gpxFormattedName}')
+
+        rowCount = len(track['time'])
+        tkLyrName = str(track['name'])
+        feedback.setProgressText(f'{tkLyrName}')
+        feedback.setProgressText(f'{rowCount}')
+
+        # ==============================================================
+        # Drop the flight of the previous version of the file
+        # ==============================================================
+        deleteFlight(flightTables, gpxFile)
+        fileStat = os.stat(sourceFile(gpxFile))
+        entry = {'size': fileStat.st_size, 'mtime': fileStat.st_mtime, 'sha1': track['sha1'],
+                 'settings': settings, 'flight': None}
+        manifest[gpxFile] = entry
+
+        # ==============================================================
+        # Time flown from every point to the next one, flights with less than two timed points are
+        # written to the problem file
+        # ==============================================================
+        durations = pointDurations(track, maxGap)
+        if durations is None:
+            checkFilesList.append(gpxFile)
+            continue
+        # ==============================================================
+        # Check if the flight is a copy of a flight already in the season
+        # ==============================================================
+        fingerprint = trackFingerprint(track)
+        duplicateOf = findDuplicate(track, fingerprint, fingerprints) if fingerprint else None
+        if duplicateOf is not None:
+            duplicateList.append([gpxFile, duplicateOf])
+            entry['duplicateOf'] = duplicateOf
+            feedback.setProgressText(f'{gpxFormattedName} is a duplicate of {duplicateOf}')
+            if skipDuplicates:
                 continue
+        elif fingerprint:
+            fingerprints[gpxFile] = fingerprint
+
+        # ===========================================================================
+        # Reduce the dense flight logs, and append the flight points and the flight line to the season tables
+        # ===========================================================================
+        if reduceTolerance > 0:
+            zones = trackZones(track, reduceZones) if reduceZones else None
+            track, durations = reduceTrack(track, durations, reduceTolerance, zones)
+            feedback.setProgressText(f'{rowCount} points reduced to {len(durations)}')
+        totalFlightTime = writeFlight(flightTables, gpxFile, gpxFormattedName, tkLyrName, track, durations)
+        feedback.setProgressText(f'Flight {gpxFormattedName} appended')
+        feedback.setProgressText(f'The total flight time of {gpxFormattedName} is {totalFlightTime} seconds')
+
+        # ===========================================================================
+        # Get season time sum
+        # ===========================================================================
+        totalSeasonTime += totalFlightTime
+        entry.update(flight=gpxFormattedName, totalTime=totalFlightTime, fingerprint=fingerprint)
+        feedback.setProgressText(f'===========================================')
+
+    with open(manifestPath, 'w') as manifestFile:
+        json.dump(manifest, manifestFile)
+    return (tablePath + '|layername=flightPoints', tablePath + '|layername=flightLines',
+            totalSeasonTime, checkFilesList, duplicateList)
+
+
+def buildPointStore(flightPoints, storeFolder, feedback, chunkSize=100000):
+    """
+    (string, string, QgsProcessingFeedback, int) -> dict
+    flightPoints: season flight points table from convertGPXFiles
+    storeFolder: folder of the season point store
 
+    Purpose:
+    Loads the season flight points into the season point store in one pass over the table, a chunk
+    of chunkSize points at a time: their EPSG:3005 coordinates, ele, time, TInterval as duration and
+    fid. The coordinates of a chunk are projected together by crsTransformer. The points of a
+    flight are contiguous in the table, they are recorded as one store flight with its
+    FlightSource, FlightName, NameTkline and TotalTime.
+    Returns the store, see createPointStore
+    """
+    layer = QgsVectorLayer(flightPoints, "", "ogr")
+    store = createPointStore(storeFolder, layer.featureCount())
+    columns = store['columns']
+    transform = crsTransformer(layer.crs().authid(), 'EPSG:3005')
+    request = QgsFeatureRequest().setSubsetOfAttributes(['ele', 'time', 'TInterval', 'FlightName', 'NameTkline',
+                                                         'TotalTime', 'FlightSource'], layer.fields())
+
+    def writeChunk(start, rows):
+        chunk = slice(start, start + len(rows['lon']))
+        columns['x'][chunk], columns['y'][chunk] = transform(rows['lon'], rows['lat'])
+        for column in ('ele', 'duration', 'flight', 'pointFid'):
+            columns[column][chunk] = rows[column]
+        columns['time'][chunk] = parseGPXTimes(rows['time'])
+        for values in rows.values():
+            values.clear()
+        return chunk.stop
+
+    rows = {column: [] for column in ('lon', 'lat', 'ele', 'time', 'duration', 'flight', 'pointFid')}
+    start = 0
+    for feature in layer.getFeatures(request):
+        if not feature.hasGeometry():
+            continue
+        if not store['flights'] or store['flights'][-1]['FlightSource'] != feature['FlightSource']:
+            totalTime = feature['TotalTime']
+            store['flights'].append({'FlightSource': feature['FlightSource'], 'FlightName': feature['FlightName'],
+                                     'NameTkline': feature['NameTkline'],
+                                     'TotalTime': totalTime if isinstance(totalTime, (int, float)) else None,
+                                     'start': start + len(rows['lon']), 'count': 0})
+        store['flights'][-1]['count'] += 1
+        point = feature.geometry().asPoint()
+        rows['lon'].append(point.x())
+        rows['lat'].append(point.y())
+        rows['ele'].append(feature['ele'] if isinstance(feature['ele'], (int, float)) else np.nan)
+        rows['time'].append(feature['time'] if isinstance(feature['time'], str) else None)
+        rows['duration'].append(feature['TInterval'] if isinstance(feature['TInterval'], (int, float)) else 0)
+        rows['flight'].append(len(store['flights']) - 1)
+        rows['pointFid'].append(feature.id())
+        if len(rows['lon']) >= chunkSize:
+            start = writeChunk(start, rows)
+            if feedback.isCanceled():
+                break
+    start = writeChunk(start, rows)
+
+    # points without a geometry or read after a cancel are left out of the store
+    store['pointCount'] = start
+    savePointStore(store)
+    feedback.setProgressText(f'{start} flight points of {len(store["flights"])} flights in the season point store')
+    return store
+
+
+def demValues(dem, x, y):
+    """
+    (gdal.Dataset, numpy array, numpy array) -> numpy array
+    Purpose:
+    DEM elevation under the points, interpolated by sampleGrid from a window of the DEM around them.
+    Returns the elevations, nan outside of the DEM
+    """
+    band = dem.GetRasterBand(1)
+    geoTransform = dem.GetGeoTransform()
+    window = gridWindow(geoTransform, dem.RasterXSize, dem.RasterYSize, x, y)
+    if window is None:
+        return np.full(len(x), np.nan)
+    xOff, yOff, width, height = window
+    grid = band.ReadAsArray(xOff, yOff, width, height).astype(np.float64)
+    if band.GetNoDataValue() is not None:
+        grid[grid == band.GetNoDataValue()] = np.nan
+    windowTransform = (geoTransform[0] + xOff * geoTransform[1], geoTransform[1], 0,
+                       geoTransform[3] + yOff * geoTransform[5], 0, geoTransform[5])
+    return sampleGrid(grid, windowTransform, x, y)
+
+
+def sampleStoreDEM(store, demPath, feedback):
+    """
+    (dict, string, QgsProcessingFeedback) -> int
+    store: season point store from buildPointStore
+    demPath: DEM raster, in EPSG:3005
+
+    Purpose:
+    Interpolates the DEM elevation under every point of the store with sampleGrid, and calculates its AGL
+    from its ele. The DEM is read a flight at a time, in a window around the points of the flight, so
+    it's never read whole.
+    Returns the number of points without a DEM value
+    """
+    columns = store['columns']
+    dem = gdal.Open(demPath)
+    missing = 0
+    for flightIndex, points in flightSlices(store):
+        demElev = demValues(dem, columns['x'][points], columns['y'][points])
+        columns['dem'][points] = demElev
+        columns['AGL'][points] = aglHeights(columns['ele'][points], demElev)
+        missing += int(np.count_nonzero(np.isnan(demElev)))
+        if feedback.isCanceled():
+            break
+    savePointStore(store)
+    feedback.setProgressText(f'DEM extract value to point, {missing} points outside of the DEM')
+    return missing
 
-    # outputLyr = output + '|layername=' + 'rawBuffer_' + str(bufferDist) + 'only'
 
-    return output
+def writeStorePoints(store, selection, flightPoints, outputPath, feedback, intervalField='TimeInterval',
+                     chunkSize=100000):
+    """
+    (dict, numpy array, string, string, QgsProcessingFeedback, string, int) -> string
+    store: season point store from sampleStoreDEM
+    selection: indexes of the store points to write, eg. from storeSelection
+    flightPoints: season flight points table the store was built from
+    outputPath: geopackage written
+    intervalField: name of the field of the point durations
+
+    Purpose:
+    Writes the selected points of the store as an EPSG:3005 point layer with the fields cat, ele, time,
+    hdop, badelf_spe, NameTkline, FlightName, TotalTime, demElev, AGL and intervalField. hdop and
+    badelf_spe are read from the hdop and badelf_speed columns of the season table, a chunk of
+    chunkSize points at a time.
+    Returns outputPath
+    """
+    columns = store['columns']
+    fields = QgsFields()
+    for name, fieldType in (('cat', QVariant.Int), ('ele', QVariant.Double), ('time', QVariant.String),
+                            ('hdop', QVariant.Double), ('badelf_spe', QVariant.Double),
+                            ('NameTkline', QVariant.String), ('FlightName', QVariant.String),
+                            ('TotalTime', QVariant.Double), ('demElev', QVariant.Double),
+                            ('AGL', QVariant.Int), (intervalField, QVariant.Double)):
+        fields.append(QgsField(name, fieldType))
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = 'GPKG'
+    options.layerName = os.path.splitext(os.path.basename(outputPath))[0]
+    writer = QgsVectorFileWriter.create(outputPath, fields, QgsWkbTypes.Point,
+                                        QgsCoordinateReferenceSystem('EPSG:3005'),
+                                        QgsProject.instance().transformContext(), options)
+
+    layer = QgsVectorLayer(flightPoints, "", "ogr")
+    # output field: season table column, the vendor field badelf_speed is written as badelf_spe
+    tableColumns = {field: column for field, column in (('hdop', 'hdop'), ('badelf_spe', 'badelf_speed'))
+                    if layer.fields().indexOf(column) >= 0}
+    tableFields = list(tableColumns.values())
+    for start in range(0, len(selection), chunkSize):
+        indexes = selection[start:start + chunkSize]
+        request = QgsFeatureRequest().setFilterFids([int(fid) for fid in columns['pointFid'][indexes]])
+        request.setFlags(QgsFeatureRequest.NoGeometry).setSubsetOfAttributes(tableFields, layer.fields())
+        tableValues = {feature.id(): feature for feature in layer.getFeatures(request)}
+        times = isoTimes(columns['time'][indexes])
+        features = []
+        for cat, (index, time) in enumerate(zip(indexes, times), start + 1):
+            flight = store['flights'][columns['flight'][index]]
+            tableFeature = tableValues.get(int(columns['pointFid'][index]))
+            feature = QgsFeature(fields)
+            feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(columns['x'][index], columns['y'][index])))
+            feature.setAttributes([cat, storeValue(columns['ele'][index]), time,
+                                   tableValue(tableFeature, tableColumns.get('hdop')),
+                                   tableValue(tableFeature, tableColumns.get('badelf_spe')),
+                                   flight['NameTkline'], flight['FlightName'], flight['TotalTime'],
+                                   storeValue(columns['dem'][index]), int(columns['AGL'][index]),
+                                   storeValue(columns['duration'][index])])
+            features.append(feature)
+        writer.addFeatures(features)
+        if feedback.isCanceled():
+            break
+    del writer
+    feedback.setProgressText(f'{len(selection)} flight points written to {outputPath}')
+    return outputPath
+
+
+def projectFlightLines(flightLines, outputPath, feedback):
+    """
+    (string, string, QgsProcessingFeedback) -> string
+    flightLines: season flight lines table from convertGPXFiles
+    outputPath: geopackage written
+
+    Purpose:
+    Writes the flight lines projected to EPSG:3005, with their fields. The vertices of all the lines
+    are projected together by crsTransformer.
+    Returns outputPath
+    """
+    layer = QgsVectorLayer(flightLines, "", "ogr")
+    fields = QgsFields()
+    for field in layer.fields():
+        if field.name() != 'fid':
+            fields.append(field)
+    lines = [feature for feature in layer.getFeatures() if feature.hasGeometry()]
+    vertices = [feature.geometry().asPolyline() for feature in lines]
+    lon = np.array([vertex.x() for line in vertices for vertex in line], dtype=np.float64)
+    lat = np.array([vertex.y() for line in vertices for vertex in line], dtype=np.float64)
+    x, y = crsTransformer(layer.crs().authid(), 'EPSG:3005')(lon, lat)
+
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = 'GPKG'
+    options.layerName = os.path.splitext(os.path.basename(outputPath))[0]
+    writer = QgsVectorFileWriter.create(outputPath, fields, QgsWkbTypes.LineString,
+                                        QgsCoordinateReferenceSystem('EPSG:3005'),
+                                        QgsProject.instance().transformContext(), options)
+    start = 0
+    for line, lineVertices in zip(lines, vertices):
+        end = start + len(lineVertices)
+        feature = QgsFeature(fields)
+        feature.setGeometry(QgsGeometry.fromPolylineXY([QgsPointXY(vertexX, vertexY)
+                                                        for vertexX, vertexY in zip(x[start:end], y[start:end])]))
+        feature.setAttributes([line[field.name()] for field in fields])
+        writer.addFeature(feature)
+        start = end
+    del writer
+    feedback.setProgressText(f'{len(lines)} flight lines written to {outputPath}')
+    return outputPath
+
+
+def tableValue(feature, column):
+    """
+    Value of a column of a season table feature, None without the feature or the column
+    """
+    if feature is None or column is None:
+        return None
+    value = feature[column]
+    return value if isinstance(value, (int, float)) else None
+
+
+def storeValue(value):
+    """
+    Store value as a python float, None for nan
+    """
+    value = float(value)
+    return None if math.isnan(value) else value
 
 
 def makeViewshed(uwrList, uwrBuffered, buffDistance, unit_no, unit_no_id, uwr_unique_Field, tempFolder, DEM, viewshed,
@@ -0,0 +1,905 @@
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (QgsFeature,
+                       QgsFeatureRequest,
+                       QgsField,
+                       QgsFields,
+                       QgsGeometry,
+                       QgsProject,
+                       QgsSpatialIndex,
+                       QgsVectorFileWriter,
+                       QgsVectorLayer,
+                       QgsWkbTypes)
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import csv
+import hashlib
+import math
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+
+# This module only depends on qgis.core (not on processing) so that it can be
+# imported by the worker processes of the buffer process pool.
+
+
+def bufferSegments(bufferDist, tolerance, maxSegments=90):
+    """
+    (int, float, int) -> int
+    bufferDist: buffer distance in meters
+    tolerance: max distance in meters between the buffer arcs and the true circle, 0 to use maxSegments
+
+    Purpose:
+    Finds the number of segments per quarter circle so a chord of the buffer arc is never
+    further than tolerance from the circle, ie. radius * (1 - cos(angle / 2)) <= tolerance.
+    """
+    if tolerance <= 0 or bufferDist <= 0:
+        return maxSegments
+    if tolerance >= bufferDist:
+        return 1
+    segmentAngle = 2 * math.acos(1 - tolerance / bufferDist)
+    return max(1, min(maxSegments, math.ceil((math.pi / 2) / segmentAngle)))
+
+
+def bufferSegmentsDict(bufferDistList, tolerance):
+    """
+    Number of segments per quarter circle for every buffer distance, eg. {500: 12, 1000: 17, 1500: 21}
+    """
+    return {bufferDist: bufferSegments(bufferDist, tolerance) for bufferDist in bufferDistList}
+
+
+def overlayParameters(gridSize):
+    """
+    (float) -> QgsGeometryParameters
+    Purpose:
+    Parameters for a fixed precision (snap-rounding) overlay on a grid of gridSize meters.
+    Returns None for 0, the default floating point overlay. Needs QGIS 3.28 or later.
+    """
+    if not gridSize:
+        return None
+    from qgis.core import QgsGeometryParameters
+    parameters = QgsGeometryParameters()
+    parameters.setGridSize(gridSize)
+    return parameters
+
+
+def difference(geometry, other, parameters=None):
+    """
+    Difference of two geometries, on the precision grid of parameters if given
+    """
+    if parameters is None:
+        return geometry.difference(other)
+    return geometry.difference(other, parameters)
+
+
+def donutRings(geometry, sortBufferDistList, segments=None, gridSize=0):
+    """
+    (QgsGeometry, list, dict, float) -> list
+    geometry: dissolved geometry of one uwr
+    sortBufferDistList: buffer distances sorted ascending. example: [500, 1000, 1500]
+    segments: number of segments per quarter circle of each buffer distance, 90 if not given
+    gridSize: precision grid in meters of the ring differences, 0 for floating point
+
+    Purpose:
+    Buffers the uwr at every distance and erases each buffer with the previous one,
+    so each ring only covers its own buffer range.
+    Returns [bufferDist, geometry] pairs, starting with the 0m "In UWR" polygon.
+    """
+    parameters = overlayParameters(gridSize)
+    rings = [[0, geometry]]
+    prevBuffer = geometry
+    for bufferDist in sortBufferDistList:
+        buffer = geometry.buffer(bufferDist, segments[bufferDist] if segments else 90)
+        rings.append([bufferDist, difference(buffer, prevBuffer, parameters)])
+        prevBuffer = buffer
+    return rings
+
+
+def vertexCount(geometry):
+    """
+    Number of vertices of a geometry
+    """
+    return sum(1 for _ in geometry.vertices())
+
+
+def bufferSegmentationReport(dissolvedPath, bufferDistList, tolerance, reportPath, feedback):
+    """
+    (string, list, float, string, QgsProcessingFeedback) -> string
+    dissolvedPath: uwr layer dissolved by unit_no and unit_no_id
+    tolerance: max deviation in meters used to pick the segments of each buffer distance
+    reportPath: csv file to write the report to
+
+    Purpose:
+    Compares the buffers made with the segments picked from tolerance against the 90 segments
+    baseline: total vertex count and total area of each buffer distance, and the area error.
+    Returns reportPath.
+    """
+    dissolvedLyr = QgsVectorLayer(dissolvedPath, "", "ogr")
+    segments = bufferSegmentsDict(bufferDistList, tolerance)
+    report = {bufferDist: [0, 0, 0.0, 0.0] for bufferDist in bufferDistList}
+    for feature in dissolvedLyr.getFeatures():
+        if feedback.isCanceled():
+            break
+        geometry = feature.geometry()
+        for bufferDist in bufferDistList:
+            baseline = geometry.buffer(bufferDist, 90)
+            adaptive = geometry.buffer(bufferDist, segments[bufferDist])
+            report[bufferDist][0] += vertexCount(baseline)
+            report[bufferDist][1] += vertexCount(adaptive)
+            report[bufferDist][2] += baseline.area()
+            report[bufferDist][3] += adaptive.area()
+
+    with open(reportPath, 'w', newline='') as reportFile:
+        reportWriter = csv.writer(reportFile)
+        reportWriter.writerow(['BUFF_DIST', 'SEGMENTS', 'VERTICES_90', 'VERTICES', 'VERTEX_REDUCTION_PCT',
+                               'AREA_90', 'AREA', 'AREA_ERROR_PCT'])
+        for bufferDist in sorted(bufferDistList):
+            baseVertices, vertices, baseArea, area = report[bufferDist]
+            vertexReduction = 100.0 * (baseVertices - vertices) / baseVertices if baseVertices else 0
+            areaError = 100.0 * (area - baseArea) / baseArea if baseArea else 0
+            reportWriter.writerow([bufferDist, segments[bufferDist], baseVertices, vertices,
+                                   round(vertexReduction, 2), round(baseArea, 2), round(area, 2),
+                                   round(areaError, 4)])
+            feedback.setProgressText(f'{bufferDist}m buffer - {segments[bufferDist]} segments, '
+                                     f'{vertices} vertices vs {baseVertices} with 90 segments '
+                                     f'({vertexReduction:.1f}% fewer), area error {areaError:.4f}%')
+    return reportPath
+
+
+def ringPrecisionReport(dissolvedPath, bufferDistList, segments, gridSize, reportPath, feedback):
+    """
+    (string, list, dict, float, string, QgsProcessingFeedback) -> string
+    dissolvedPath: uwr layer dissolved by unit_no and unit_no_id
+    segments: number of segments per quarter circle of each buffer distance
+    gridSize: precision grid in meters of the ring differences
+    reportPath: csv file to write the report to
+
+    Purpose:
+    Benchmarks the ring differences on the precision grid against the floating point overlay:
+    time spent and total area of each ring, the speed-up and the area deviation.
+    Returns reportPath.
+    """
+    dissolvedLyr = QgsVectorLayer(dissolvedPath, "", "ogr")
+    sortBufferDistList = list(sorted(bufferDistList))
+    parameters = overlayParameters(gridSize)
+    report = {bufferDist: [0.0, 0.0, 0.0, 0.0] for bufferDist in sortBufferDistList}
+    for feature in dissolvedLyr.getFeatures():
+        if feedback.isCanceled():
+            break
+        geometry = feature.geometry()
+        prevBuffer = geometry
+        for bufferDist in sortBufferDistList:
+            buffer = geometry.buffer(bufferDist, segments[bufferDist])
+            startTime = time.perf_counter()
+            floatRing = difference(buffer, prevBuffer)
+            floatTime = time.perf_counter() - startTime
+            startTime = time.perf_counter()
+            gridRing = difference(buffer, prevBuffer, parameters)
+            gridTime = time.perf_counter() - startTime
+            report[bufferDist][0] += floatTime
+            report[bufferDist][1] += gridTime
+            report[bufferDist][2] += floatRing.area()
+            report[bufferDist][3] += gridRing.area()
+            prevBuffer = buffer
+
+    with open(reportPath, 'w', newline='') as reportFile:
+        reportWriter = csv.writer(reportFile)
+        reportWriter.writerow(['BUFF_DIST', 'GRID_SIZE', 'SECONDS_FLOAT', 'SECONDS_GRID', 'SPEED_UP',
+                               'AREA_FLOAT', 'AREA_GRID', 'AREA_DEVIATION_PCT'])
+        for bufferDist in sortBufferDistList:
+            floatTime, gridTime, floatArea, gridArea = report[bufferDist]
+            speedUp = floatTime / gridTime if gridTime else 0
+            areaDeviation = 100.0 * (gridArea - floatArea) / floatArea if floatArea else 0
+            reportWriter.writerow([bufferDist, gridSize, round(floatTime, 4), round(gridTime, 4), round(speedUp, 2),
+                                   round(floatArea, 2), round(gridArea, 2), round(areaDeviation, 6)])
+            feedback.setProgressText(f'{bufferDist}m ring - {gridSize}m grid {speedUp:.2f}x the floating point '
+                                     f'overlay, area deviation {areaDeviation:.6f}%')
+    return reportPath
+
+
+def geometryFromWkb(wkb):
+    """
+    Rebuilds a QgsGeometry from WKB bytes passed between processes
+    """
+    geometry = QgsGeometry()
+    geometry.fromWkb(wkb)
+    return geometry
+
+
+def workerExecutable():
+    """
+    (None) -> string
+    Purpose:
+    Python interpreter for the worker processes. Inside QGIS sys.executable is the QGIS application,
+    so the interpreter QGIS ships with is looked for in sys.exec_prefix instead.
+    Returns the path of the interpreter, None if there is none
+    """
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return sys.executable
+    if os.name == 'nt':
+        candidates = [os.path.join(sys.exec_prefix, name) for name in ('pythonw.exe', 'python.exe', 'python3.exe')]
+    else:
+        candidates = [os.path.join(sys.exec_prefix, 'bin', name) for name in ('python3', 'python')]
+    for candidate in candidates:
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+
+def workerCheck():
+    """
+    Runs in a worker process, it only returns once the worker has imported qgis.core and this module
+    """
+    return os.getpid()
+
+
+def processPool(workers, feedback, timeout=120):
+    """
+    (int, QgsProcessingFeedback, float) -> ProcessPoolExecutor
+    Purpose:
+    Creates a pool of worker processes started with the interpreter of workerExecutable, and checks
+    that a worker can import qgis.core and the plugin modules outside of the QGIS application.
+    Returns the pool, None if there is no interpreter or the workers can't start. The caller then
+    runs in this process; the reason is written to feedback.
+    """
+    executable = workerExecutable()
+    if executable is None:
+        feedback.setProgressText(f'No python interpreter for the worker processes in {sys.exec_prefix}, '
+                                 f'running in this process')
+        return None
+    mpContext = multiprocessing.get_context('spawn')
+    mpContext.set_executable(executable)
+    pool = None
+    try:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=mpContext)
+        pool.submit(workerCheck).result(timeout=timeout)
+    except Exception as e:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        feedback.setProgressText(f'The worker processes could not start with {executable} ({e!r}), '
+                                 f'running in this process')
+        return None
+    return pool
+
+
+def donutRingsWorker(chunkIndex, wkbList, sortBufferDistList, segments, gridSize=0):
+    """
+    (int, list, list, dict, float) -> int, int, list
+    Purpose:
+    Runs in a worker process. Creates the donut rings of a chunk of uwr geometries given as WKB.
+    Returns the chunk index, the worker process id and the rings of each uwr as WKB.
+    """
+    chunkRings = []
+    for wkb in wkbList:
+        rings = donutRings(geometryFromWkb(wkb), sortBufferDistList, segments, gridSize)
+        chunkRings.append([[bufferDist, bytes(ring.asWkb())] for bufferDist, ring in rings])
+    return chunkIndex, os.getpid(), chunkRings
+
+
+def iterDonutRings(features, sortBufferDistList, segments, workers, feedback, gridSize=0):
+    """
+    (iterable, list, dict, int, QgsProcessingFeedback, float) -> generator
+    features: dissolved uwr features
+    segments: number of segments per quarter circle of each buffer distance
+    workers: number of worker processes, 1 builds the rings in this process, as does a pool that
+    processPool can't start
+    gridSize: precision grid in meters of the ring differences, 0 for floating point
+
+    Purpose:
+    Yields [feature, rings] for every uwr in the order of features. With more than one worker,
+    the uwr are split into chunks that are buffered in a process pool; finished chunks are
+    yielded in their original order so the output is the same as the serial one.
+    """
+    pool = processPool(workers, feedback) if workers > 1 else None
+    if pool is None:
+        for feature in features:
+            yield feature, donutRings(feature.geometry(), sortBufferDistList, segments, gridSize)
+        return
+
+    features = list(features)
+    chunkSize = max(1, math.ceil(len(features) / (workers * 4)))
+    chunks = [features[i:i + chunkSize] for i in range(0, len(features), chunkSize)]
+    feedback.setProgressText(f'Buffering {len(features)} uwr in {len(chunks)} chunks with {workers} workers')
+
+    chunkResults = {}
+    workerNumbers = {}
+    workerCounts = {}
+    nextChunk = 0
+    with pool:
+        futures = [pool.submit(donutRingsWorker, chunkIndex, [bytes(f.geometry().asWkb()) for f in chunk],
+                               sortBufferDistList, segments, gridSize)
+                   for chunkIndex, chunk in enumerate(chunks)]
+        for future in as_completed(futures):
+            chunkIndex, pid, chunkRings = future.result()
+            chunkResults[chunkIndex] = chunkRings
+
+            # ==============================================================
+            # Report the progress of each worker
+            # ==============================================================
+            workerNumber = workerNumbers.setdefault(pid, len(workerNumbers) + 1)
+            workerCounts[workerNumber] = workerCounts.get(workerNumber, 0) + len(chunkRings)
+            feedback.setProgressText(f'Worker {workerNumber}: {workerCounts[workerNumber]} uwr buffered')
+            if feedback.isCanceled():
+                pool.shutdown(cancel_futures=True)
+                return
+
+            # ==============================================================
+            # Yield the finished chunks in order
+            # ==============================================================
+            while nextChunk in chunkResults:
+                for feature, rings in zip(chunks[nextChunk], chunkResults.pop(nextChunk)):
+                    try:
+                        yield feature, [[bufferDist, geometryFromWkb(wkb)] for bufferDist, wkb in rings]
+                    except GeneratorExit:
+                        # the caller stopped reading, don't wait for the remaining chunks
+                        pool.shutdown(cancel_futures=True)
+                        raise
+                nextChunk += 1
+
+
+def unionGeometries(geometries):
+    """
+    Union of the geometries of the features of one uwr
+    """
+    if len(geometries) == 1:
+        return geometries[0]
+    return QgsGeometry.unaryUnion(geometries)
+
+
+def dissolveWorker(chunkIndex, groupsWkb):
+    """
+    (int, list) -> int, list
+    Purpose:
+    Runs in a worker process. Unions the geometries of each uwr of a chunk given as WKB.
+    Returns the chunk index and the dissolved geometry of each uwr as WKB.
+    """
+    return chunkIndex, [bytes(unionGeometries([geometryFromWkb(wkb) for wkb in groupWkb]).asWkb())
+                        for groupWkb in groupsWkb]
+
+
+def iterUWRGroups(source, uwrFids, repaired):
+    """
+    (QgsFeatureSource, dict, dict) -> generator
+    Purpose:
+    Yields [first feature, geometries] for each uwr, reading one uwr at a time by feature id.
+    The repaired geometry is used for the features in repaired.
+    """
+    for uwr in sorted(uwrFids):
+        features = list(source.getFeatures(QgsFeatureRequest().setFilterFids(uwrFids[uwr])))
+        geometries = [repaired[feature.id()][1] if feature.id() in repaired else feature.geometry()
+                      for feature in features]
+        yield features[0], geometries
+
+
+def dissolveUWR(source, uwrFids, repaired, dissolvedPath, feedback, workers=1, chunkSize=50):
+    """
+    (QgsFeatureSource, dict, dict, string, QgsProcessingFeedback, int, int) -> string
+    source: original uwr layer
+    uwrFids: {uwr_unique_id: [feature ids]} of the uwr to dissolve
+    repaired: {feature id: (wkb hash, repaired geometry)} of the invalid features
+    dissolvedPath: path of the dissolved layer without the .gpkg extension
+    workers: number of worker processes, 1 dissolves in this process, as does a pool that
+    processPool can't start
+    chunkSize: number of uwr sent to a worker at a time
+
+    Purpose:
+    Dissolves the uwr features by uwr, one uwr group at a time so only the features of the
+    groups being unioned are held in memory. With more than one worker, chunks of groups are
+    unioned in a process pool, keeping at most two chunks per worker in flight. The attributes
+    of the first feature of each uwr are kept, like native:dissolve.
+    Returns the path of the dissolved layer.
+    """
+    fields = QgsFields()
+    for field in source.fields():
+        if field.name() != 'fid':
+            fields.append(field)
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = 'GPKG'
+    options.layerName = os.path.basename(dissolvedPath)
+    writer = QgsVectorFileWriter.create(dissolvedPath + '.gpkg', fields, QgsWkbTypes.MultiPolygon,
+                                        source.sourceCrs(), QgsProject.instance().transformContext(), options)
+
+    def writeDissolved(feature, geometry):
+        geometry.convertToMultiType()
+        outFeature = QgsFeature(fields)
+        for field in fields:
+            outFeature[field.name()] = feature[field.name()]
+        outFeature.setGeometry(geometry)
+        writer.addFeature(outFeature)
+
+    groups = iterUWRGroups(source, uwrFids, repaired)
+    pool = processPool(workers, feedback) if workers > 1 else None
+    if pool is None:
+        for feature, geometries in groups:
+            if feedback.isCanceled():
+                break
+            writeDissolved(feature, unionGeometries(geometries))
+    else:
+        inFlight = deque()
+        with pool:
+            chunkIndex = 0
+            while True:
+                chunk = [group for _, group in zip(range(chunkSize), groups)]
+                if chunk:
+                    inFlight.append((chunk, pool.submit(dissolveWorker, chunkIndex,
+                                                        [[bytes(g.asWkb()) for g in geometries]
+                                                         for _, geometries in chunk])))
+                    chunkIndex += 1
+                # ==============================================================
+                # Write the oldest chunk once enough chunks are in flight,
+                # so the groups are written in order with bounded memory
+                # ==============================================================
+                while inFlight and (len(inFlight) >= workers * 2 or not chunk):
+                    doneChunk, future = inFlight.popleft()
+                    for (feature, _), wkb in zip(doneChunk, future.result()[1]):
+                        writeDissolved(feature, geometryFromWkb(wkb))
+                    if feedback.isCanceled():
+                        pool.shutdown(cancel_futures=True)
+                        inFlight.clear()
+                if not chunk or feedback.isCanceled():
+                    break
+
+    # the writer flushes to disk when deleted
+    del writer
+    feedback.setProgressText(f'{len(uwrFids)} uwr dissolved into {dissolvedPath}.gpkg')
+    return dissolvedPath + '.gpkg'
+
+
+def uwrSourceHashes(features, unit_no, unit_no_id, bufferDistList, tolerance, gridSize=0):
+    """
+    (iterable, string, string, list, float, float) -> dict, dict
+    features: features of the original uwr layer
+    tolerance: buffer deviation tolerance, part of the hash because it changes the rings
+    gridSize: precision grid of the ring differences, part of the hash when it is used
+
+    Purpose:
+    Hashes the source geometries of every uwr together with the buffer settings, so an uwr
+    only has to be buffered again when its geometry or the buffer settings change. The hash
+    doesn't depend on the order of the features of a multi-feature uwr.
+    Returns {uwr_unique_id: hash} and {uwr_unique_id: [feature ids]}
+    """
+    featureHashes = {}
+    uwrFids = {}
+    for feature in features:
+        uwr = f'{feature[unit_no]}__{feature[unit_no_id]}'
+        featureHashes.setdefault(uwr, []).append(hashlib.sha1(bytes(feature.geometry().asWkb())).hexdigest())
+        uwrFids.setdefault(uwr, []).append(feature.id())
+
+    settings = f'{sorted(bufferDistList)}|{tolerance}'
+    if gridSize:
+        settings += f'|{gridSize}'
+    uwrHashes = {}
+    for uwr, hashes in featureHashes.items():
+        uwrHashes[uwr] = hashlib.sha1(('|'.join(sorted(hashes)) + '|' + settings).encode()).hexdigest()
+    return uwrHashes, uwrFids
+
+
+def uwrBufferedHashes(uwrBufferedPath, uwr_unique_Field):
+    """
+    (string, string) -> dict
+    Purpose:
+    Reads the SRC_HASH stored with each uwr in uwrBuffered. Uwr buffered before the hashes
+    were stored get None, so they are buffered again once.
+    Returns {uwr_unique_id: hash}, empty if uwrBuffered doesn't exist
+    """
+    if not os.path.isfile(uwrBufferedPath + '.gpkg'):
+        return {}
+    uwrBufferedLyr = QgsVectorLayer(uwrBufferedPath + '.gpkg', "", "ogr")
+    hasHash = 'SRC_HASH' in uwrBufferedLyr.fields().names()
+    hashes = {}
+    for feature in uwrBufferedLyr.getFeatures():
+        hashes[f'{feature[uwr_unique_Field]}'] = feature['SRC_HASH'] if hasHash else None
+    return hashes
+
+
+def uwrBufferedFields(dissolvedLyr, uwr_unique_Field):
+    """
+    Fields of a new uwrBuffered layer: the fields of the dissolved uwr layer plus
+    uwr_unique_Field, BUFF_DIST and SRC_HASH
+    """
+    fields = QgsFields()
+    for field in dissolvedLyr.fields():
+        if field.name() not in ['fid', uwr_unique_Field, 'BUFF_DIST', 'SRC_HASH']:
+            fields.append(field)
+    fields.append(QgsField(uwr_unique_Field, QVariant.String, len=100))
+    fields.append(QgsField('BUFF_DIST', QVariant.Double))
+    fields.append(QgsField('SRC_HASH', QVariant.String, len=40))
+    return fields
+
+
+def openUWRBuffered(uwrBufferedPath, fields, crs, uwr_unique_Field, replaceUWRSet=None):
+    """
+    (string, QgsFields, QgsCoordinateReferenceSystem, string, set) -> QgsFeatureSink, QgsFields, bool, object
+    uwrBufferedPath: path of uwrBuffered without the .gpkg extension
+    replaceUWRSet: uwr_unique_id of the uwr whose rings are about to be rebuilt
+
+    Purpose:
+    Opens the existing uwrBuffered geopackage for appending, or creates a new one.
+    In an existing uwrBuffered, the rows of the uwr in replaceUWRSet are deleted in place and
+    the SRC_HASH field is added if it is missing.
+    Returns the sink to add features to, the fields of the sink, whether the geometries
+    have to be multi-part, and the object that has to be kept alive until writing is done.
+    """
+    layerName = os.path.basename(uwrBufferedPath)
+    if os.path.isfile(uwrBufferedPath + '.gpkg'):
+        layer = QgsVectorLayer(uwrBufferedPath + '.gpkg' + f'|layername={layerName}', layerName, "ogr")
+        provider = layer.dataProvider()
+        if provider.fields().indexOf('SRC_HASH') < 0:
+            provider.addAttributes([QgsField('SRC_HASH', QVariant.String, len=40)])
+            layer.updateFields()
+        if replaceUWRSet:
+            deleteUWRRows(layer, uwr_unique_Field, replaceUWRSet)
+        return provider, provider.fields(), QgsWkbTypes.isMultiType(layer.wkbType()), layer
+
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = 'GPKG'
+    options.layerName = layerName
+    writer = QgsVectorFileWriter.create(uwrBufferedPath + '.gpkg', fields, QgsWkbTypes.MultiPolygon, crs,
+                                        QgsProject.instance().transformContext(), options)
+    return writer, fields, True, writer
+
+
+def deleteUWRRows(layer, uwr_unique_Field, uwrSet):
+    """
+    Deletes the rows of the uwr in uwrSet from an uwrBuffered layer, in place
+    """
+    staleFids = [feature.id() for feature in layer.getFeatures()
+                 if f'{feature[uwr_unique_Field]}' in uwrSet]
+    layer.dataProvider().deleteFeatures(staleFids)
+
+
+def deleteUWRBuffered(uwrBufferedPath, uwr_unique_Field, uwrSet):
+    """
+    (string, string, set) -> None
+    uwrBufferedPath: path of uwrBuffered without the .gpkg extension
+    uwrSet: uwr_unique_id of the uwr that are no longer in the original uwr layer
+
+    Purpose:
+    Deletes the rings of the uwr in uwrSet from an existing uwrBuffered. Their pairs are dropped
+    from the uwrOverlap table the next time writeUWROverlap runs.
+    """
+    layerName = os.path.basename(uwrBufferedPath)
+    layer = QgsVectorLayer(uwrBufferedPath + '.gpkg' + f'|layername={layerName}', layerName, "ogr")
+    deleteUWRRows(layer, uwr_unique_Field, uwrSet)
+
+
+def ringFeatures(feature, uwr, rings, sinkFields, copyFields, multiType, uwr_unique_Field, srcHash):
+    """
+    (QgsFeature, string, list, QgsFields, list, bool, string, string) -> list
+    Purpose:
+    Makes the uwrBuffered features of the rings of one uwr, with the attributes of feature.
+    """
+    outFeatures = []
+    for bufferDist, geometry in rings:
+        if multiType:
+            geometry.convertToMultiType()
+        outFeature = QgsFeature(sinkFields)
+        for name in copyFields:
+            outFeature[name] = feature[name]
+        outFeature[uwr_unique_Field] = uwr
+        outFeature['BUFF_DIST'] = bufferDist
+        if srcHash:
+            outFeature['SRC_HASH'] = srcHash
+        outFeature.setGeometry(geometry)
+        outFeatures.append(outFeature)
+    return outFeatures
+
+
+def openRingCache(cacheFolder):
+    """
+    (string) -> sqlite3.Connection
+    cacheFolder: folder of the ring cache shared between projects
+
+    Purpose:
+    Opens the ring cache database in cacheFolder, creating it if needed. Every entry holds
+    the rings of one uwr with the time it was last used.
+    """
+    os.makedirs(cacheFolder, exist_ok=True)
+    ringCache = sqlite3.connect(os.path.join(cacheFolder, 'ringCache.sqlite'), timeout=60)
+    ringCache.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, bytes INTEGER, lastUsed REAL)')
+    ringCache.execute('CREATE TABLE IF NOT EXISTS rings (key TEXT, bufferDist REAL, wkb BLOB)')
+    ringCache.execute('CREATE INDEX IF NOT EXISTS ringsKey ON rings (key)')
+    ringCache.commit()
+    return ringCache
+
+
+def ringCacheKey(uwrHash, crs):
+    """
+    Ring cache key of an uwr: its source hash, which covers the geometry, buffer distances
+    and segmentation settings, and the crs of the geometry
+    """
+    return hashlib.sha1(f'{uwrHash}|{crs.authid()}'.encode()).hexdigest()
+
+
+def cachedRings(ringCache, key):
+    """
+    (sqlite3.Connection, string) -> list
+    Purpose:
+    Reads the rings stored under key and marks the entry as used.
+    Returns [bufferDist, geometry] pairs, None if the key is not in the cache.
+    """
+    rows = ringCache.execute('SELECT bufferDist, wkb FROM rings WHERE key = ? ORDER BY bufferDist',
+                             (key,)).fetchall()
+    if not rows:
+        return None
+    ringCache.execute('UPDATE entries SET lastUsed = ? WHERE key = ?', (time.time(), key))
+    return [[bufferDist, geometryFromWkb(wkb)] for bufferDist, wkb in rows]
+
+
+def storeRings(ringCache, key, rings):
+    """
+    (sqlite3.Connection, string, list) -> None
+    Purpose:
+    Stores the [bufferDist, geometry] rings of one uwr under key.
+    """
+    ringsWkb = [(key, bufferDist, bytes(geometry.asWkb())) for bufferDist, geometry in rings]
+    ringCache.execute('DELETE FROM rings WHERE key = ?', (key,))
+    ringCache.executemany('INSERT INTO rings VALUES (?, ?, ?)', ringsWkb)
+    ringCache.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                      (key, sum(len(wkb) for _, _, wkb in ringsWkb), time.time()))
+
+
+def evictRingCache(ringCache, maxBytes, feedback):
+    """
+    (sqlite3.Connection, int, QgsProcessingFeedback) -> None
+    Purpose:
+    Removes the least recently used entries until the rings in the cache take at most maxBytes.
+    """
+    totalBytes = ringCache.execute('SELECT COALESCE(SUM(bytes), 0) FROM entries').fetchone()[0]
+    evicted = 0
+    for key, entryBytes in ringCache.execute('SELECT key, bytes FROM entries ORDER BY lastUsed').fetchall():
+        if totalBytes <= maxBytes:
+            break
+        ringCache.execute('DELETE FROM rings WHERE key = ?', (key,))
+        ringCache.execute('DELETE FROM entries WHERE key = ?', (key,))
+        totalBytes -= entryBytes
+        evicted += 1
+    ringCache.commit()
+    if evicted:
+        ringCache.execute('VACUUM')
+        feedback.setProgressText(f'{evicted} uwr evicted from the ring cache')
+
+
+def writeCachedRings(source, uwrFids, ringCache, cacheKeys, uwrHashes, uwrBufferedPath, uwr_unique_Field,
+                     replaceUWRSet, feedback):
+    """
+    (QgsFeatureSource, dict, sqlite3.Connection, dict, dict, string, string, set, QgsProcessingFeedback) -> set
+    source: original uwr layer
+    uwrFids: {uwr_unique_id: [feature ids]} of the uwr to buffer
+    replaceUWRSet: uwr_unique_id of uwr already in uwrBuffered that have changed
+
+    Purpose:
+    Writes the uwr whose rings are in the ring cache straight into uwrBuffered, with the
+    attributes of their first source feature like the dissolve. If any uwr is found, the rows
+    of all the uwr in replaceUWRSet are deleted from an existing uwrBuffered.
+    Returns the uwr_unique_id of the uwr written from the cache.
+    """
+    cachedUWRSet = set()
+    for uwr in uwrFids:
+        if ringCache.execute('SELECT 1 FROM entries WHERE key = ?', (cacheKeys[uwr],)).fetchone():
+            cachedUWRSet.add(uwr)
+    if not cachedUWRSet:
+        return cachedUWRSet
+
+    sink, sinkFields, multiType, keepAlive = openUWRBuffered(
+        uwrBufferedPath, uwrBufferedFields(source, uwr_unique_Field), source.sourceCrs(),
+        uwr_unique_Field, replaceUWRSet)
+    copyFields = [field.name() for field in source.fields() if sinkFields.indexOf(field.name()) >= 0
+                  and field.name() not in ['fid', 'SRC_HASH']]
+    for uwr in sorted(cachedUWRSet):
+        if feedback.isCanceled():
+            break
+        feature = next(source.getFeatures(QgsFeatureRequest().setFilterFid(uwrFids[uwr][0])))
+        rings = cachedRings(ringCache, cacheKeys[uwr])
+        sink.addFeatures(ringFeatures(feature, uwr, rings, sinkFields, copyFields, multiType, uwr_unique_Field,
+                                      uwrHashes[uwr]))
+    ringCache.commit()
+
+    # the writer flushes to disk when deleted
+    del sink
+    del keepAlive
+    feedback.setProgressText(f'{len(cachedUWRSet)} uwr written from the ring cache')
+    return cachedUWRSet
+
+
+def makeDonutBuffers(dissolvedPath, bufferDistList, unit_no, unit_no_id, uwr_unique_Field, uwrBufferedPath,
+                     feedback, workers=1, tolerance=0, uwrHashes=None, replaceUWRSet=None, gridSize=0,
+                     ringCache=None, cacheKeys=None):
+    """
+    (string, list, string, string, string, string, QgsProcessingFeedback, int, float, dict, set, float,
+    sqlite3.Connection, dict) -> string
+    dissolvedPath: uwr layer dissolved by unit_no and unit_no_id
+    bufferDistList: buffer distances. example: [500, 1000, 1500]
+    uwrBufferedPath: path of uwrBuffered without the .gpkg extension
+    workers: number of worker processes used to create the rings
+    tolerance: max deviation in meters of the buffer arcs from a true circle, 0 to use 90 segments
+    uwrHashes: {uwr_unique_id: hash} from uwrSourceHashes, stored in SRC_HASH
+    replaceUWRSet: uwr_unique_id of uwr already in uwrBuffered that have changed
+    gridSize: precision grid in meters of the ring differences, 0 for floating point
+    ringCache: shared ring cache from openRingCache, the new rings are stored in it if given
+    cacheKeys: {uwr_unique_id: ring cache key} from ringCacheKey
+
+    Purpose:
+    Creates the donut buffers of every buffer distance and the 0m "In UWR" polygon in one
+    pass per uwr, and writes them straight into uwrBuffered. Appends to uwrBuffered if it
+    already exists, replacing the rows of the uwr in replaceUWRSet.
+    Returns the path of uwrBuffered.
+    """
+    dissolvedLyr = QgsVectorLayer(dissolvedPath, "", "ogr")
+    sortBufferDistList = list(sorted(bufferDistList))
+    segments = bufferSegmentsDict(bufferDistList, tolerance)
+    feedback.setProgressText(f'Buffer segments per quarter circle: {segments}')
+    sink, sinkFields, multiType, keepAlive = openUWRBuffered(
+        uwrBufferedPath, uwrBufferedFields(dissolvedLyr, uwr_unique_Field), dissolvedLyr.crs(),
+        uwr_unique_Field, replaceUWRSet)
+
+    dissolvedFields = dissolvedLyr.fields().names()
+    copyFields = [name for name in dissolvedFields if sinkFields.indexOf(name) >= 0 and name != 'fid'
+                  and name != 'SRC_HASH']
+    uwrCount = dissolvedLyr.featureCount()
+    total = 100.0 / uwrCount if uwrCount else 0
+
+    uwrRings = iterDonutRings(dissolvedLyr.getFeatures(), sortBufferDistList, segments, workers, feedback,
+                              gridSize)
+    for current, (feature, rings) in enumerate(uwrRings):
+        if feedback.isCanceled():
+            break
+        uwr = f'{feature[unit_no]}__{feature[unit_no_id]}'
+        outFeatures = ringFeatures(feature, uwr, rings, sinkFields, copyFields, multiType, uwr_unique_Field,
+                                   uwrHashes.get(uwr) if uwrHashes else None)
+        if ringCache is not None:
+            storeRings(ringCache, cacheKeys[uwr], rings)
+        sink.addFeatures(outFeatures)
+        feedback.setProgress(int(current * total))
+
+    if ringCache is not None:
+        ringCache.commit()
+
+    # the writer flushes to disk when deleted
+    del sink
+    del keepAlive
+    feedback.setProgressText(f'{uwrCount} uwr buffered into {uwrBufferedPath}.gpkg')
+    return uwrBufferedPath + '.gpkg'
+
+
+def uwrOuterGeometries(layer, uwr_unique_Field):
+    """
+    (QgsVectorLayer, string) -> dict
+    Purpose:
+    Unions the rings of every uwr of an uwrBuffered layer into the area covered by its
+    largest buffer.
+    Returns {uwr_unique_id: QgsGeometry}
+    """
+    uwrGeometries = {}
+    for feature in layer.getFeatures():
+        uwrGeometries.setdefault(f'{feature[uwr_unique_Field]}', []).append(feature.geometry())
+    return {uwr: unionGeometries(geometries) for uwr, geometries in uwrGeometries.items()}
+
+
+def uwrOverlapPairs(uwrGeometries, uwrSet=None):
+    """
+    (dict, set) -> list
+    uwrGeometries: {uwr_unique_id: outer geometry} from uwrOuterGeometries
+    uwrSet: only find the overlaps of these uwr, all uwr if not given
+
+    Purpose:
+    Finds the pairs of uwr whose buffer rings intersect, with the area of the intersection.
+    Returns [uwrA, uwrB, area] with uwrA < uwrB
+    """
+    uwrList = sorted(uwrGeometries)
+    spatialIndex = QgsSpatialIndex()
+    for i, uwr in enumerate(uwrList):
+        spatialIndex.addFeature(i, uwrGeometries[uwr].boundingBox())
+
+    pairs = []
+    for i, uwr in enumerate(uwrList):
+        if uwrSet is not None and uwr not in uwrSet:
+            continue
+        geometry = uwrGeometries[uwr]
+        engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+        engine.prepareGeometry()
+        for j in spatialIndex.intersects(geometry.boundingBox()):
+            other = uwrList[j]
+            # each pair once, unless the other uwr is skipped by uwrSet
+            if j == i or (j < i and (uwrSet is None or other in uwrSet)):
+                continue
+            if engine.intersects(uwrGeometries[other].constGet()):
+                area = geometry.intersection(uwrGeometries[other]).area()
+                pairs.append(sorted([uwr, other]) + [area])
+    return pairs
+
+
+def hasUWROverlap(uwrBufferedPath):
+    """
+    Whether the uwrBuffered geopackage has the uwrOverlap table
+    """
+    return QgsVectorLayer(uwrBufferedPath + '.gpkg|layername=uwrOverlap', "", "ogr").isValid()
+
+
+def writeUWROverlap(uwrBufferedPath, uwr_unique_Field, feedback, rebuiltUWRSet=None):
+    """
+    (string, string, QgsProcessingFeedback, set) -> None
+    uwrBufferedPath: path of uwrBuffered without the .gpkg extension
+    rebuiltUWRSet: uwr_unique_id of the uwr buffered in this run, all uwr are checked if not given
+
+    Purpose:
+    Stores the overlap graph of the uwr buffer rings in the uwrOverlap table of the uwrBuffered
+    geopackage: one row per pair of uwr whose rings intersect, with the intersection area.
+    When the table exists, only the pairs of the rebuilt uwr are found again, and the pairs of
+    uwr no longer in uwrBuffered are dropped.
+    """
+    layerName = os.path.basename(uwrBufferedPath)
+    uwrBufferedLyr = QgsVectorLayer(uwrBufferedPath + '.gpkg' + f'|layername={layerName}', layerName, "ogr")
+    uwrGeometries = uwrOuterGeometries(uwrBufferedLyr, uwr_unique_Field)
+
+    overlapLyr = QgsVectorLayer(uwrBufferedPath + '.gpkg|layername=uwrOverlap', "", "ogr")
+    pairs = []
+    if overlapLyr.isValid() and rebuiltUWRSet is not None:
+        for feature in overlapLyr.getFeatures():
+            if feature['uwrA'] not in rebuiltUWRSet and feature['uwrB'] not in rebuiltUWRSet \
+                    and feature['uwrA'] in uwrGeometries and feature['uwrB'] in uwrGeometries:
+                pairs.append([feature['uwrA'], feature['uwrB'], feature['AREA']])
+        pairs += uwrOverlapPairs(uwrGeometries, rebuiltUWRSet)
+    else:
+        pairs = uwrOverlapPairs(uwrGeometries)
+    del overlapLyr
+
+    fields = QgsFields()
+    fields.append(QgsField('uwrA', QVariant.String, len=100))
+    fields.append(QgsField('uwrB', QVariant.String, len=100))
+    fields.append(QgsField('AREA', QVariant.Double))
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = 'GPKG'
+    options.layerName = 'uwrOverlap'
+    options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+    writer = QgsVectorFileWriter.create(uwrBufferedPath + '.gpkg', fields, QgsWkbTypes.NoGeometry,
+                                        uwrBufferedLyr.crs(), QgsProject.instance().transformContext(), options)
+    for uwrA, uwrB, area in pairs:
+        feature = QgsFeature(fields)
+        feature.setAttributes([uwrA, uwrB, area])
+        writer.addFeature(feature)
+
+    # the writer flushes to disk when deleted
+    del writer
+    feedback.setProgressText(f'{len(pairs)} overlapping uwr pairs stored in uwrOverlap')
+
+
+def uwrOverlapGroups(uwrBufferedPath, uwr_unique_Field, uwrSet):
+    """
+    (string, string, set) -> list
+    uwrBufferedPath: path of the uwrBuffered geopackage
+    uwrSet: uwr_unique_id of the uwr to group
+
+    Purpose:
+    Groups the uwr whose buffer rings overlap, directly or through other uwr of uwrSet, using the
+    uwrOverlap table of uwrBuffered. The overlaps are found from the rings if there is no table.
+    Returns the groups as sorted lists of uwr_unique_id
+    """
+    overlapLyr = QgsVectorLayer(uwrBufferedPath + '|layername=uwrOverlap', "", "ogr")
+    if overlapLyr.isValid():
+        pairs = [[feature['uwrA'], feature['uwrB']] for feature in overlapLyr.getFeatures()]
+    else:
+        uwrBufferedLyr = QgsVectorLayer(uwrBufferedPath, "", "ogr")
+        pairs = uwrOverlapPairs(uwrOuterGeometries(uwrBufferedLyr, uwr_unique_Field), uwrSet)
+
+    # ==============================================================
+    # Connected components of the overlap graph, by union-find
+    # ==============================================================
+    parents = {uwr: uwr for uwr in uwrSet}
+
+    def root(uwr):
+        while parents[uwr] != uwr:
+            parents[uwr] = parents[parents[uwr]]
+            uwr = parents[uwr]
+        return uwr
+
+    for pair in pairs:
+        uwrA, uwrB = pair[0], pair[1]
+        if uwrA in parents and uwrB in parents:
+            parents[root(uwrA)] = root(uwrB)
+
+    groups = {}
+    for uwr in uwrSet:
+        groups.setdefault(root(uwr), []).append(uwr)
+    return sorted(sorted(group) for group in groups.values())
@@ -0,0 +1,211 @@
+from functools import lru_cache
+import json
+import numpy as np
+import os
+
+# This module doesn't depend on qgis, the season point store is plain numpy arrays.
+#
+# The season point store keeps one memory-mapped .npy file per column of the flight points, so the
+# stages after the gpx ingest read and write slices of a season of millions of points without
+# loading it, or copying it to a new layer, at every step. The flights and the uwr codes the
+# columns refer to are kept in pointStore.json next to the columns.
+
+# column: dtype of the column
+#   x, y: EPSG:3005 coordinates of the point
+#   ele: gpx elevation, dem: DEM elevation under the point, AGL: height above ground (m)
+#   time: seconds since epoch, duration: time (s) flown from the point to the next one
+#   flight: index of the flight in the store flights, pointFid: fid of the point in the season table
+#   uwr: index of the uwr code in the store uwrCodes, ring: BUFF_DIST of the uwr ring the point is in
+storeColumns = {'x': np.float64, 'y': np.float64, 'ele': np.float32, 'dem': np.float32, 'AGL': np.float32,
+                'time': np.float64, 'duration': np.float32, 'flight': np.int32, 'pointFid': np.int64,
+                'uwr': np.int32, 'ring': np.float32}
+
+# value of the columns not set yet
+storeEmpty = {'dem': np.nan, 'AGL': np.nan, 'uwr': -1, 'ring': np.nan}
+
+
+def createPointStore(storeFolder, pointCount):
+    """
+    (string, int) -> dict
+    storeFolder: folder of the store, the columns of a previous store in it are replaced
+    pointCount: number of points of the store
+
+    Purpose:
+    Creates the column files of an empty season point store.
+    Returns the store: {'folder', 'pointCount', 'flights', 'uwrCodes', 'columns': {column: memmap}}
+    """
+    os.makedirs(storeFolder, exist_ok=True)
+    columns = {}
+    for column, dtype in storeColumns.items():
+        columnPath = os.path.join(storeFolder, column + '.npy')
+        if os.path.isfile(columnPath):
+            os.remove(columnPath)
+        columns[column] = np.lib.format.open_memmap(columnPath, mode='w+', dtype=dtype, shape=(pointCount,))
+        if column in storeEmpty:
+            columns[column][:] = storeEmpty[column]
+    store = {'folder': storeFolder, 'pointCount': pointCount, 'flights': [], 'uwrCodes': [], 'columns': columns}
+    savePointStore(store)
+    return store
+
+
+def openPointStore(storeFolder, mode='r'):
+    """
+    (string, string) -> dict
+    mode: 'r' to read the columns, 'r+' to also write them
+
+    Purpose:
+    Opens the season point store written by createPointStore.
+    Returns the store, see createPointStore
+    """
+    with open(os.path.join(storeFolder, 'pointStore.json')) as storeFile:
+        store = json.load(storeFile)
+    store['folder'] = storeFolder
+    store['columns'] = {column: np.load(os.path.join(storeFolder, column + '.npy'), mmap_mode=mode)
+                        for column in storeColumns}
+    return store
+
+
+def savePointStore(store):
+    """
+    Flushes the columns of the store to disk and writes its flights and uwr codes
+    """
+    for values in store['columns'].values():
+        if isinstance(values, np.memmap):
+            values.flush()
+    with open(os.path.join(store['folder'], 'pointStore.json'), 'w') as storeFile:
+        json.dump({key: store[key] for key in ('pointCount', 'flights', 'uwrCodes')}, storeFile)
+
+
+def storeChunks(pointCount, chunkSize=1000000):
+    """
+    Slices of at most chunkSize points covering the store
+    """
+    for start in range(0, pointCount, chunkSize):
+        yield slice(start, min(start + chunkSize, pointCount))
+
+
+def flightSlices(store):
+    """
+    Yields [flight index, slice of its points] for every flight of the store
+    """
+    for flightIndex, flight in enumerate(store['flights']):
+        yield flightIndex, slice(flight['start'], flight['start'] + flight['count'])
+
+
+@lru_cache(maxsize=None)
+def crsTransformer(sourceCrs='EPSG:4326', targetCrs='EPSG:3005'):
+    """
+    (string, string) -> function
+    Purpose:
+    Transformer of coordinate arrays between two crs, created once for every crs pair. Uses a PROJ
+    transformer from pyproj, or the GDAL osr one when pyproj isn't installed. Both take the coordinates
+    in x, y (lon, lat) order.
+    Returns a function (x array, y array) -> (x array, y array)
+    """
+    try:
+        from pyproj import Transformer
+    except ImportError:
+        Transformer = None
+    if Transformer is not None:
+        transformer = Transformer.from_crs(sourceCrs, targetCrs, always_xy=True)
+        return lambda x, y: transformer.transform(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+
+    from osgeo import osr
+    crsPair = []
+    for crs in (sourceCrs, targetCrs):
+        reference = osr.SpatialReference()
+        reference.SetFromUserInput(crs)
+        reference.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        crsPair.append(reference)
+    transformation = osr.CoordinateTransformation(*crsPair)
+
+    def transform(x, y):
+        if len(x) == 0:
+            return np.array([], dtype=np.float64), np.array([], dtype=np.float64)
+        points = np.array(transformation.TransformPoints(np.column_stack([x, y]).astype(np.float64)))
+        return points[:, 0], points[:, 1]
+    return transform
+
+
+def uwrCode(store, uwr):
+    """
+    Index of an uwr code in the store uwrCodes, added if it's not there yet
+    """
+    if uwr not in store['uwrCodes']:
+        store['uwrCodes'].append(uwr)
+    return store['uwrCodes'].index(uwr)
+
+
+def gridWindow(geoTransform, xSize, ySize, x, y):
+    """
+    (tuple, int, int, numpy array, numpy array) -> tuple
+    geoTransform: GDAL geotransform of a north up raster
+    xSize, ySize: number of columns and rows of the raster
+
+    Purpose:
+    Pixel window of the raster covering the points, with one pixel around them for the interpolation.
+    Returns (xOff, yOff, width, height), None if the points are outside of the raster
+    """
+    located = ~(np.isnan(x) | np.isnan(y))
+    if not located.any():
+        return None
+    cols = (x[located] - geoTransform[0]) / geoTransform[1]
+    rows = (y[located] - geoTransform[3]) / geoTransform[5]
+    xOff = max(int(np.floor(cols.min())) - 1, 0)
+    yOff = max(int(np.floor(rows.min())) - 1, 0)
+    xEnd = min(int(np.floor(cols.max())) + 2, xSize)
+    yEnd = min(int(np.floor(rows.max())) + 2, ySize)
+    if xEnd <= xOff or yEnd <= yOff:
+        return None
+    return xOff, yOff, xEnd - xOff, yEnd - yOff
+
+
+def sampleGrid(grid, geoTransform, x, y):
+    """
+    (numpy array, tuple, numpy array, numpy array) -> numpy array
+    grid: raster values, nan for nodata
+    geoTransform: GDAL geotransform of the grid
+
+    Purpose:
+    Bilinear interpolation of the grid at the points, from the four pixel centres around each point.
+    Points within half a pixel of the grid edge take the values of the edge pixels.
+    Returns the values, nan for a point outside of the grid or next to a nodata pixel
+    """
+    cols = (x - geoTransform[0]) / geoTransform[1] - 0.5
+    rows = (y - geoTransform[3]) / geoTransform[5] - 0.5
+    height, width = grid.shape
+    inside = (cols >= -0.5) & (cols <= width - 0.5) & (rows >= -0.5) & (rows <= height - 0.5)
+    cols = np.clip(np.nan_to_num(cols), 0, width - 1)
+    rows = np.clip(np.nan_to_num(rows), 0, height - 1)
+    col0 = np.minimum(np.floor(cols).astype(np.int64), max(width - 2, 0))
+    row0 = np.minimum(np.floor(rows).astype(np.int64), max(height - 2, 0))
+    col1 = np.minimum(col0 + 1, width - 1)
+    row1 = np.minimum(row0 + 1, height - 1)
+    colShare = cols - col0
+    rowShare = rows - row0
+    top = grid[row0, col0] * (1 - colShare) + grid[row0, col1] * colShare
+    bottom = grid[row1, col0] * (1 - colShare) + grid[row1, col1] * colShare
+    values = top * (1 - rowShare) + bottom * rowShare
+    values[~inside] = np.nan
+    return values
+
+
+def aglHeights(ele, dem):
+    """
+    Height above ground (m) of the points rounded to the metre, 0 below ground, nan without a DEM value
+    """
+    heights = np.rint(np.maximum(ele.astype(np.float64) - dem, 0))
+    heights[np.isnan(dem)] = np.nan
+    return heights
+
+
+def storeSelection(store, maxAGL):
+    """
+    (dict, float) -> numpy array
+    Purpose:
+    Indexes of the store points below maxAGL, read a chunk at a time.
+    Returns the indexes in store order
+    """
+    agl = store['columns']['AGL']
+    selections = [np.flatnonzero(agl[chunk] < maxAGL) + chunk.start for chunk in storeChunks(store['pointCount'])]
+    return np.concatenate(selections) if selections else np.array([], dtype=np.int64)
@@ -41,6 +41,8 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterString,
                        QgsProcessingParameterField,
                        QgsProcessingParameterDistance,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterBoolean,
                        QgsProcessingFeedback,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterMultipleLayers,
@@ -51,14 +53,17 @@ from qgis.core import (QgsProcessing,
                        QgsVectorFileWriter,
                        QgsException,
                        QgsProject)
-import glob
 import os
 
 import pandas as pd
 import processing
-from .flightPathAnalysis_Function_QGIS import rawBuffer, findBufferRange, replaceNonAlphaNum, convert_timedelta, makeViewshed
+from .flightPathAnalysis_Function_QGIS import (replaceNonAlphaNum, convert_timedelta, makeViewshed, createUWRBuffered,
+                                               flightTrackIndex, tiledJoin, groupFlightPoints, convertGPXFiles,
+                                               segmentIncursionTimes, buildPointStore, sampleStoreDEM,
+                                               writeStorePoints, projectFlightLines)
+from .flightPathAnalysis_Function_GPX import gpxSources
+from .flightPathAnalysis_Function_Store import storeSelection
 import shutil
-from pathlib import Path
 
 
 class createUWRBuffer(QgsProcessingAlgorithm):
@@ -82,6 +87,12 @@ class createUWRBuffer(QgsProcessingAlgorithm):
     buffDistIS_high = 'buffDistIS_high'
     buffDistIS_moderate = 'buffDistIS_moderate'
     buffDistIS_low = 'buffDistIS_low'
+    bufferWorkers = 'bufferWorkers'
+    buffTolerance = 'buffTolerance'
+    segmentReport = 'segmentReport'
+    gridSize = 'gridSize'
+    ringCache = 'ringCache'
+    ringCacheSize = 'ringCacheSize'
 
     def initAlgorithm(self, config):
         """
@@ -119,6 +130,43 @@ class createUWRBuffer(QgsProcessingAlgorithm):
         self.addParameter(QgsProcessingParameterString(
             self.buffDistIS_low, self.tr('Buffer distance - Low Incursion Severity'), 1500))
 
+        # ===========================================================================
+        # bufferWorkers - number of worker processes used to create the uwr buffers
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterNumber(
+            self.bufferWorkers, self.tr('Number of worker processes for buffering'),
+            QgsProcessingParameterNumber.Integer, 1, minValue=1))
+
+        # ===========================================================================
+        # buffTolerance - max distance (m) between the buffer arcs and a true circle, used to pick
+        # the number of buffer segments of each buffer distance. 0 keeps 90 segments
+        # segmentReport - compare vertex count and area of the buffers against 90 segments
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterNumber(
+            self.buffTolerance, self.tr('Max buffer deviation from a true circle (m), 0 = 90 segments'),
+            QgsProcessingParameterNumber.Double, 0, minValue=0))
+
+        # ===========================================================================
+        # gridSize - precision grid (m) of the ring differences, eg. 0.1. 0 keeps floating point overlay
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterNumber(
+            self.gridSize, self.tr('Precision grid of the buffer ring differences (m), 0 = floating point'),
+            QgsProcessingParameterNumber.Double, 0, minValue=0))
+
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.segmentReport, self.tr('Report buffer vertex count, area error and precision grid speed-up'), False))
+
+        # ===========================================================================
+        # ringCache - folder of the buffer ring cache shared between projects, with its max size in MB
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterFile(
+            self.ringCache, self.tr('Shared buffer ring cache folder'), QgsProcessingParameterFile.Folder,
+            optional=True))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.ringCacheSize, self.tr('Max size of the buffer ring cache (MB)'),
+            QgsProcessingParameterNumber.Integer, 500, minValue=1))
+
 
     def processAlgorithm(self, parameters, context, feedback):
         """
@@ -128,8 +176,6 @@ class createUWRBuffer(QgsProcessingAlgorithm):
         # to uniquely identify the feature sink, and must be included in the
         # dictionary returned by the processAlgorithm function.
         origUWR_source = self.parameterAsSource(parameters, self.origUWR, context)
-        origUWRPath = parameters['origUWR']
-        origUWR = None
         projectFolder = parameters['projectFolder']
         uwrBufferedPath = os.path.join(projectFolder, 'uwrBuffered')
         delFolder = os.path.join(projectFolder, 'delFolder')
@@ -157,237 +203,23 @@ class createUWRBuffer(QgsProcessingAlgorithm):
 
             bufferDistList = [int(parameters['buffDistIS_high']), int(parameters['buffDistIS_moderate']),
                               int(parameters['buffDistIS_low'])]
+            bufferWorkers = self.parameterAsInt(parameters, self.bufferWorkers, context)
+            buffTolerance = self.parameterAsDouble(parameters, self.buffTolerance, context)
+            segmentReport = self.parameterAsBool(parameters, self.segmentReport, context)
+            gridSize = self.parameterAsDouble(parameters, self.gridSize, context)
+            ringCacheFolder = self.parameterAsFile(parameters, self.ringCache, context)
+            ringCacheSize = self.parameterAsInt(parameters, self.ringCacheSize, context)
             feedback.setProgressText(str(bufferDistList))
 
-            # ===========================================================================
-            # Check if the input vector includes invalid geometry
-            # ===========================================================================
-            result = processing.run("qgis:checkvalidity", {
-                'INPUT_LAYER':origUWRPath})
-            errorCount = result['ERROR_COUNT']
-            feedback.setProgressText(str(errorCount))
-
-            # ===========================================================================
-            # Fix the input geometry if invalid found, and replace the input for further process
-            # ===========================================================================
-            if errorCount > 0:
-                fixGeom = processing.run("native:fixgeometries",
-                                         {'INPUT': origUWRPath,
-                                          'OUTPUT': 'TEMPORARY_OUTPUT'})
-                feedback.setProgressText('Geometry fixed')
-                origUWR = fixGeom['OUTPUT']
-
-            else:
-                feedback.setProgressText('No need to fix geometry')
-                origUWR = origUWR_source
-
-
             # ==============================================================
-            # Get list of relevant UWR
+            # Create or update uwrBuffered, only new or changed uwr are buffered
             # ==============================================================
-            origUWRFieldList = origUWR.fields().names()
-            unit_no_index = origUWRFieldList.index(unit_no)
-            unit_no_id_index = origUWRFieldList.index(unit_no_id)
-            feedback.setProgressText(f'{unit_no_id_index, unit_no_index}')
-            uwrSet = set()
-            for feature in origUWR.getFeatures():
-                uwr_unique_Field_value = f'{feature.attributes()[unit_no_index]}__{feature.attributes()[unit_no_id_index]}'
-                uwrSet.add(uwr_unique_Field_value)
-
-            feedback.setProgressText(f'{uwr_unique_Field} added and updated')
-            feedback.setProgressText(f'{uwrSet} added and updated')
-
-            # ==============================================================
-            # Check existence of uwrBuffered in project folder
-            # ==============================================================
-            uwrBuffered_exist = os.path.isfile(uwrBufferedPath + '.gpkg')
-
-            # ==============================================================
-            # Get list of uwr that have buffers created
-            # ==============================================================
-            if uwrBuffered_exist:
-                feedback.setProgressText(f'uwrBuffered exists in project folder.')
-                createdUWRSet = set()
-                uwrBuffered_layer = QgsVectorLayer((uwrBufferedPath + '.gpkg'), "uwrBuffered", "ogr")
-                uwrBufferedFieldList = uwrBuffered_layer.fields().names()
-                feedback.setProgressText(f'{uwrBufferedFieldList}')
-                uwr_unique_Field_index = uwrBufferedFieldList.index(uwr_unique_Field)
-                feedback.setProgressText(f'{uwrBufferedFieldList}')
-                for feature in uwrBuffered_layer.getFeatures():
-                    uwr_unique_Field_value =  f'{feature.attributes()[uwr_unique_Field_index]}'
-                    createdUWRSet.add(uwr_unique_Field_value)
-
-                uwrRequireSet = uwrSet - createdUWRSet
-                feedback.setProgressText(f'{uwrSet} --uwrSet')
-                feedback.setProgressText(f'{createdUWRSet} -- createdUWRSet')
-                feedback.setProgressText(f'{uwrRequireSet} --uwrRequireSet')
-
-            else:
-                uwrRequireSet = uwrSet
-                feedback.setProgressText(f'uwrBuffered NOT exists in project folder.')
-
-
-            if len(uwrRequireSet) > 0:
-                if uwrBuffered_exist:
-                # ==============================================================
-                # Make new field in copy of orig UWR FC for unique UWR id.
-                # DIFFERENT FROM unique uwr id. make it so that there's no way this field existed before
-                # ==============================================================
-                    tempUniqueUWRField = 'tempUniqueUWRField'
-                    if tempUniqueUWRField not in origUWRFieldList:
-                        tempGPKG = processing.run("native:fieldcalculator",
-                                                  {'FIELD_LENGTH': 100,
-                                                   'FIELD_NAME': tempUniqueUWRField,
-                                                   'NEW_FIELD': True,
-                                                   'FIELD_PRECISION': 0,
-                                                   'FIELD_TYPE': 2,
-                                                   'FORMULA': f' "{unit_no}" + \'__\' + "{unit_no_id}" ',
-                                                   'INPUT': origUWR,
-                                                   'OUTPUT': 'TEMPORARY_OUTPUT'}, context=context, feedback=feedback)['OUTPUT']
-
-
-                    # ==============================================================
-                    # Select require uwr by making query with uwrRequireSet
-                    # ==============================================================
-                    uwrList_String = "','".join(uwrRequireSet)
-                    unbufferedFL = os.path.join(projectFolder, 'unbufferedUWR')
-                    expression = tempUniqueUWRField + " in ('" + uwrList_String + "')"
-                    unbufferedFLPath = processing.run("native:extractbyexpression",
-                                   {'EXPRESSION': expression,
-                                    'INPUT': tempGPKG,
-                                    'OUTPUT': unbufferedFL})['OUTPUT']
-                    feedback.setProgressText(f'unBufferedUWR created in {unbufferedFL}')
-                    requireUWRLayer = unbufferedFLPath
-                else:
-                    requireUWRLayer = origUWR
-                    feedback.setProgressText('requireUWRLayer = origUWR')
-
-                # ==============================================================
-                # Dissolves input feature class by dissolveFields list if list is given
-                # This is to avoid errors for multi-part uwr that have been split into
-                # separate features in the original uwr feature class.
-                # ==============================================================
-                dissolvedOrigPath = os.path.join(projectFolder, 'dissolve')
-                dissolvedOrig = processing.run("native:dissolve",
-                                               {'FIELD': [unit_no, unit_no_id],
-                                                'INPUT': requireUWRLayer,
-                                                'OUTPUT': 'TEMPORARY_OUTPUT',
-                                                'SEPARATE_DISJOINT': False})['OUTPUT']
-                dissolvedOrig_fid_removed = processing.run("native:deletecolumn",
-                                               {'COLUMN': ['fid'],
-                                                'INPUT': dissolvedOrig,
-                                                'OUTPUT': dissolvedOrigPath})['OUTPUT']
-
-                # ============re==================================================
-                # Start list of intermediate features to be deleted
-                # ==============================================================
-                uwrOnly = "BufferUWROnly"
-                delFC = [os.path.join(projectFolder, uwrOnly)]
-
-                # ==============================================================
-                # Create raw buffers
-                # ==============================================================
-                rawBufferDict = {}
-                for bufferDist in bufferDistList:
-                    rawBufferLoc, rawBufferName = rawBuffer(projectFolder, 'dissolve.gpkg',
-                                                  str(bufferDist) + 'Meters', bufferDist, delFolder,
-                                                      unit_no, unit_no_id, uwr_unique_Field)
-                    rawBufferDict[bufferDist] = [rawBufferLoc, rawBufferName]
-                    delFC.append(os.path.join(rawBufferLoc, rawBufferName))
-                    feedback.setProgressText(f"raw buffer created, {rawBufferName}")
-
-                # ==============================================================
-                # Get donut shaped buffer to only get list of buffered donut polygons
-                # that will be merge together to the final layer
-                # ==============================================================
-                requireMergeBufferList = []
-
-                # ==============================================================
-                # Go through each buffer distance to get the donut shapes of
-                # only the area for each buffer distance
-                # ==============================================================
-                uniqueIDFields = [unit_no, unit_no_id]
-                sortBufferDistList = list(sorted(bufferDistList))
-                feedback.setProgressText(f'{sortBufferDistList} -- sortedBuffer')
-                for bufferDist in sortBufferDistList:
-                    ToEraseLoc = rawBufferDict[bufferDist][0]
-                    ToEraseName = rawBufferDict[bufferDist][1] + '.gpkg'
-                    ToErasePath = os.path.join(ToEraseLoc, ToEraseName)
-                    feedback.setProgressText(f'{ToEraseLoc} and {ToEraseName}')
-                    feedback.setProgressText(f'{bufferDist} -- Bufferdist')
-
-                    if sortBufferDistList.index(bufferDist) == 0:
-                        onlyBufferDist = findBufferRange(dissolvedOrig_fid_removed, ToErasePath, uniqueIDFields, delFolder, bufferDist)
-                        feedback.setProgressText(f'UseToErasePath - {dissolvedOrig_fid_removed}')
-                        feedback.setProgressText(f'ToErasePath - {ToErasePath}')
-                    else:
-                        prevIndex = sortBufferDistList.index(bufferDist) - 1
-                        prevBufferDist = sortBufferDistList[prevIndex]
-                        prevBufferPath = os.path.join(rawBufferDict[prevBufferDist][0], rawBufferDict[prevBufferDist][1] + '.gpkg')
-                        feedback.setProgressText(prevBufferPath)
-                        feedback.setProgressText(f'UseToErasePath - {prevBufferPath}')
-                        feedback.setProgressText(f'ToErasePath - {ToErasePath}')
-                        onlyBufferDist = findBufferRange(prevBufferPath, ToErasePath, uniqueIDFields, delFolder, bufferDist)
-
-                    requireMergeBufferList.append(onlyBufferDist)
-                    feedback.setProgressText(f'appended uwronly{onlyBufferDist} -- onlyBufferDist')
-
-                # ==============================================================
-                # Create bufferUWROnly_NEW with uwr_unique_field and BUFF_DIST fields
-                # ==============================================================
-                uwrOnlyNewPath = os.path.join(projectFolder, uwrOnly)
-                uwrOnly_new = processing.run("native:savefeatures",
-                                               {'INPUT': dissolvedOrig_fid_removed,
-                                                'OUTPUT': 'TEMPORARY_OUTPUT',
-                                                'LAYER_NAME': '',
-                                                'DATASOURCE_OPTIONS': '',
-                                                'LAYER_OPTIONS': ''})['OUTPUT']
-
-                uwrOnly_new_uniField = processing.run("native:fieldcalculator",
-                                       {'FIELD_LENGTH': 100,
-                                        'FIELD_NAME': uwr_unique_Field,
-                                        'NEW_FIELD': True,
-                                        'FIELD_PRECISION': 0,
-                                        'FIELD_TYPE': 2,
-                                        'FORMULA': f' "{unit_no}" + \'__\' + "{unit_no_id}" ',
-                                        'INPUT': uwrOnly_new,
-                                        'OUTPUT': 'TEMPORARY_OUTPUT'}, context=context, feedback=feedback)['OUTPUT']
-
-                uwrOnly_new_uniField_buffDist = processing.run("native:fieldcalculator",
-                                       {'FIELD_LENGTH': 100,
-                                        'FIELD_NAME': 'BUFF_DIST',
-                                        'NEW_FIELD': True,
-                                        'FIELD_PRECISION': 0,
-                                        'FIELD_TYPE': 0,
-                                        'FORMULA': 0,
-                                        'INPUT': uwrOnly_new_uniField,
-                                        'OUTPUT': uwrOnlyNewPath}, context=context, feedback=feedback)['OUTPUT']
-                requireMergeBufferList.append(uwrOnly_new_uniField_buffDist)
-
-                feedback.setProgressText(f'{uwrOnly_new_uniField_buffDist} created')
-
-                # ==============================================================
-                # Append uwr into the final geopackage or create a new one
-                # ==============================================================
-                if uwrBuffered_exist:
-                    requireMergeBufferList.append(uwrBuffered_layer)
-                    final = processing.run("native:mergevectorlayers",
-                                           {'LAYERS': requireMergeBufferList,
-                                            'OUTPUT': uwrBufferedPath + '_updated'})['OUTPUT']
-                    feedback.setProgressText('final geopackage exists')
-
-                else:
-                    final = processing.run("native:mergevectorlayers",
-                                           {'LAYERS': requireMergeBufferList,
-                                            'OUTPUT': uwrBufferedPath})['OUTPUT']
-                    for f in requireMergeBufferList:
-                        feedback.setProgressText(f'{f} merged')
-
-                finalLyr = QgsVectorLayer(final, 'uwrBuffered', "ogr")
-                QgsProject.instance().addMapLayer(finalLyr)
-            else:
-                feedback.setProgressText(f'No Need to create uwr buffers')
-                QgsProject.instance().addMapLayer(uwrBuffered_layer)
+            final = createUWRBuffered(origUWR_source, projectFolder, bufferDistList, unit_no, unit_no_id,
+                                      uwr_unique_Field, feedback, bufferWorkers, buffTolerance, segmentReport,
+                                      gridSize=gridSize, ringCacheFolder=ringCacheFolder,
+                                      ringCacheSize=ringCacheSize)
+            finalLyr = QgsVectorLayer(final, 'uwrBuffered', "ogr")
+            QgsProject.instance().addMapLayer(finalLyr)
 
         except QgsException as e:
             feedback.setProgressText('Something is wrong')
@@ -487,6 +319,13 @@ class flightPathConvert(QgsProcessingAlgorithm):
     unit_id = 'unit_id'
     unit_id_no = 'unit_id_no'
     DEM = 'DEM'
+    tileSize = 'tileSize'
+    gpxWorkers = 'gpxWorkers'
+    gpxPrefetch = 'gpxPrefetch'
+    maxTimeGap = 'maxTimeGap'
+    skipDuplicates = 'skipDuplicates'
+    reduceTolerance = 'reduceTolerance'
+    segmentTiming = 'segmentTiming'
 
     def initAlgorithm(self, config):
         """
@@ -527,6 +366,59 @@ class flightPathConvert(QgsProcessingAlgorithm):
         self.addParameter(QgsProcessingParameterRasterLayer(
             self.DEM, self.tr('Input the project DEM')))
 
+        # ===========================================================================
+        # tileSize - size (m) of the tiles the flight points are classified in, 0 classifies all at once
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterNumber(
+            self.tileSize, self.tr('Tile size for classifying flight points (m), 0 = no tiles'),
+            QgsProcessingParameterNumber.Double, 0, minValue=0))
+
+        # ===========================================================================
+        # gpxWorkers - number of worker processes used to read the gpx files
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterNumber(
+            self.gpxWorkers, self.tr('Number of worker processes for reading gpx files'),
+            QgsProcessingParameterNumber.Integer, 1, minValue=1))
+
+        # ===========================================================================
+        # gpxPrefetch - number of gpx files read ahead by reader threads while the previous ones are
+        # processed, when the files are read with one worker. 0, the default, reads each file when
+        # it's needed
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterNumber(
+            self.gpxPrefetch, self.tr('Number of gpx files read ahead'),
+            QgsProcessingParameterNumber.Integer, 0, minValue=0))
+
+        # ===========================================================================
+        # maxTimeGap - longest time (s) between two gpx points counted as flight time, longer gaps
+        # (logger dropouts) are capped to it. 0 counts every gap
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterNumber(
+            self.maxTimeGap, self.tr('Longest time between gpx points counted as flight time (s), 0 = no limit'),
+            QgsProcessingParameterNumber.Double, 60, minValue=0))
+
+        # ===========================================================================
+        # skipDuplicates - leave out the flights uploaded twice, under another name or trimmed.
+        # Duplicates are listed in duplicateGPXFiles.txt either way
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.skipDuplicates, self.tr('Skip duplicate flights (listed in duplicateGPXFiles.txt)'), True))
+
+        # ===========================================================================
+        # reduceTolerance - position error (m) allowed when collapsing hovering points and downsampling
+        # straight flight, each kept point carries the time of the points it replaces. 0 keeps every point
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterNumber(
+            self.reduceTolerance, self.tr('Flight point reduction tolerance (m), 0 = keep every point'),
+            QgsProcessingParameterNumber.Double, 0, minValue=0))
+
+        # ===========================================================================
+        # segmentTiming - also time the incursions by flight segments, with the ring entry and exit
+        # times interpolated along each segment, into allSegmentStats.xlsx
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.segmentTiming, self.tr('Time incursions by flight segments (allSegmentStats.xlsx)'), False))
+
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
@@ -539,6 +431,14 @@ class flightPathConvert(QgsProcessingAlgorithm):
         uwrBufferedPath = parameters['uwrBuffered']
         gpxFolder = parameters['gpxFolder']
         DEM = parameters['DEM']
+        demPath = self.parameterAsRasterLayer(parameters, self.DEM, context).source()
+        tileSize = self.parameterAsDouble(parameters, self.tileSize, context)
+        gpxWorkers = self.parameterAsInt(parameters, self.gpxWorkers, context)
+        gpxPrefetch = self.parameterAsInt(parameters, self.gpxPrefetch, context)
+        maxTimeGap = self.parameterAsDouble(parameters, self.maxTimeGap, context)
+        skipDuplicates = self.parameterAsBool(parameters, self.skipDuplicates, context)
+        reduceTolerance = self.parameterAsDouble(parameters, self.reduceTolerance, context)
+        segmentTiming = self.parameterAsBool(parameters, self.segmentTiming, context)
         delFolder = os.path.join(projectFolder, 'delFolder')
 
         # ==============================================================
@@ -563,14 +463,14 @@ class flightPathConvert(QgsProcessingAlgorithm):
 
         # ==============================================================
         # Create variables for converting all gpx files into fc
-        # timeIntervalDict - dictionary of different time intervals and the flight points in each
-        # flightLines - lists of flight lines
+        # flightPoints - season table of the flight points, each point with its TInterval
+        # flightLines - season table of the flight lines
         # flightCount - count of flight lines
         # totalSeasonTime- total flight time in the season
         # checkFilesList - checkFilesList
         # ==============================================================
-        timeIntervalDict = {}
-        flightLines = []
+        flightPoints = None
+        flightLines = None
         flightCount = 0
         totalSeasonTime = 0
         checkFilesList = []
@@ -578,8 +478,7 @@ class flightPathConvert(QgsProcessingAlgorithm):
         # ===========================================================================
         # Loop through the input GPX folder
         # ===========================================================================
-        gpxFiles = glob.glob(os.path.join(gpxFolder, "*.gpx"))
-        gpxTemps = []
+        gpxFiles = gpxSources(gpxFolder)
 
         try:
             # ===========================================================================
@@ -595,352 +494,60 @@ class flightPathConvert(QgsProcessingAlgorithm):
                 os.mkdir(delFolder)
 
             # ===========================================================================
-            # Get the row count of each GPX file, and the required information from different layers
+            # Convert the GPX files into flight points and flight lines.
+            # gpxIngest keeps the converted flights between runs, only new or modified gpx files are read
             # ===========================================================================
-            for gpxFile in gpxFiles:
-                flightCount += 1
-                feedback.setProgressText(f'{str(flightCount)}: {str(gpxFile)}')
-                gpxFormattedName = replaceNonAlphaNum(Path(gpxFile).stem, '_')
-                feedback.setProgressText(f'{gpxFormattedName}')
-
-                gpxDict = {'tkpt': '|layername=track_points', 'tkline': '|layername=tracks'}
-                rowCount = processing.run("qgis:basicstatisticsforfields",
-                                          {'INPUT_LAYER': gpxFile + gpxDict['tkpt'],
-                                           'FIELD_NAME': 'time',
-                                           'OUTPUT_HTML_FILE': 'TEMPORARY_OUTPUT'})['COUNT']
-                tkLyr = QgsVectorLayer((gpxFile + gpxDict['tkline']), "", "ogr")
-                tkLyrNameIndex = (tkLyr.fields().names()).index('name')
-                if tkLyrNameIndex != None:
-                    tkLyrFeatures = tkLyr.getFeatures()
-                    for feature in tkLyrFeatures:
-                        tkLyrName = str(feature.attributes()[tkLyrNameIndex])
-                        feedback.setProgressText(f'{tkLyrName}')
-                feedback.setProgressText(f'{rowCount}')
-
-                # ==============================================================
-                # Checks for files with consistent time intervals.
-                #  - All fc with same time intervals are grouped together in the dictionary
-                #  - If there are more than 2 rows
-                #       - find time between point recorded halfway through the flight and the point recorded right before it.
-                #       - else,time for objectid 3 - objectid 2 because there was an instance where there were 4 minutes between id 1 and 2.
-                #         assume only seconds between them the two points
-                # ==============================================================
-                tkptLyr_id = processing.run("native:fieldcalculator",
-                                            {'FIELD_LENGTH': 100,
-                                             'FIELD_NAME': 'OBJECTID',
-                                             'NEW_FIELD': True,
-                                             'FIELD_PRECISION': 0,
-                                             'FIELD_TYPE': 0,
-                                             'FORMULA': '$id',
-                                             'INPUT': gpxFile + gpxDict['tkpt'],
-                                             'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
-                query = None
-                if int(rowCount) > 2:
-                    half = round(int(rowCount) / 2)
-                    sel = (half - 1, half)
-                    query = "OBJECTID in " + str(sel)
-                elif int(rowCount) == 2:
-                    half = round(int(rowCount) / 2)
-                    sel = (half - 1, half)
-                    query = "OBJECTID in (0,1)"
-                else:
-                    checkFilesList.append(gpxFile)
-                    continue
-
-                if query != None:
-                    tkptLyrExtracted = processing.run("native:extractbyexpression",
-                                                    {'EXPRESSION': query,
-                                                     'INPUT': tkptLyr_id,
-                                                     'OUTPUT': os.path.join(delFolder, 'tkptExtracted' + str(flightCount))})['OUTPUT']
-                    tkptLyr = QgsVectorLayer((tkptLyrExtracted), "", "ogr")
-                    tkptExtractedTimeIndex = (tkptLyr.fields().names()).index('time')
-                    features = tkptLyr.getFeatures()
-                    values = []
-                    # ==============================================================
-                    # Calculate the time interval and the totalFlightTime
-                    # ==============================================================
-                    for f in features:
-                        timeValue = f.attributes()[tkptExtractedTimeIndex]
-                        values.append(timeValue)
-                    timeInterval = values[1].toTime_t() - values[0].toTime_t()
-                    totalFlightTime = rowCount * timeInterval
-                    feedback.setProgressText(f'The total flight time of {gpxFormattedName} is {totalFlightTime} seconds')
-
-
-                # ===========================================================================
-                # Add the Name field from tracks layer to track points layer
-                # ===========================================================================
-                gpxTempPath = os.path.join(delFolder, 'temp_' + gpxFormattedName)
-                feedback.setProgressText(f'{gpxTempPath}')
-                gpxTemp_saved = processing.run("native:savefeatures",
-                                               {'INPUT': gpxFile + gpxDict['tkpt'],
-                                                'OUTPUT': 'TEMPORARY_OUTPUT',
-                                                'LAYER_NAME': '',
-                                                'DATASOURCE_OPTIONS': '',
-                                                'LAYER_OPTIONS': ''})['OUTPUT']
-
-                gpxField_name_new = processing.run("native:fieldcalculator",
-                                       {'FIELD_LENGTH': 30,
-                                        'FIELD_NAME': 'NameTkline',
-                                        'NEW_FIELD': True,
-                                        'FIELD_PRECISION': 0,
-                                        'FIELD_TYPE': 2,
-                                        'FORMULA':  f"'{tkLyrName}'",
-                                        'INPUT': gpxTemp_saved,
-                                        'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
-
-                # ===========================================================================
-                # Add the flightName field
-                # ===========================================================================
-                gpxField_flightName = processing.run("native:fieldcalculator",
-                                       {'FIELD_LENGTH': 100,
-                                        'FIELD_NAME': 'FlightName',
-                                        'NEW_FIELD': True,
-                                        'FIELD_PRECISION': 0,
-                                        'FIELD_TYPE': 2,
-                                        'FORMULA':  f"'{gpxFormattedName}'",
-                                        'INPUT': gpxField_name_new,
-                                        'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
-
-
-                # ===========================================================================
-                # Add the TotalTime field
-                # ===========================================================================
-                gpxTemp = processing.run("native:fieldcalculator",
-                                       {'FIELD_LENGTH': 100,
-                                        'FIELD_NAME': 'TotalTime',
-                                        'NEW_FIELD': True,
-                                        'FIELD_PRECISION': 2,
-                                        'FIELD_TYPE': 0,
-                                        'FORMULA':  f"'{totalFlightTime}'",
-                                        'INPUT': gpxField_flightName,
-                                        'OUTPUT': gpxTempPath}, context=context, feedback=feedback)['OUTPUT']
-
-                gpxTemps.append(gpxTemp)
-
-                # ===========================================================================
-                # Create flight line
-                # ===========================================================================
-                flightLineName = gpxFormattedName + '__flightLine'
-                flightLinePath = os.path.join(delFolder, flightLineName)
-                flightline = processing.run("native:pointstopath",
-                                            {'INPUT':gpxTemp,
-                                             'CLOSE_PATH':False,
-                                             'ORDER_EXPRESSION':'',
-                                             'NATURAL_SORT':False,
-                                             'GROUP_EXPRESSION':'',
-                                             'OUTPUT':'TEMPORARY_OUTPUT'})['OUTPUT']
-
-                flightLineNameField = processing.run("native:fieldcalculator",
-                                       {'FIELD_LENGTH': 100,
-                                        'FIELD_NAME': 'Name',
-                                        'NEW_FIELD': True,
-                                        'FIELD_PRECISION': 0,
-                                        'FIELD_TYPE': 2,
-                                        'FORMULA':  f"'{tkLyrName}'",
-                                        'INPUT': flightline,
-                                        'OUTPUT': flightLinePath})['OUTPUT']
-                flightLines.append(flightLineNameField + f'|layername={flightLineName}')
-                feedback.setProgressText(f'Flight Line: {flightLineNameField} appended')
-
-                # ===========================================================================
-                # Get season time sum
-                # ===========================================================================
-                totalSeasonTime += totalFlightTime
-                timeIntervalStr = "T" + replaceNonAlphaNum(str(timeInterval), "_")
-                if timeIntervalStr not in timeIntervalDict:
-                    timeIntervalDict[timeIntervalStr] = [timeInterval, [gpxTemp]]
-                else:
-                    timeIntervalDict[timeIntervalStr][1].append(gpxTemp)
-                feedback.setProgressText(f'===========================================')
-
+            ingestFolder = os.path.join(projectFolder, 'gpxIngest')
+            os.makedirs(ingestFolder, exist_ok=True)
+            flightPoints, flightLines, totalSeasonTime, checkFilesList, duplicateList = convertGPXFiles(
+                gpxFiles, ingestFolder, feedback, gpxWorkers, maxTimeGap, skipDuplicates, reduceTolerance,
+                gpxPrefetch, uwrBufferedPath, demPath)
+            flightCount = len(gpxFiles)
 
             # ===========================================================================
-            # Output the problem text to the gpx folder
+            # Output the problem and duplicate gpx files to the project folder
             # ===========================================================================
             if len(checkFilesList) > 0:
                 problemGPXText = open(os.path.join(projectFolder, 'problemGPXFiles.txt'), "w")
                 for i in checkFilesList:
                     problemGPXText.write(i + "\n")
                 problemGPXText.close()
+            if len(duplicateList) > 0:
+                duplicateGPXText = open(os.path.join(projectFolder, 'duplicateGPXFiles.txt'), "w")
+                for duplicateFile, originalFile in duplicateList:
+                    duplicateGPXText.write(duplicateFile + " is a duplicate of " + originalFile + "\n")
+                duplicateGPXText.close()
 
             feedback.setProgressText(f'Total season time : {totalSeasonTime}')
             feedback.setProgressText(f'Total flight line {flightCount}')
-            feedback.setProgressText(f'Number of different time interval {len(timeIntervalDict)}')
-            feedback.setProgressText(f'{timeIntervalDict}')
-
-            # ===========================================================================
-            # Unprojected
-            # ===========================================================================
-            unprojectedGPX = []
-            for interval in timeIntervalDict:
-                gpxAllUnprojectedPath = os.path.join(delFolder, interval + '_All_unprojected')
-                gpxMergeUnprojected = processing.run("native:mergevectorlayers",
-                                        {'LAYERS': timeIntervalDict[interval][1],
-                                         'CRS': None,
-                                         'OUTPUT': os.path.join(delFolder, 'mergeUnprojected')})['OUTPUT']
-
-                feedback.setProgressText(f'Merged all gpx file for {interval}')
-
-                # ===========================================================================
-                # Reproject GPX merge lyr, and create a dem extent to down the orig DEM
-                # ===========================================================================
-                gpxMergePprojected = processing.run("grass7:v.proj",
-                                                             {'input': gpxMergeUnprojected,
-                                                              'crs': QgsCoordinateReferenceSystem('EPSG:3005'),
-                                                              'smax': 10000, '-z': False, '-w': False,
-                                                              'output': os.path.join(delFolder, 'mergeProjected.gpkg'),
-                                                              'GRASS_REGION_PARAMETER': None,
-                                                              'GRASS_SNAP_TOLERANCE_PARAMETER': -1,
-                                                              'GRASS_MIN_AREA_PARAMETER': 0.0001,
-                                                              'GRASS_OUTPUT_TYPE_PARAMETER': 0,
-                                                              'GRASS_VECTOR_DSCO': '',
-                                                              'GRASS_VECTOR_LCO': '',
-                                                              'GRASS_VECTOR_EXPORT_NOCAT': False})['output']
-
-                gpxMergePprojected_extent = processing.run("native:polygonfromlayerextent",
-                               {'INPUT': gpxMergePprojected,
-                                'ROUND_TO': 0, 'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
-                demExtent = processing.run("native:buffer", {
-                    'INPUT': gpxMergePprojected_extent,
-                    'DISTANCE': 100, 'SEGMENTS': 90, 'END_CAP_STYLE': 2, 'JOIN_STYLE': 0, 'MITER_LIMIT': 2,
-                    'DISSOLVE': False, 'OUTPUT': os.path.join(delFolder, 'gpxMergeProjected_extent')})['OUTPUT']
-
-                demClipped = processing.run("gdal:cliprasterbymasklayer",
-                                            {'INPUT':DEM,
-                                             'MASK':demExtent,
-                                             'SOURCE_CRS':None,'TARGET_CRS':None,'TARGET_EXTENT':None,'NODATA':None,'ALPHA_BAND':False,'CROP_TO_CUTLINE':True,
-                                             'KEEP_RESOLUTION':True,'SET_RESOLUTION':False,'X_RESOLUTION':None,'Y_RESOLUTION':None,'MULTITHREADING':False,
-                                             'OPTIONS':'','DATA_TYPE':0,'EXTRA':'','OUTPUT':os.path.join(delFolder, 'demElev.tif')})['OUTPUT']
-                # ===========================================================================
-                # Extract the elevation values to points, default field name: DEMelev
-                # ===========================================================================
-                DEMElev = processing.run("sagang:addrastervaluestopoints",
-                               {'SHAPES': gpxMergePprojected,
-                                'GRIDS': [demClipped],
-                                'RESULT': 'TEMPORARY_OUTPUT',
-                                'RESAMPLING': 3})['RESULT']
-                feedback.setProgressText(f'DEM extract value to point')
-
-                AGL = processing.run("native:fieldcalculator",
-                                            {'INPUT':DEMElev,
-                                             'FIELD_NAME':'AGL',
-                                             'FIELD_TYPE':1,
-                                             'FIELD_LENGTH':100,
-                                             'FIELD_PRECISION':0,
-                                             'FORMULA':'case\r\nwhen "ele" - "demElev" <0 then 0 \r\nelse "ele" - "demElev"\r\nend\r\n\r\n',
-                                             'OUTPUT':gpxAllUnprojectedPath})['OUTPUT']
-                # ===========================================================================
-                # Create layer with only points less than 500m
-                # ===========================================================================
-                pointLessthan500m_UnprojectedPath = os.path.join(delFolder,'PointLessthan500m_Unprojected' + interval)
-                pointLessthan500mExtracted = processing.run("native:extractbyexpression",
-                                                  {'EXPRESSION': '"AGL" < 500',
-                                                   'INPUT': AGL,
-                                                   'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
-                rowCount = processing.run("qgis:basicstatisticsforfields",
-                                          {'INPUT_LAYER': pointLessthan500mExtracted,
-                                           'FIELD_NAME': 'time',
-                                           'OUTPUT_HTML_FILE': 'TEMPORARY_OUTPUT'})['COUNT']
-                feedback.setProgressText(f'point less than 500, row count: {rowCount}')
-                if rowCount == 0:
-                    feedback.setProgressText(f'point less than 500m layer table is empty')
-                    continue
-
-                # ===========================================================================
-                # Add time interval field
-                # ===========================================================================
-                timeIntervalField = processing.run("native:fieldcalculator",
-                                            {'INPUT':pointLessthan500mExtracted,
-                                             'FIELD_NAME':'TimeInterval',
-                                             'FIELD_TYPE':0,
-                                             'FIELD_LENGTH':100,
-                                             'FIELD_PRECISION':0,
-                                             'FORMULA':f"'{timeIntervalDict[interval][0]}'",
-                                             'OUTPUT':pointLessthan500m_UnprojectedPath})['OUTPUT']
-                feedback.setProgressText(f'TimeInterval field added')
-                unprojectedGPX.append(timeIntervalField + f'|layername=PointLessthan500m_Unprojected{interval}')
-                feedback.setProgressText(f'Unprojected layer:{timeIntervalField} appended')
-            feedback.setProgressText(f'{unprojectedGPX}')
 
             # ===========================================================================
-            # Merge all unprojectedGPS layers that includes points below 500m
+            # Load the flight points of the season table into the season point store, projected to EPSG:3005,
+            # and calculate their AGL from the DEM. The stages below read the store a slice at a time
             # ===========================================================================
-            if len(unprojectedGPX) > 1:
-                gpxMergeUnprojected_500m = processing.run("sagang:mergevectorlayers", {
-                'INPUT': unprojectedGPX,
-                'MERGED': os.path.join(delFolder, 'pointLessthan500m_Unprojected_Final'),
-                'SRCINFO': False,
-                'MATCH': True,
-                'DELETE': False})['MERGED'] + '.shp'
-            else:
-                gpxMergeUnprojected_500m = unprojectedGPX[0]
-
+            store = buildPointStore(flightPoints, os.path.join(ingestFolder, 'pointStore'), feedback)
+            sampleStoreDEM(store, demPath, feedback)
 
-            feedback.setProgressText(f'{gpxMergeUnprojected_500m} created')
             # ===========================================================================
-            # Remove blank fields from gpxMergeUnprojected_500m_Final
+            # Write the points less than 500m, projected to ESPG 3005
             # ===========================================================================
-            gpxMergeUnprojected_500m_reprojected = processing.run("native:refactorfields",
-                                                {'INPUT':gpxMergeUnprojected_500m,
-                                                'FIELDS_MAPPING':[{'expression': '"cat"','length': 16,'name': 'cat','precision': 0,'sub_type': 0,'type': 4,'type_name': 'int8'},
-                                                                  {'expression': '"ele"','length': 18,'name': 'ele','precision': 10,'sub_type': 0,'type': 6,'type_name': 'double precision'},
-                                                                  {'expression': '"time"','length': 23,'name': 'time','precision': 0,'sub_type': 0,'type': 10,'type_name': 'text'},
-                                                                  {'expression': '"hdop"','length': 18,'name': 'hdop','precision': 10,'sub_type': 0,'type': 6,'type_name': 'double precision'},
-                                                                  {'expression': '"badelf_spe"','length': 18,'name': 'badelf_spe','precision': 10,'sub_type': 0,'type': 6,'type_name': 'double precision'},
-                                                                  {'expression': '"NameTkline"','length': 35,'name': 'NameTkline','precision': 0,'sub_type': 0,'type': 10,'type_name': 'text'},
-                                                                  {'expression': '"FlightName"','length': 34,'name': 'FlightName','precision': 0,'sub_type': 0,'type': 10,'type_name': 'text'},
-                                                                  {'expression': '"TotalTime"','length': 18,'name': 'TotalTime','precision': 10,'sub_type': 0,'type': 6,'type_name': 'double precision'},
-                                                                  {'expression': '"layer"','length': 39,'name': 'layer','precision': 0,'sub_type': 0,'type': 10,'type_name': 'text'},
-                                                                  {'expression': '"demElev"','length': 18,'name': 'demElev','precision': 10,'sub_type': 0,'type': 6,'type_name': 'double precision'},
-                                                                  {'expression': '"AGL"','length': 16,'name': 'AGL','precision': 0,'sub_type': 0,'type': 4,'type_name': 'int8'},
-                                                                  {'expression': '"TimeInterval"','length': 18,'name': 'TimeInterval','precision': 10,'sub_type': 0,'type': 6,'type_name': 'double precision'}],
-                                                 'OUTPUT':'TEMPORARY_OUTPUT'})['OUTPUT']
+            pointLessthan500m = storeSelection(store, 500)
+            rowCount = len(pointLessthan500m)
+            feedback.setProgressText(f'point less than 500, row count: {rowCount}')
+            if rowCount == 0:
+                raise SystemExit("No flight points below 500m")
 
-            # ===========================================================================
-            # Reproject the result to ESPG 3005
-            # ===========================================================================
-            feedback.setProgressText(f'Reprojecting allFlightPoints....')
-            pointLessthan500m_Projected = processing.run("grass7:v.proj",
-                                                         {'input':gpxMergeUnprojected_500m_reprojected,
-                                                         'crs':QgsCoordinateReferenceSystem('EPSG:3005'),
-                                                          'smax':10000,'-z':False,'-w':False,
-                                                          'output':os.path.join(projectFolder, 'pointLessthan500m_Projected.gpkg'),
-                                                          'GRASS_REGION_PARAMETER':None,
-                                                          'GRASS_SNAP_TOLERANCE_PARAMETER':-1,
-                                                          'GRASS_MIN_AREA_PARAMETER':0.0001,
-                                                          'GRASS_OUTPUT_TYPE_PARAMETER':0,
-                                                          'GRASS_VECTOR_DSCO':'',
-                                                          'GRASS_VECTOR_LCO':'',
-                                                          'GRASS_VECTOR_EXPORT_NOCAT':False})['output']
-            feedback.setProgressText(f'Reprojected allFlightPoints')
+            pointLessthan500m_Projected = writeStorePoints(store, pointLessthan500m, flightPoints,
+                                                           os.path.join(projectFolder, 'pointLessthan500m_Projected.gpkg'),
+                                                           feedback)
 
             # ===========================================================================
-            # Merge all the flight lines
+            # All the flight lines are in the season table
             # ===========================================================================
-            gpxMergeFlightLines = processing.run("native:mergevectorlayers",
-                                    {'LAYERS': flightLines,
-                                    'CRS': None,
-                                    'OUTPUT': os.path.join(delFolder, 'allFlightLinesUnprojected')})['OUTPUT']
+            gpxMergeFlightLines = flightLines
             feedback.setProgressText(f'Reprojecting allFlightLines....')
 
-            allFlightLines_Projected = processing.run("grass7:v.proj",
-                                                         {'input': gpxMergeFlightLines,
-                                                          'crs': QgsCoordinateReferenceSystem('EPSG:3005'),
-                                                          'smax': 10000, '-z': False, '-w': False,
-                                                          'output': 'TEMPORARY_OUTPUT',
-                                                          'GRASS_REGION_PARAMETER': None,
-                                                          'GRASS_SNAP_TOLERANCE_PARAMETER': -1,
-                                                          'GRASS_MIN_AREA_PARAMETER': 0.0001,
-                                                          'GRASS_OUTPUT_TYPE_PARAMETER': 0,
-                                                          'GRASS_VECTOR_DSCO': '',
-                                                          'GRASS_VECTOR_LCO': '',
-                                                          'GRASS_VECTOR_EXPORT_NOCAT': False})['output']
-
-            allFlightLines = processing.run("native:savefeatures", {
-                'INPUT': allFlightLines_Projected,
-                'OUTPUT': os.path.join(projectFolder, 'allFlightLines'), 'LAYER_NAME': '',
-                'DATASOURCE_OPTIONS': '', 'LAYER_OPTIONS': ''})
+            projectFlightLines(gpxMergeFlightLines, os.path.join(projectFolder, 'allFlightLines.gpkg'), feedback)
             feedback.setProgressText(f'Reprojected allFlightLines')
 
             # ===========================================================================
@@ -973,15 +580,19 @@ class flightPathConvert(QgsProcessingAlgorithm):
             # ===========================================================================
             # Spatial join the pointLessthan500m and the selected uwebuffered field
             # ===========================================================================
-            pointLessthan500m_uwrbuffer = processing.run("native:joinattributesbylocation",
-                                  {'INPUT':heightRangeField,
-                                   'PREDICATE':[0],
-                                   'JOIN':uwr_fieldMapping,
-                                   'JOIN_FIELDS':[],
-                                   'METHOD':0,
-                                   'DISCARD_NONMATCHING':True,
-                                   'PREFIX':'',
-                                   'OUTPUT':os.path.join(delFolder, 'Point_lessthan500Height_uwrbuffer')})['OUTPUT']
+            if tileSize > 0:
+                pointLessthan500m_uwrbuffer = tiledJoin(heightRangeField, uwr_fieldMapping, uwr_unique_Field, tileSize,
+                                                        delFolder, 'Point_lessthan500Height_uwrbuffer', feedback)
+            else:
+                pointLessthan500m_uwrbuffer = processing.run("native:joinattributesbylocation",
+                                      {'INPUT':heightRangeField,
+                                       'PREDICATE':[0],
+                                       'JOIN':uwr_fieldMapping,
+                                       'JOIN_FIELDS':[],
+                                       'METHOD':0,
+                                       'DISCARD_NONMATCHING':True,
+                                       'PREFIX':'',
+                                       'OUTPUT':os.path.join(delFolder, 'Point_lessthan500Height_uwrbuffer')})['OUTPUT']
 
             # ==============================================================
             # If table is empty, ie, no point within uwr buffer zones, no need to get a table
@@ -1023,6 +634,15 @@ class flightPathConvert(QgsProcessingAlgorithm):
                                             'INPUT': incursionSeverityField,
                                             'OUTPUT': os.path.join(projectFolder, name)})['OUTPUT']
                 feedback.setProgressText(f'{diffISlyr} created')
+
+            # ==============================================================
+            # Time the incursions by flight segments
+            # ==============================================================
+            if segmentTiming:
+                segmentStats = segmentIncursionTimes(store, uwrBufferedPath, unit_no, unit_no_id, uwr_unique_Field,
+                                                     incursionSeverity, os.path.join(projectFolder, 'allSegmentStats'),
+                                                     feedback)
+                feedback.setProgressText(f'{segmentStats} created')
             allFLightPoints = QgsVectorLayer((incursionSeverityField), "allFlightPoints", "ogr")
             QgsProject.instance().addMapLayer(allFLightPoints)
             feedback.setProgressText('---Process completed successfully---')
@@ -1162,10 +782,10 @@ class calGeneralStats(QgsProcessingAlgorithm):
                 'INPUT': allFlightPoints,
                 'VALUES_FIELD_NAME': 'TimeInterval',
                 'CATEGORIES_FIELD_NAME': ['NameTkline', 'FlightName', 'TotalTime', 'HeightRange', 'UWR_NUMBER', 'UWR_UNIT_N',
-                                          'BUFF_DIST', 'IncursionSeverity', "TimeInterv"],
+                                          'BUFF_DIST', 'IncursionSeverity'],
                 'OUTPUT': os.path.join(delFolder, 'statsTemp')})['OUTPUT']
 
-            allFlightPointsStats_fieldMapping = processing.run("native:refactorfields",
+            allFlightPointsStats_final = processing.run("native:refactorfields",
                                                         {'INPUT':allFlightPointsStats_temp,
                                                          'FIELDS_MAPPING':[
                                                              {'expression': '"NameTkline"','length': 21,'name': 'NameTkline','precision': 0,'sub_type': 0,'type': 10,'type_name': 'text'},
@@ -1176,16 +796,9 @@ class calGeneralStats(QgsProcessingAlgorithm):
                                                              {'expression': '"UWR_UNIT_N"','length': 14,'name': 'UWR_UNIT_N','precision': 0,'sub_type': 0,'type': 10,'type_name': 'text'},
                                                              {'expression': '"BUFF_DIST"','length': 0,'name': 'BUFF_DIST','precision': 0,'sub_type': 0,'type': 6,'type_name': 'double precision'},
                                                              {'expression': '"IncursionSeverity"','length': 100,'name': 'IncursionSeverity','precision': 0,'sub_type': 0,'type': 10,'type_name': 'text'},
-                                                             {'expression': '"TimeInterv"', 'length': 0,'name': 'TimeInterv', 'precision': 0, 'sub_type': 0,'type': 6, 'type_name': 'double precision'},
-                                                             {'expression': '"count"','length': 0,'name': 'Frequency','precision': 0,'sub_type': 0,'type': 2,'type_name': 'integer'}],
-                                                         'OUTPUT':'TEMPORARY_OUTPUT'})['OUTPUT']
-            allFlightPointsStats_final = processing.run("native:fieldcalculator", {'INPUT':allFlightPointsStats_fieldMapping,
-                                                                              'FIELD_NAME':'TotalIncursionTime',
-                                                                              'FIELD_TYPE':0,
-                                                                              'FIELD_LENGTH':100,
-                                                                              'FIELD_PRECISION':2,
-                                                                              'FORMULA':' "Frequency" * "TimeInterv" ',
-                                                                              'OUTPUT':statsPath})['OUTPUT']
+                                                             {'expression': '"count"','length': 0,'name': 'Frequency','precision': 0,'sub_type': 0,'type': 2,'type_name': 'integer'},
+                                                             {'expression': '"sum"','length': 0,'name': 'TotalIncursionTime','precision': 2,'sub_type': 0,'type': 6,'type_name': 'double precision'}],
+                                                         'OUTPUT':statsPath})['OUTPUT']
 
             lyr = QgsVectorLayer(allFlightPointsStats_final, 'allFlightPointStats', "ogr")
 
@@ -1449,6 +1062,11 @@ class LOS_analysis(QgsProcessingAlgorithm):
             # ==============================================================
             uwr_notmasked_List = []
 
+            # ==============================================================
+            # Extract the flight points of each group of overlapping uwr once
+            # ==============================================================
+            uwrPoints = groupFlightPoints(uwrBuffered, uwrSet, allFlightPoints, uwr_unique_Field, delFolder, feedback)
+
             for uwr in uwrSet:
                 nameUWR = replaceNonAlphaNum(uwr, "_")
                 points_aglViewshed = 'points_aglViewshed' + nameUWR
@@ -1497,7 +1115,7 @@ class LOS_analysis(QgsProcessingAlgorithm):
 
                 uwrFlightPoints_selected = processing.run("native:extractbyexpression",
                                                      {'EXPRESSION': expression,
-                                                      'INPUT': allFlightPoints,
+                                                      'INPUT': uwrPoints[uwr],
                                                       'OUTPUT': os.path.join(delFolder, 'uwrFlightPoints_selected' + uwr)})['OUTPUT']
                 feedback.setProgressText(f'{uwrFlightPoints_selected}')
                 # ==============================================================
@@ -1736,7 +1354,7 @@ class finalPointsStats(QgsProcessingAlgorithm):
                 'INPUT': LOS_finalPoints,
                 'VALUES_FIELD_NAME': 'TInterval',
                 'CATEGORIES_FIELD_NAME': ['NameTkline', 'FlightName', 'TotalTime', 'HeightRange', unit_no, unit_no_id,
-                                          'BUFF_DIST', 'IncursionSeverity', "TInterval"],
+                                          'BUFF_DIST', 'IncursionSeverity'],
                 'OUTPUT': os.path.join(delFolder, 'LOS_statsTemp')})['OUTPUT']
 
             LOS_finalPointsStats_fieldMapping = processing.run("native:refactorfields",
@@ -1750,7 +1368,7 @@ class finalPointsStats(QgsProcessingAlgorithm):
                                                                     {'expression': '"UWR_UNIT_NUMBER"', 'length': 14, 'name': 'UWR_UNIT_NUMBER', 'precision': 0, 'sub_type': 0, 'type': 10, 'type_name': 'text'},
                                                                     {'expression': '"BUFF_DIST"', 'length': 0, 'name': 'BUFF_DIST', 'precision': 0, 'sub_type': 0, 'type': 6, 'type_name': 'double precision'},
                                                                     {'expression': '"IncursionSeverity"', 'length': 100, 'name': 'IncursionSeverity', 'precision': 0, 'sub_type': 0, 'type': 10, 'type_name': 'text'},
-                                                                    {'expression': '"sum"', 'length': 0, 'name': 'TotalTimeIncursion', 'precision': 0, 'sub_type': 0, 'type': 2, 'type_name': 'integer'}],
+                                                                    {'expression': '"sum"', 'length': 0, 'name': 'TotalTimeIncursion', 'precision': 2, 'sub_type': 0, 'type': 6, 'type_name': 'double precision'}],
                                                                 'OUTPUT': os.path.join(delFolder, 'tempStats')})['OUTPUT']
 
 
@@ -1855,6 +1473,20 @@ class flightPathAnalysis(QgsProcessingAlgorithm):
     buffDistIS_high = 'buffDistIS_high'
     buffDistIS_moderate = 'buffDistIS_moderate'
     buffDistIS_low = 'buffDistIS_low'
+    bufferWorkers = 'bufferWorkers'
+    buffTolerance = 'buffTolerance'
+    segmentReport = 'segmentReport'
+    gridSize = 'gridSize'
+    ringCache = 'ringCache'
+    ringCacheSize = 'ringCacheSize'
+    flightPruning = 'flightPruning'
+    tileSize = 'tileSize'
+    gpxWorkers = 'gpxWorkers'
+    gpxPrefetch = 'gpxPrefetch'
+    maxTimeGap = 'maxTimeGap'
+    skipDuplicates = 'skipDuplicates'
+    reduceTolerance = 'reduceTolerance'
+    segmentTiming = 'segmentTiming'
     viewshed = 'viewshed'
     minElevViewshed = 'minElevViewshed'
 
@@ -1915,6 +1547,102 @@ class flightPathAnalysis(QgsProcessingAlgorithm):
         self.addParameter(QgsProcessingParameterString(
             self.buffDistIS_low, self.tr('Buffer distance - Low Incursion Severity'), 1500))
 
+        # ===========================================================================
+        # bufferWorkers - number of worker processes used to create the uwr buffers
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterNumber(
+            self.bufferWorkers, self.tr('Number of worker processes for buffering'),
+            QgsProcessingParameterNumber.Integer, 1, minValue=1))
+
+        # ===========================================================================
+        # buffTolerance - max distance (m) between the buffer arcs and a true circle, used to pick
+        # the number of buffer segments of each buffer distance. 0 keeps 90 segments
+        # segmentReport - compare vertex count and area of the buffers against 90 segments
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterNumber(
+            self.buffTolerance, self.tr('Max buffer deviation from a true circle (m), 0 = 90 segments'),
+            QgsProcessingParameterNumber.Double, 0, minValue=0))
+
+        # ===========================================================================
+        # gridSize - precision grid (m) of the ring differences, eg. 0.1. 0 keeps floating point overlay
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterNumber(
+            self.gridSize, self.tr('Precision grid of the buffer ring differences (m), 0 = floating point'),
+            QgsProcessingParameterNumber.Double, 0, minValue=0))
+
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.segmentReport, self.tr('Report buffer vertex count, area error and precision grid speed-up'), False))
+
+        # ===========================================================================
+        # ringCache - folder of the buffer ring cache shared between projects, with its max size in MB
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterFile(
+            self.ringCache, self.tr('Shared buffer ring cache folder'), QgsProcessingParameterFile.Folder,
+            optional=True))
+
+        self.addParameter(QgsProcessingParameterNumber(
+            self.ringCacheSize, self.tr('Max size of the buffer ring cache (MB)'),
+            QgsProcessingParameterNumber.Integer, 500, minValue=1))
+
+        # ===========================================================================
+        # flightPruning - only buffer the uwr within the largest buffer distance of a flight track
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.flightPruning, self.tr('Only buffer UWR near the flight tracks of the gpx folder'), False))
+
+        # ===========================================================================
+        # tileSize - size (m) of the tiles the flight points are classified in, 0 classifies all at once
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterNumber(
+            self.tileSize, self.tr('Tile size for classifying flight points (m), 0 = no tiles'),
+            QgsProcessingParameterNumber.Double, 0, minValue=0))
+
+        # ===========================================================================
+        # gpxWorkers - number of worker processes used to read the gpx files
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterNumber(
+            self.gpxWorkers, self.tr('Number of worker processes for reading gpx files'),
+            QgsProcessingParameterNumber.Integer, 1, minValue=1))
+
+        # ===========================================================================
+        # gpxPrefetch - number of gpx files read ahead by reader threads while the previous ones are
+        # processed, when the files are read with one worker. 0, the default, reads each file when
+        # it's needed
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterNumber(
+            self.gpxPrefetch, self.tr('Number of gpx files read ahead'),
+            QgsProcessingParameterNumber.Integer, 0, minValue=0))
+
+        # ===========================================================================
+        # maxTimeGap - longest time (s) between two gpx points counted as flight time, longer gaps
+        # (logger dropouts) are capped to it. 0 counts every gap
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterNumber(
+            self.maxTimeGap, self.tr('Longest time between gpx points counted as flight time (s), 0 = no limit'),
+            QgsProcessingParameterNumber.Double, 60, minValue=0))
+
+        # ===========================================================================
+        # skipDuplicates - leave out the flights uploaded twice, under another name or trimmed.
+        # Duplicates are listed in duplicateGPXFiles.txt either way
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.skipDuplicates, self.tr('Skip duplicate flights (listed in duplicateGPXFiles.txt)'), True))
+
+        # ===========================================================================
+        # reduceTolerance - position error (m) allowed when collapsing hovering points and downsampling
+        # straight flight, each kept point carries the time of the points it replaces. 0 keeps every point
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterNumber(
+            self.reduceTolerance, self.tr('Flight point reduction tolerance (m), 0 = keep every point'),
+            QgsProcessingParameterNumber.Double, 0, minValue=0))
+
+        # ===========================================================================
+        # segmentTiming - also time the incursions by flight segments, with the ring entry and exit
+        # times interpolated along each segment, into allSegmentStats.xlsx
+        # ===========================================================================
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.segmentTiming, self.tr('Time incursions by flight segments (allSegmentStats.xlsx)'), False))
+
 
     def processAlgorithm(self, parameters, context, feedback):
         """
@@ -1924,16 +1652,29 @@ class flightPathAnalysis(QgsProcessingAlgorithm):
         # to uniquely identify the feature sink, and must be included in the
         # dictionary returned by the processAlgorithm function.
         origUWR_source = self.parameterAsSource(parameters, self.origUWR, context)
-        origUWRPath = parameters['origUWR']
-        origUWR = None
         projectFolder = parameters['projectFolder']
         gpxFolder = parameters['gpxFolder']
         DEM = parameters['DEM']
+        demPath = self.parameterAsRasterLayer(parameters, self.DEM, context).source()
         existedViewshed = parameters['viewshed']
         existedMinElevViewshed = parameters['minElevViewshed']
         bufferDistList = [int(parameters['buffDistIS_high']), int(parameters['buffDistIS_moderate']), int(parameters['buffDistIS_low'])]
         incursionSeverity = {int(0): "In UWR", int(parameters['buffDistIS_high']): "High", int(parameters['buffDistIS_moderate']): "Moderate",
                           int(parameters['buffDistIS_low']): "Low"}
+        bufferWorkers = self.parameterAsInt(parameters, self.bufferWorkers, context)
+        buffTolerance = self.parameterAsDouble(parameters, self.buffTolerance, context)
+        segmentReport = self.parameterAsBool(parameters, self.segmentReport, context)
+        gridSize = self.parameterAsDouble(parameters, self.gridSize, context)
+        ringCacheFolder = self.parameterAsFile(parameters, self.ringCache, context)
+        ringCacheSize = self.parameterAsInt(parameters, self.ringCacheSize, context)
+        flightPruning = self.parameterAsBool(parameters, self.flightPruning, context)
+        tileSize = self.parameterAsDouble(parameters, self.tileSize, context)
+        gpxWorkers = self.parameterAsInt(parameters, self.gpxWorkers, context)
+        gpxPrefetch = self.parameterAsInt(parameters, self.gpxPrefetch, context)
+        maxTimeGap = self.parameterAsDouble(parameters, self.maxTimeGap, context)
+        skipDuplicates = self.parameterAsBool(parameters, self.skipDuplicates, context)
+        reduceTolerance = self.parameterAsDouble(parameters, self.reduceTolerance, context)
+        segmentTiming = self.parameterAsBool(parameters, self.segmentTiming, context)
 
         # ==============================================================
         # Result layer path
@@ -1977,232 +1718,15 @@ class flightPathAnalysis(QgsProcessingAlgorithm):
 
             feedback.setProgressText(str(bufferDistList))
 
-            # ===========================================================================
-            # Check if the input vector includes invalid geometry
-            # ===========================================================================
-            result = processing.run("qgis:checkvalidity", {'INPUT_LAYER': origUWRPath})
-            errorCount = result['ERROR_COUNT']
-            feedback.setProgressText(str(errorCount))
-
-            # ===========================================================================
-            # Fix the input geometry if invalid found, and replace the input for further process
-            # ===========================================================================
-            if errorCount > 0:
-                fixGeom = processing.run("native:fixgeometries",{'INPUT': origUWRPath, 'OUTPUT': 'TEMPORARY_OUTPUT'})
-                feedback.setProgressText('Geometry fixed')
-                origUWR = fixGeom['OUTPUT']
-
-            else:
-                feedback.setProgressText('No need to fix')
-                origUWR = origUWR_source
-
-
             # ==============================================================
-            # Get list of relevant UWR
+            # Create or update uwrBuffered, only new or changed uwr are buffered
             # ==============================================================
-            origUWRFieldList = origUWR.fields().names()
-            unit_no_index = origUWRFieldList.index(unit_no)
-            unit_no_id_index = origUWRFieldList.index(unit_no_id)
-            feedback.setProgressText(f'{unit_no_id_index, unit_no_index}')
-            uwrSet = set()
-            for feature in origUWR.getFeatures():
-                uwr_unique_Field_value = f'{feature.attributes()[unit_no_index]}__{feature.attributes()[unit_no_id_index]}'
-                uwrSet.add(uwr_unique_Field_value)
-
-            feedback.setProgressText(f'{uwr_unique_Field} added and updated')
-            feedback.setProgressText(f'{uwrSet} added and updated')
-
-            # ==============================================================
-            # Check existence of uwrBuffered in project folder
-            # ==============================================================
-            uwrBuffered_exist = os.path.isfile(uwrBufferedPath + '.gpkg')
-
-            # ==============================================================
-            # Get list of uwr that have buffers created
-            # ==============================================================
-            if uwrBuffered_exist:
-                feedback.setProgressText(f'uwrBuffered exists in project folder.')
-                createdUWRSet = set()
-                uwrBuffered_layer = QgsVectorLayer((uwrBufferedPath + '.gpkg'), "uwrBuffered", "ogr")
-                uwrBufferedFieldList = uwrBuffered_layer.fields().names()
-                feedback.setProgressText(f'{uwrBufferedFieldList}')
-                uwr_unique_Field_index = uwrBufferedFieldList.index(uwr_unique_Field)
-                feedback.setProgressText(f'{uwrBufferedFieldList}')
-                for feature in uwrBuffered_layer.getFeatures():
-                    uwr_unique_Field_value =  f'{feature.attributes()[uwr_unique_Field_index]}'
-                    createdUWRSet.add(uwr_unique_Field_value)
-
-                uwrRequireSet = uwrSet - createdUWRSet
-                feedback.setProgressText(f'{uwrSet} --uwrSet')
-                feedback.setProgressText(f'{createdUWRSet} -- createdUWRSet')
-                feedback.setProgressText(f'{uwrRequireSet} --uwrRequireSet')
-
-            else:
-                uwrRequireSet = uwrSet
-                feedback.setProgressText(f'uwrBuffered NOT exists in project folder.')
-
-
-            if len(uwrRequireSet) > 0:
-                if uwrBuffered_exist:
-                # ==============================================================
-                # Make new field in copy of orig UWR FC for unique UWR id.
-                # DIFFERENT FROM unique uwr id. make it so that there's no way this field existed before
-                # ==============================================================
-                    tempUniqueUWRField = 'tempUniqueUWRField'
-                    if tempUniqueUWRField not in origUWRFieldList:
-                        tempGPKG = processing.run("native:fieldcalculator",
-                                                  {'FIELD_LENGTH': 100,
-                                                   'FIELD_NAME': tempUniqueUWRField,
-                                                   'NEW_FIELD': True,
-                                                   'FIELD_PRECISION': 0,
-                                                   'FIELD_TYPE': 2,
-                                                   'FORMULA': f' "{unit_no}" + \'__\' + "{unit_no_id}" ',
-                                                   'INPUT': origUWR,
-                                                   'OUTPUT': 'TEMPORARY_OUTPUT'}, context=context, feedback=feedback)['OUTPUT']
-
-
-                    # ==============================================================
-                    # Select require uwr by making query with uwrRequireSet
-                    # ==============================================================
-                    uwrList_String = "','".join(uwrRequireSet)
-                    unbufferedFL = os.path.join(projectFolder, 'unbufferedUWR')
-                    expression = tempUniqueUWRField + " in ('" + uwrList_String + "')"
-                    unbufferedFLPath = processing.run("native:extractbyexpression",
-                                   {'EXPRESSION': expression,
-                                    'INPUT': tempGPKG,
-                                    'OUTPUT': unbufferedFL})['OUTPUT']
-                    feedback.setProgressText(f'unBufferedUWR created in {unbufferedFL}')
-                    requireUWRLayer = unbufferedFLPath
-                else:
-                    requireUWRLayer = origUWRPath
-                    feedback.setProgressText('requireUWRLayer = origUWR')
-
-                # ==============================================================
-                # Dissolves input feature class by dissolveFields list if list is given
-                # This is to avoid errors for multi-part uwr that have been split into
-                # separate features in the original uwr feature class.
-                # ==============================================================
-                dissolvedOrigPath = os.path.join(projectFolder, 'dissolve')
-                dissolvedOrig = processing.run("native:dissolve",
-                                               {'FIELD': [unit_no, unit_no_id],
-                                                'INPUT': requireUWRLayer,
-                                                'OUTPUT': 'TEMPORARY_OUTPUT',
-                                                'SEPARATE_DISJOINT': False})['OUTPUT']
-                dissolvedOrig_fid_removed = processing.run("native:deletecolumn",
-                                               {'COLUMN': ['fid'],
-                                                'INPUT': dissolvedOrig,
-                                                'OUTPUT': dissolvedOrigPath})['OUTPUT']
-
-                # ============re==================================================
-                # Start list of intermediate features to be deleted
-                # ==============================================================
-                uwrOnly = "BufferUWROnly"
-                delFC = [os.path.join(projectFolder, uwrOnly)]
-
-                # ==============================================================
-                # Create raw buffers
-                # ==============================================================
-                rawBufferDict = {}
-                for bufferDist in bufferDistList:
-                    rawBufferLoc, rawBufferName = rawBuffer(projectFolder, 'dissolve.gpkg',
-                                                  str(bufferDist) + 'Meters', bufferDist, delFolder,
-                                                      unit_no, unit_no_id, uwr_unique_Field)
-                    rawBufferDict[bufferDist] = [rawBufferLoc, rawBufferName]
-                    delFC.append(os.path.join(rawBufferLoc, rawBufferName))
-                    feedback.setProgressText(f"raw buffer created, {rawBufferName}")
-
-                # ==============================================================
-                # Get donut shaped buffer to only get list of buffered donut polygons
-                # that will be merge together to the final layer
-                # ==============================================================
-                requireMergeBufferList = []
-
-                # ==============================================================
-                # Go through each buffer distance to get the donut shapes of
-                # only the area for each buffer distance
-                # ==============================================================
-                uniqueIDFields = [unit_no, unit_no_id]
-                sortBufferDistList = list(sorted(bufferDistList))
-                feedback.setProgressText(f'{sortBufferDistList} -- sortedBuffer')
-                for bufferDist in sortBufferDistList:
-                    ToEraseLoc = rawBufferDict[bufferDist][0]
-                    ToEraseName = rawBufferDict[bufferDist][1] + '.gpkg'
-                    ToErasePath = os.path.join(ToEraseLoc, ToEraseName)
-                    feedback.setProgressText(f'{ToEraseLoc} and {ToEraseName}')
-                    feedback.setProgressText(f'{bufferDist} -- Bufferdist')
-
-                    if sortBufferDistList.index(bufferDist) == 0:
-                        onlyBufferDist = findBufferRange(dissolvedOrig_fid_removed, ToErasePath, uniqueIDFields, delFolder, bufferDist)
-                        feedback.setProgressText(f'UseToErasePath - {dissolvedOrig_fid_removed}')
-                        feedback.setProgressText(f'ToErasePath - {ToErasePath}')
-                    else:
-                        prevIndex = sortBufferDistList.index(bufferDist) - 1
-                        prevBufferDist = sortBufferDistList[prevIndex]
-                        prevBufferPath = os.path.join(rawBufferDict[prevBufferDist][0], rawBufferDict[prevBufferDist][1] + '.gpkg')
-                        feedback.setProgressText(prevBufferPath)
-                        feedback.setProgressText(f'UseToErasePath - {prevBufferPath}')
-                        feedback.setProgressText(f'ToErasePath - {ToErasePath}')
-                        onlyBufferDist = findBufferRange(prevBufferPath, ToErasePath, uniqueIDFields, delFolder, bufferDist)
-
-                    requireMergeBufferList.append(onlyBufferDist)
-                    feedback.setProgressText(f'appended uwronly{onlyBufferDist} -- onlyBufferDist')
-
-                # ==============================================================
-                # Create bufferUWROnly_NEW with uwr_unique_field and BUFF_DIST fields
-                # ==============================================================
-                uwrOnlyNewPath = os.path.join(projectFolder, uwrOnly)
-                uwrOnly_new = processing.run("native:savefeatures",
-                                               {'INPUT': dissolvedOrig_fid_removed,
-                                                'OUTPUT': 'TEMPORARY_OUTPUT',
-                                                'LAYER_NAME': '',
-                                                'DATASOURCE_OPTIONS': '',
-                                                'LAYER_OPTIONS': ''})['OUTPUT']
-
-                uwrOnly_new_uniField = processing.run("native:fieldcalculator",
-                                       {'FIELD_LENGTH': 100,
-                                        'FIELD_NAME': uwr_unique_Field,
-                                        'NEW_FIELD': True,
-                                        'FIELD_PRECISION': 0,
-                                        'FIELD_TYPE': 2,
-                                        'FORMULA': f' "{unit_no}" + \'__\' + "{unit_no_id}" ',
-                                        'INPUT': uwrOnly_new,
-                                        'OUTPUT': 'TEMPORARY_OUTPUT'}, context=context, feedback=feedback)['OUTPUT']
-
-                uwrOnly_new_uniField_buffDist = processing.run("native:fieldcalculator",
-                                       {'FIELD_LENGTH': 100,
-                                        'FIELD_NAME': 'BUFF_DIST',
-                                        'NEW_FIELD': True,
-                                        'FIELD_PRECISION': 0,
-                                        'FIELD_TYPE': 0,
-                                        'FORMULA': 0,
-                                        'INPUT': uwrOnly_new_uniField,
-                                        'OUTPUT': uwrOnlyNewPath}, context=context, feedback=feedback)['OUTPUT']
-                requireMergeBufferList.append(uwrOnly_new_uniField_buffDist)
-
-                feedback.setProgressText(f'{uwrOnly_new_uniField_buffDist} created')
-
-                # ==============================================================
-                # Append uwr into the final geopackage or create a new one
-                # ==============================================================
-
-                if uwrBuffered_exist:
-                    requireMergeBufferList.append(uwrBuffered_layer)
-                    uwrBuffered = processing.run("native:mergevectorlayers",
-                                           {'LAYERS': requireMergeBufferList,
-                                            'OUTPUT': uwrBufferedPath + '_updated'})['OUTPUT']
-                    feedback.setProgressText('final geopackage exists')
-                else:
-                    uwrBuffered = processing.run("native:mergevectorlayers",
-                                           {'LAYERS': requireMergeBufferList,
-                                            'OUTPUT': uwrBufferedPath})['OUTPUT']
-
-                    for f in requireMergeBufferList:
-                        feedback.setProgressText(f'{f} merged')
-
-
-            else:
-                uwrBuffered = uwrBufferedPath + '.gpkg'
-                feedback.setProgressText(f'No Need to create uwr buffers')
+            trackIndex = None
+            if flightPruning:
+                trackIndex = flightTrackIndex(gpxFolder, origUWR_source.sourceCrs(), feedback)
+            uwrBuffered = createUWRBuffered(origUWR_source, projectFolder, bufferDistList, unit_no, unit_no_id,
+                                            uwr_unique_Field, feedback, bufferWorkers, buffTolerance, segmentReport,
+                                            trackIndex, gridSize, ringCacheFolder, ringCacheSize)
 
             # ==============================================================
             # Reproject the origUWR (to fit with the DEM )
@@ -2229,14 +1753,14 @@ class flightPathAnalysis(QgsProcessingAlgorithm):
         try:
             # ==============================================================
             # Create variables for converting all gpx files into fc
-            # timeIntervalDict - dictionary of different time intervals and the flight points in each
-            # flightLines - lists of flight lines
+            # flightPoints - season table of the flight points, each point with its TInterval
+            # flightLines - season table of the flight lines
             # flightCount - count of flight lines
             # totalSeasonTime- total flight time in the season
             # checkFilesList - checkFilesList
             # ==============================================================
-            timeIntervalDict = {}
-            flightLines = []
+            flightPoints = None
+            flightLines = None
             flightCount = 0
             totalSeasonTime = 0
             checkFilesList = []
@@ -2244,355 +1768,63 @@ class flightPathAnalysis(QgsProcessingAlgorithm):
             # ===========================================================================
             # Loop through the input GPX folder
             # ===========================================================================
-            gpxFiles = glob.glob(os.path.join(gpxFolder, "*.gpx"))
-            gpxTemps = []
+            gpxFiles = gpxSources(gpxFolder)
 
             # ===========================================================================
-            # Get the row count of each GPX file, and the required information from different layers
+            # Convert the GPX files into flight points and flight lines.
+            # gpxIngest keeps the converted flights between runs, only new or modified gpx files are read
             # ===========================================================================
-            for gpxFile in gpxFiles:
-                flightCount += 1
-                feedback.setProgressText(f'{str(flightCount)}: {str(gpxFile)}')
-                gpxFormattedName = replaceNonAlphaNum(Path(gpxFile).stem, '_')
-                feedback.setProgressText(f'{gpxFormattedName}')
-
-                gpxDict = {'tkpt': '|layername=track_points', 'tkline': '|layername=tracks'}
-                rowCount = processing.run("qgis:basicstatisticsforfields",
-                                          {'INPUT_LAYER': gpxFile + gpxDict['tkpt'],
-                                           'FIELD_NAME': 'time',
-                                           'OUTPUT_HTML_FILE': 'TEMPORARY_OUTPUT'})['COUNT']
-                tkLyr = QgsVectorLayer((gpxFile + gpxDict['tkline']), "", "ogr")
-                tkLyrNameIndex = (tkLyr.fields().names()).index('name')
-                if tkLyrNameIndex != None:
-                    tkLyrFeatures = tkLyr.getFeatures()
-                    for feature in tkLyrFeatures:
-                        tkLyrName = str(feature.attributes()[tkLyrNameIndex])
-                        feedback.setProgressText(f'{tkLyrName}')
-                feedback.setProgressText(f'{rowCount}')
-
-                # ==============================================================
-                # Checks for files with consistent time intervals.
-                #  - All fc with same time intervals are grouped together in the dictionary
-                #  - If there are more than 2 rows
-                #       - find time between point recorded halfway through the flight and the point recorded right before it.
-                #       - else,time for objectid 3 - objectid 2 because there was an instance where there were 4 minutes between id 1 and 2.
-                #         assume only seconds between them the two points
-                # ==============================================================
-                tkptLyr_id = processing.run("native:fieldcalculator",
-                                            {'FIELD_LENGTH': 100,
-                                             'FIELD_NAME': 'OBJECTID',
-                                             'NEW_FIELD': True,
-                                             'FIELD_PRECISION': 0,
-                                             'FIELD_TYPE': 0,
-                                             'FORMULA': '$id',
-                                             'INPUT': gpxFile + gpxDict['tkpt'],
-                                             'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
-                query = None
-                if int(rowCount) > 2:
-                    half = round(int(rowCount) / 2)
-                    sel = (half - 1, half)
-                    query = "OBJECTID in " + str(sel)
-                elif int(rowCount) == 2:
-                    half = round(int(rowCount) / 2)
-                    sel = (half - 1, half)
-                    query = "OBJECTID in (0,1)"
-                else:
-                    checkFilesList.append(gpxFile)
-                    continue
-
-                if query != None:
-                    tkptLyrExtracted = processing.run("native:extractbyexpression",
-                                                      {'EXPRESSION': query,
-                                                       'INPUT': tkptLyr_id,
-                                                       'OUTPUT': os.path.join(delFolder, 'tkptExtracted' + str(flightCount))})['OUTPUT']
-                    tkptLyr = QgsVectorLayer((tkptLyrExtracted), "", "ogr")
-                    tkptExtractedTimeIndex = (tkptLyr.fields().names()).index('time')
-                    features = tkptLyr.getFeatures()
-                    values = []
-                    # ==============================================================
-                    # Calculate the time interval and the totalFlightTime
-                    # ==============================================================
-                    for f in features:
-                        timeValue = f.attributes()[tkptExtractedTimeIndex]
-                        values.append(timeValue)
-                    timeInterval = values[1].toTime_t() - values[0].toTime_t()
-                    totalFlightTime = rowCount * timeInterval
-                    feedback.setProgressText(f'The total flight time of {gpxFormattedName} is {totalFlightTime} seconds')
-
-                # ===========================================================================
-                # Add the Name field from tracks layer to track points layer
-                # ===========================================================================
-                gpxTempPath = os.path.join(delFolder, 'temp_' + gpxFormattedName)
-                feedback.setProgressText(f'{gpxTempPath}')
-                gpxTemp_saved = processing.run("native:savefeatures",
-                                               {'INPUT': gpxFile + gpxDict['tkpt'],
-                                                'OUTPUT': 'TEMPORARY_OUTPUT',
-                                                'LAYER_NAME': '',
-                                                'DATASOURCE_OPTIONS': '',
-                                                'LAYER_OPTIONS': ''})['OUTPUT']
-
-                gpxField_name_new = processing.run("native:fieldcalculator",
-                                                   {'FIELD_LENGTH': 30,
-                                                    'FIELD_NAME': 'NameTkline',
-                                                    'NEW_FIELD': True,
-                                                    'FIELD_PRECISION': 0,
-                                                    'FIELD_TYPE': 2,
-                                                    'FORMULA': f"'{tkLyrName}'",
-                                                    'INPUT': gpxTemp_saved,
-                                                    'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
-
-                # ===========================================================================
-                # Add the flightName field
-                # ===========================================================================
-                gpxField_flightName = processing.run("native:fieldcalculator",
-                                                     {'FIELD_LENGTH': 100,
-                                                      'FIELD_NAME': 'FlightName',
-                                                      'NEW_FIELD': True,
-                                                      'FIELD_PRECISION': 0,
-                                                      'FIELD_TYPE': 2,
-                                                      'FORMULA': f"'{gpxFormattedName}'",
-                                                      'INPUT': gpxField_name_new,
-                                                      'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
-
-                # ===========================================================================
-                # Add the TotalTime field
-                # ===========================================================================
-                gpxTemp = processing.run("native:fieldcalculator",
-                                         {'FIELD_LENGTH': 100,
-                                          'FIELD_NAME': 'TotalTime',
-                                          'NEW_FIELD': True,
-                                          'FIELD_PRECISION': 2,
-                                          'FIELD_TYPE': 0,
-                                          'FORMULA': f"'{totalFlightTime}'",
-                                          'INPUT': gpxField_flightName,
-                                          'OUTPUT': gpxTempPath}, context=context, feedback=feedback)['OUTPUT']
-
-                gpxTemps.append(gpxTemp)
-
-                # ===========================================================================
-                # Create flight line
-                # ===========================================================================
-                flightLineName = gpxFormattedName + '__flightLine'
-                flightLinePath = os.path.join(delFolder, flightLineName)
-                flightline = processing.run("native:pointstopath",
-                                            {'INPUT': gpxTemp,
-                                             'CLOSE_PATH': False,
-                                             'ORDER_EXPRESSION': '',
-                                             'NATURAL_SORT': False,
-                                             'GROUP_EXPRESSION': '',
-                                             'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
-
-                flightLineNameField = processing.run("native:fieldcalculator",
-                                                     {'FIELD_LENGTH': 100,
-                                                      'FIELD_NAME': 'Name',
-                                                      'NEW_FIELD': True,
-                                                      'FIELD_PRECISION': 0,
-                                                      'FIELD_TYPE': 2,
-                                                      'FORMULA': f"'{tkLyrName}'",
-                                                      'INPUT': flightline,
-                                                      'OUTPUT': flightLinePath})['OUTPUT']
-                flightLines.append(flightLineNameField + f'|layername={flightLineName}')
-                feedback.setProgressText(f'Flight Line: {flightLineNameField} appended')
-
-                # ===========================================================================
-                # Get season time sum
-                # ===========================================================================
-                totalSeasonTime += totalFlightTime
-                timeIntervalStr = "T" + replaceNonAlphaNum(str(timeInterval), "_")
-                if timeIntervalStr not in timeIntervalDict:
-                    timeIntervalDict[timeIntervalStr] = [timeInterval, [gpxTemp]]
-                else:
-                    timeIntervalDict[timeIntervalStr][1].append(gpxTemp)
-                feedback.setProgressText(f'===========================================')
+            ingestFolder = os.path.join(projectFolder, 'gpxIngest')
+            os.makedirs(ingestFolder, exist_ok=True)
+            flightPoints, flightLines, totalSeasonTime, checkFilesList, duplicateList = convertGPXFiles(
+                gpxFiles, ingestFolder, feedback, gpxWorkers, maxTimeGap, skipDuplicates, reduceTolerance,
+                gpxPrefetch, uwrBuffered, demPath)
+            flightCount = len(gpxFiles)
 
             # ===========================================================================
-            # Output the problem text to the gpx folder
+            # Output the problem and duplicate gpx files to the project folder
             # ===========================================================================
             if len(checkFilesList) > 0:
                 problemGPXText = open(os.path.join(projectFolder, 'problemGPXFiles.txt'), "w")
                 for i in checkFilesList:
                     problemGPXText.write(i + "\n")
                 problemGPXText.close()
+            if len(duplicateList) > 0:
+                duplicateGPXText = open(os.path.join(projectFolder, 'duplicateGPXFiles.txt'), "w")
+                for duplicateFile, originalFile in duplicateList:
+                    duplicateGPXText.write(duplicateFile + " is a duplicate of " + originalFile + "\n")
+                duplicateGPXText.close()
 
             feedback.setProgressText(f'Total season time : {totalSeasonTime}')
             feedback.setProgressText(f'Total flight line {flightCount}')
-            feedback.setProgressText(f'Number of different time interval {len(timeIntervalDict)}')
-            feedback.setProgressText(f'{timeIntervalDict}')
 
             # ===========================================================================
-            # Unprojected
+            # Load the flight points of the season table into the season point store, projected to EPSG:3005,
+            # and calculate their AGL from the DEM. The stages below read the store a slice at a time
             # ===========================================================================
-            unprojectedGPX = []
-            for interval in timeIntervalDict:
-                gpxAllUnprojectedPath = os.path.join(delFolder, interval + '_All_unprojected')
-                gpxMergeUnprojected = processing.run("native:mergevectorlayers",
-                                                     {'LAYERS': timeIntervalDict[interval][1],
-                                                      'CRS': None,
-                                                      'OUTPUT': os.path.join(delFolder, 'mergeUnprojected')})['OUTPUT']
-
-                feedback.setProgressText(f'Merged all gpx file for {interval}')
-
-                # ===========================================================================
-                # Reproject GPX merge lyr, and create a dem extent to down the orig DEM
-                # ===========================================================================
-                gpxMergePprojected = processing.run("grass7:v.proj",
-                                                    {'input': gpxMergeUnprojected,
-                                                     'crs': QgsCoordinateReferenceSystem('EPSG:3005'),
-                                                     'smax': 10000, '-z': False, '-w': False,
-                                                     'output': os.path.join(delFolder, 'mergeProjected.gpkg'),
-                                                     'GRASS_REGION_PARAMETER': None,
-                                                     'GRASS_SNAP_TOLERANCE_PARAMETER': -1,
-                                                     'GRASS_MIN_AREA_PARAMETER': 0.0001,
-                                                     'GRASS_OUTPUT_TYPE_PARAMETER': 0,
-                                                     'GRASS_VECTOR_DSCO': '',
-                                                     'GRASS_VECTOR_LCO': '',
-                                                     'GRASS_VECTOR_EXPORT_NOCAT': False})['output']
-
-                gpxMergePprojected_extent = processing.run("native:polygonfromlayerextent",
-                                                           {'INPUT': gpxMergePprojected,
-                                                            'ROUND_TO': 0, 'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
-                demExtent = processing.run("native:buffer", {
-                    'INPUT': gpxMergePprojected_extent,
-                    'DISTANCE': 100, 'SEGMENTS': 90, 'END_CAP_STYLE': 2, 'JOIN_STYLE': 0, 'MITER_LIMIT': 2,
-                    'DISSOLVE': False, 'OUTPUT': os.path.join(delFolder, 'gpxMergeProjected_extent')})['OUTPUT']
-
-                demClipped = processing.run("gdal:cliprasterbymasklayer",
-                                            {'INPUT': DEM,
-                                             'MASK': demExtent,
-                                             'SOURCE_CRS': None, 'TARGET_CRS': None, 'TARGET_EXTENT': None,
-                                             'NODATA': None, 'ALPHA_BAND': False, 'CROP_TO_CUTLINE': True,
-                                             'KEEP_RESOLUTION': True, 'SET_RESOLUTION': False, 'X_RESOLUTION': None,
-                                             'Y_RESOLUTION': None, 'MULTITHREADING': False,
-                                             'OPTIONS': '', 'DATA_TYPE': 0, 'EXTRA': '',
-                                             'OUTPUT': os.path.join(delFolder, 'demElev.tif')})['OUTPUT']
-                # ===========================================================================
-                # Extract the elevation values to points, default field name: DEMelev
-                # ===========================================================================
-                DEMElev = processing.run("sagang:addrastervaluestopoints",
-                                         {'SHAPES': gpxMergePprojected,
-                                          'GRIDS': [demClipped],
-                                          'RESULT': 'TEMPORARY_OUTPUT',
-                                          'RESAMPLING': 3})['RESULT']
-                feedback.setProgressText(f'DEM extract value to point')
-
-                AGL = processing.run("native:fieldcalculator",
-                                     {'INPUT': DEMElev,
-                                      'FIELD_NAME': 'AGL',
-                                      'FIELD_TYPE': 1,
-                                      'FIELD_LENGTH': 100,
-                                      'FIELD_PRECISION': 0,
-                                      'FORMULA': 'case\r\nwhen "ele" - "demElev" <0 then 0 \r\nelse "ele" - "demElev"\r\nend\r\n\r\n',
-                                      'OUTPUT': gpxAllUnprojectedPath})['OUTPUT']
-                # ===========================================================================
-                # Create layer with only points less than 500m
-                # ===========================================================================
-                pointLessthan500m_UnprojectedPath = os.path.join(delFolder, 'PointLessthan500m_Unprojected' + interval)
-                pointLessthan500mExtracted = processing.run("native:extractbyexpression",
-                                                            {'EXPRESSION': '"AGL" < 500',
-                                                             'INPUT': AGL,
-                                                             'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
-                rowCount = processing.run("qgis:basicstatisticsforfields",
-                                          {'INPUT_LAYER': pointLessthan500mExtracted,
-                                           'FIELD_NAME': 'time',
-                                           'OUTPUT_HTML_FILE': 'TEMPORARY_OUTPUT'})['COUNT']
-                feedback.setProgressText(f'point less than 500, row count: {rowCount}')
-                if rowCount == 0:
-                    feedback.setProgressText(f'point less than 500m layer table is empty')
-                    continue
-
-                # ===========================================================================
-                # Add time interval field
-                # ===========================================================================
-                timeIntervalField = processing.run("native:fieldcalculator",
-                                                   {'INPUT': pointLessthan500mExtracted,
-                                                    'FIELD_NAME': 'TInterval',
-                                                    'FIELD_TYPE': 0,
-                                                    'FIELD_LENGTH': 100,
-                                                    'FIELD_PRECISION': 0,
-                                                    'FORMULA': f"'{timeIntervalDict[interval][0]}'",
-                                                    'OUTPUT': pointLessthan500m_UnprojectedPath})['OUTPUT']
-                feedback.setProgressText(f'TInterval field added')
-                unprojectedGPX.append(timeIntervalField + f'|layername=PointLessthan500m_Unprojected{interval}')
-                feedback.setProgressText(f'Unprojected layer:{timeIntervalField} appended')
-            feedback.setProgressText(f'{unprojectedGPX}')
-
-            # ===========================================================================
-            # Merge all unprojectedGPS layers that includes points below 500m
-            # ===========================================================================
-            if len(unprojectedGPX) > 1:
-                gpxMergeUnprojected_500m = processing.run("sagang:mergevectorlayers", {
-                    'INPUT': unprojectedGPX,
-                    'MERGED': os.path.join(delFolder, 'pointLessthan500m_Unprojected_Final'),
-                    'SRCINFO': False,
-                    'MATCH': True,
-                    'DELETE': False})['MERGED'] + '.shp'
-            else:
-                gpxMergeUnprojected_500m = unprojectedGPX[0]
+            store = buildPointStore(flightPoints, os.path.join(ingestFolder, 'pointStore'), feedback)
+            sampleStoreDEM(store, demPath, feedback)
 
-            feedback.setProgressText(f'{gpxMergeUnprojected_500m} created')
             # ===========================================================================
-            # Remove blank fields from gpxMergeUnprojected_500m_Final
+            # Write the points less than 500m, projected to ESPG 3005
             # ===========================================================================
-            gpxMergeUnprojected_500m_reprojected = processing.run("native:refactorfields",
-                                    {'INPUT': gpxMergeUnprojected_500m,
-                                    'FIELDS_MAPPING': [{'expression': '"cat"', 'length': 16, 'name': 'cat', 'precision': 0, 'sub_type': 0,'type': 4, 'type_name': 'int8'},
-                                                       {'expression': '"ele"', 'length': 18,'name': 'ele', 'precision': 10, 'sub_type': 0, 'type': 6, 'type_name': 'double precision'},
-                                                       {'expression': '"time"', 'length': 23, 'name': 'time', 'precision': 0, 'sub_type': 0, 'type': 10, 'type_name': 'text'},
-                                                       {'expression': '"hdop"', 'length': 18, 'name': 'hdop', 'precision': 10, 'sub_type': 0, 'type': 6, 'type_name': 'double precision'},
-                                                       {'expression': '"badelf_spe"', 'length': 18, 'name': 'badelf_spe', 'precision': 10, 'sub_type': 0, 'type': 6, 'type_name': 'double precision'},
-                                                       {'expression': '"NameTkline"', 'length': 50, 'name': 'NameTkline', 'precision': 0, 'sub_type': 0, 'type': 10, 'type_name': 'text'},
-                                                       {'expression': '"FlightName"', 'length': 34, 'name': 'FlightName', 'precision': 0, 'sub_type': 0, 'type': 10, 'type_name': 'text'},
-                                                       {'expression': '"TotalTime"', 'length': 18, 'name': 'TotalTime', 'precision': 10, 'sub_type': 0, 'type': 6, 'type_name': 'double precision'},
-                                                       {'expression': '"layer"', 'length': 39, 'name': 'layer', 'precision': 0, 'sub_type': 0, 'type': 10, 'type_name': 'text'},
-                                                       {'expression': '"demElev"', 'length': 18, 'name': 'demElev', 'precision': 10, 'sub_type': 0, 'type': 6, 'type_name': 'double precision'},
-                                                       {'expression': '"AGL"', 'length': 16, 'name': 'AGL', 'precision': 0, 'sub_type': 0, 'type': 4, 'type_name': 'int8'},
-                                                       {'expression': '"TInterval"', 'length': 18, 'name': 'TInterval', 'precision': 10, 'sub_type': 0, 'type': 6, 'type_name': 'double precision'}],
-                                    'OUTPUT': 'TEMPORARY_OUTPUT'})['OUTPUT']
+            pointLessthan500m = storeSelection(store, 500)
+            rowCount = len(pointLessthan500m)
+            feedback.setProgressText(f'point less than 500, row count: {rowCount}')
+            if rowCount == 0:
+                raise SystemExit("No flight points below 500m")
 
-            # ===========================================================================
-            # Reproject the result to ESPG 3005
-            # ===========================================================================
-            feedback.setProgressText(f'Reprojecting allFlightPoints....')
-            pointLessthan500m_Projected = processing.run("grass7:v.proj",
-                                                         {'input': gpxMergeUnprojected_500m_reprojected,
-                                                          'crs': QgsCoordinateReferenceSystem('EPSG:3005'),
-                                                          'smax': 10000, '-z': False, '-w': False,
-                                                          'output': os.path.join(projectFolder, 'pointLessthan500m_Projected.gpkg'),
-                                                          'GRASS_REGION_PARAMETER': None,
-                                                          'GRASS_SNAP_TOLERANCE_PARAMETER': -1,
-                                                          'GRASS_MIN_AREA_PARAMETER': 0.0001,
-                                                          'GRASS_OUTPUT_TYPE_PARAMETER': 0,
-                                                          'GRASS_VECTOR_DSCO': '',
-                                                          'GRASS_VECTOR_LCO': '',
-                                                          'GRASS_VECTOR_EXPORT_NOCAT': False})['output']
-            feedback.setProgressText(f'Reprojected allFlightPoints')
+            pointLessthan500m_Projected = writeStorePoints(store, pointLessthan500m, flightPoints,
+                                                           os.path.join(projectFolder, 'pointLessthan500m_Projected.gpkg'),
+                                                           feedback, 'TInterval')
 
             # ===========================================================================
-            # Merge all the flight lines
+            # All the flight lines are in the season table
             # ===========================================================================
-            gpxMergeFlightLines = processing.run("native:mergevectorlayers",
-                                                 {'LAYERS': flightLines,
-                                                  'CRS': None,
-                                                  'OUTPUT': os.path.join(delFolder, 'allFlightLinesUnprojected')})['OUTPUT']
+            gpxMergeFlightLines = flightLines
             feedback.setProgressText(f'Reprojecting allFlightLines....')
 
-            allFlightLines_Projected = processing.run("grass7:v.proj",
-                                                      {'input': gpxMergeFlightLines,
-                                                       'crs': QgsCoordinateReferenceSystem('EPSG:3005'),
-                                                       'smax': 10000, '-z': False, '-w': False,
-                                                       'output': 'TEMPORARY_OUTPUT',
-                                                       'GRASS_REGION_PARAMETER': None,
-                                                       'GRASS_SNAP_TOLERANCE_PARAMETER': -1,
-                                                       'GRASS_MIN_AREA_PARAMETER': 0.0001,
-                                                       'GRASS_OUTPUT_TYPE_PARAMETER': 0,
-                                                       'GRASS_VECTOR_DSCO': '',
-                                                       'GRASS_VECTOR_LCO': '',
-                                                       'GRASS_VECTOR_EXPORT_NOCAT': False})['output']
-
-            allFlightLines = processing.run("native:savefeatures", {
-                'INPUT': allFlightLines_Projected,
-                'OUTPUT': os.path.join(projectFolder, 'allFlightLines'),
-                'LAYER_NAME': '', 'DATASOURCE_OPTIONS': '', 'LAYER_OPTIONS': ''})
+            projectFlightLines(gpxMergeFlightLines, os.path.join(projectFolder, 'allFlightLines.gpkg'), feedback)
             feedback.setProgressText(f'Reprojected allFlightLines')
 
             # ===========================================================================
@@ -2625,15 +1857,19 @@ class flightPathAnalysis(QgsProcessingAlgorithm):
             # ===========================================================================
             # Spatial join the pointLessthan500m and the selected uwebuffered field
             # ===========================================================================
-            pointLessthan500m_uwrbuffer = processing.run("native:joinattributesbylocation",
-                                                         {'INPUT': heightRangeField,
-                                                          'PREDICATE': [0],
-                                                          'JOIN': uwr_fieldMapping,
-                                                          'JOIN_FIELDS': [],
-                                                          'METHOD': 0,
-                                                          'DISCARD_NONMATCHING': True,
-                                                          'PREFIX': '',
-                                                          'OUTPUT': os.path.join(delFolder,'Point_lessthan500Height_uwrbuffer')})['OUTPUT']
+            if tileSize > 0:
+                pointLessthan500m_uwrbuffer = tiledJoin(heightRangeField, uwr_fieldMapping, uwr_unique_Field, tileSize,
+                                                        delFolder, 'Point_lessthan500Height_uwrbuffer', feedback)
+            else:
+                pointLessthan500m_uwrbuffer = processing.run("native:joinattributesbylocation",
+                                                             {'INPUT': heightRangeField,
+                                                              'PREDICATE': [0],
+                                                              'JOIN': uwr_fieldMapping,
+                                                              'JOIN_FIELDS': [],
+                                                              'METHOD': 0,
+                                                              'DISCARD_NONMATCHING': True,
+                                                              'PREFIX': '',
+                                                              'OUTPUT': os.path.join(delFolder,'Point_lessthan500Height_uwrbuffer')})['OUTPUT']
 
             # ==============================================================
             # If table is empty, ie, no point within uwr buffer zones, no need to get a table
@@ -2685,10 +1921,10 @@ class flightPathAnalysis(QgsProcessingAlgorithm):
                 'INPUT': allFlightPoints,
                 'VALUES_FIELD_NAME': 'TInterval',
                 'CATEGORIES_FIELD_NAME': ['NameTkline', 'FlightName', 'TotalTime', 'HeightRange', f'{unit_no}', f'{unit_no_id}',
-                                          'BUFF_DIST', 'IncursionSeverity', "TInterval"],
+                                          'BUFF_DIST', 'IncursionSeverity'],
                 'OUTPUT': os.path.join(delFolder, 'statsTemp')})['OUTPUT']
 
-            allFlightPointsStats_fieldMapping = processing.run("native:refactorfields",
+            allFlightPointsStats_final = processing.run("native:refactorfields",
                                                         {'INPUT':allFlightPointsStats_temp,
                                                          'FIELDS_MAPPING':[
                                                              {'expression': '"NameTkline"','length': 50,'name': 'NameTkline','precision': 0,'sub_type': 0,'type': 10,'type_name': 'text'},
@@ -2699,21 +1935,22 @@ class flightPathAnalysis(QgsProcessingAlgorithm):
                                                              {'expression': f"{unit_no_id}",'length': 14,'name': f'{unit_no_id}','precision': 0,'sub_type': 0,'type': 10,'type_name': 'text'},
                                                              {'expression': '"BUFF_DIST"','length': 0,'name': 'BUFF_DIST','precision': 0,'sub_type': 0,'type': 6,'type_name': 'double precision'},
                                                              {'expression': '"IncursionSeverity"','length': 100,'name': 'IncursionSeverity','precision': 0,'sub_type': 0,'type': 10,'type_name': 'text'},
-                                                             {'expression': '"TInterval"', 'length': 0,'name': 'TInterval', 'precision': 0, 'sub_type': 0,'type': 6, 'type_name': 'double precision'},
-                                                             {'expression': '"count"','length': 0,'name': 'Frequency','precision': 0,'sub_type': 0,'type': 2,'type_name': 'integer'}],
-                                                         'OUTPUT':os.path.join(delFolder, 'tempfield')})['OUTPUT']
-
-            allFlightPointsStats_final = processing.run("native:fieldcalculator", {'INPUT':allFlightPointsStats_fieldMapping,
-                                                                              'FIELD_NAME':'TotalIncursionTime',
-                                                                              'FIELD_TYPE':0,
-                                                                              'FIELD_LENGTH':100,
-                                                                              'FIELD_PRECISION':2,
-                                                                              'FORMULA':' "Frequency" * "TInterval" ',
-                                                                              'OUTPUT':statsPath})['OUTPUT']
+                                                             {'expression': '"count"','length': 0,'name': 'Frequency','precision': 0,'sub_type': 0,'type': 2,'type_name': 'integer'},
+                                                             {'expression': '"sum"','length': 0,'name': 'TotalIncursionTime','precision': 2,'sub_type': 0,'type': 6,'type_name': 'double precision'}],
+                                                         'OUTPUT':statsPath})['OUTPUT']
 
             lyr = QgsVectorLayer(allFlightPointsStats_final, 'allFlightPointStats', "ogr")
 
             QgsVectorFileWriter.writeAsVectorFormat(lyr, statsPath ,"utf-8",driverName = "XLSX", layerOptions = ['GEOMETRY=AS_XYZ'])
+
+            # ==============================================================
+            # Time the incursions by flight segments
+            # ==============================================================
+            if segmentTiming:
+                segmentStats = segmentIncursionTimes(store, uwrBuffered, unit_no, unit_no_id, uwr_unique_Field,
+                                                     incursionSeverity, os.path.join(projectFolder, 'allSegmentStats'),
+                                                     feedback)
+                feedback.setProgressText(f'{segmentStats} created')
             feedback.setProgressText('============================== Completed - Flightpath Conversion ==============================')
 
         except QgsException as e:
@@ -2796,6 +2033,12 @@ class flightPathAnalysis(QgsProcessingAlgorithm):
             # ==============================================================
             uwr_notmasked_List = []
 
+            # ==============================================================
+            # Extract the flight points of each group of overlapping uwr once
+            # ==============================================================
+            uwrPoints = groupFlightPoints(uwrBufferedPath + '.gpkg', flightPTUwrSet, allFlightPoints, uwr_unique_Field,
+                                          delFolder, feedback)
+
             for uwr in flightPTUwrSet:
                 nameUWR = replaceNonAlphaNum(uwr, "_")
                 points_aglViewshed = 'points_aglViewshed' + nameUWR
@@ -2844,7 +2087,7 @@ class flightPathAnalysis(QgsProcessingAlgorithm):
 
                 uwrFlightPoints_selected = processing.run("native:extractbyexpression",
                                                      {'EXPRESSION': expression,
-                                                      'INPUT': allFlightPoints,
+                                                      'INPUT': uwrPoints[uwr],
                                                       'OUTPUT': os.path.join(delFolder, 'uwrFlightPoints_selected' + uwr)})['OUTPUT']
                 feedback.setProgressText(f'{uwrFlightPoints_selected}')
                 # ==============================================================
@@ -2950,7 +2193,7 @@ class flightPathAnalysis(QgsProcessingAlgorithm):
                 'INPUT': LOS_uwrFlightPoints_selected,
                 'VALUES_FIELD_NAME': 'TInterval',
                 'CATEGORIES_FIELD_NAME': ['NameTkline', 'FlightName', 'TotalTime', 'HeightRange', unit_no, unit_no_id,
-                                          'BUFF_DIST', 'IncursionSeverity', "TInterval"],
+                                          'BUFF_DIST', 'IncursionSeverity'],
                 'OUTPUT': os.path.join(delFolder, 'LOS_statsTemp')})['OUTPUT']
             finalStatsPath = os.path.join(projectFolder, 'LOS_finalStats')
 
@@ -2965,7 +2208,7 @@ class flightPathAnalysis(QgsProcessingAlgorithm):
                                                                     {'expression': '"UWR_UNIT_NUMBER"', 'length': 14, 'name': 'UWR_UNIT_NUMBER', 'precision': 0, 'sub_type': 0, 'type': 10, 'type_name': 'text'},
                                                                     {'expression': '"BUFF_DIST"', 'length': 0, 'name': 'BUFF_DIST', 'precision': 0, 'sub_type': 0, 'type': 6, 'type_name': 'double precision'},
                                                                     {'expression': '"IncursionSeverity"', 'length': 100, 'name': 'IncursionSeverity', 'precision': 0, 'sub_type': 0, 'type': 10, 'type_name': 'text'},
-                                                                    {'expression': '"sum"', 'length': 0, 'name': 'TotalTimeIncursion', 'precision': 0, 'sub_type': 0, 'type': 2, 'type_name': 'integer'}],
+                                                                    {'expression': '"sum"', 'length': 0, 'name': 'TotalTimeIncursion', 'precision': 2, 'sub_type': 0, 'type': 6, 'type_name': 'double precision'}],
                                                                 'OUTPUT': os.path.join(delFolder, 'tempStats')})['OUTPUT']
 
             lyr = QgsVectorLayer(LOS_finalPointsStats_fieldMapping, 'LOS_finalPointsStats', "ogr")
@@ -0,0 +1,138 @@
+import gzip
+import hashlib
+import io
+import os
+import sys
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+import numpy as np
+
+# flightPathAnalysis_Function_GPX doesn't depend on qgis, it's imported without the plugin package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import flightPathAnalysis_Function_GPX
+from flightPathAnalysis_Function_GPX import (gpxSources, parseFlight, pointDurations, readFlightBytes, reduceTrack,
+                                             sourceHash)
+
+
+def straightTrack(pointCount, hoverCount=0):
+    """
+    Track flown east at 50 m/s, logged every second, after hovering hoverCount seconds at the start
+    """
+    metres = np.concatenate([np.zeros(hoverCount), np.arange(pointCount - hoverCount) * 50.0])
+    return {'lon': -123 + metres / 72000, 'lat': np.full(pointCount, 50.0),
+            'ele': np.full(pointCount, 1000.0), 'time': 1.6e9 + np.arange(pointCount, dtype=np.float64),
+            'hdop': np.full(pointCount, np.nan), 'name': 'test', 'vendor': {}}
+
+
+def zoneSums(zones, durations):
+    """
+    {zone: time (s) flown in the zone}
+    """
+    return {int(zone): float(durations[zones == zone].sum()) for zone in np.unique(zones)}
+
+
+class reduceTrackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.track = straightTrack(600, hoverCount=120)
+        self.durations = pointDurations(self.track)
+        # uwr rings crossed on the way, and a height band change, as trackZones would number them
+        self.zones = np.zeros(600, dtype=int)
+        self.zones[200:260] = 1
+        self.zones[260:330] = 2
+        self.zones[330:335] = 3
+        self.zones[335:] = 1
+
+    def test_reduces_hover_and_straight_flight(self):
+        reduced, keptDurations = reduceTrack(self.track, self.durations, 10)
+        self.assertLess(len(keptDurations), 10)
+        self.assertAlmostEqual(keptDurations.sum(), self.durations.sum())
+
+    def test_zone_sums_unchanged(self):
+        reduced, keptDurations = reduceTrack(self.track, self.durations, 10, self.zones)
+        self.assertLess(len(keptDurations), 20)
+        keptZones = self.zones[np.searchsorted(self.track['time'], reduced['time'])]
+        self.assertEqual(zoneSums(keptZones, keptDurations), zoneSums(self.zones, self.durations))
+
+    def test_points_without_position_dropped_with_their_time(self):
+        self.track['lon'][400] = np.nan
+        reduced, keptDurations = reduceTrack(self.track, self.durations, 10, self.zones)
+        located = ~np.isnan(self.track['lon'])
+        self.assertAlmostEqual(keptDurations.sum(), self.durations[located].sum())
+
+    def test_no_tolerance_keeps_track(self):
+        reduced, keptDurations = reduceTrack(self.track, self.durations, 0, self.zones)
+        self.assertIs(reduced, self.track)
+
+
+def gpxContent(flightNumber):
+    """
+    Content of a small gpx file, different for every flight number
+    """
+    points = ''.join(f'<trkpt lat="50.{flightNumber:02d}{i:02d}" lon="-123.0"><ele>1000</ele>'
+                     f'<time>2021-03-04T18:00:{i:02d}Z</time></trkpt>' for i in range(10))
+    return (f'<?xml version="1.0"?><gpx xmlns="http://www.topografix.com/GPX/1/1"><trk><name>flight{flightNumber}'
+            f'</name><trkseg>{points}</trkseg></trk></gpx>').encode()
+
+
+class archiveSourcesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        folder = self.folder.name
+        self.contents = {}
+        with zipfile.ZipFile(os.path.join(folder, 'march.zip'), 'w') as zipArchive:
+            for flightNumber in range(3):
+                zipArchive.writestr(f'z{flightNumber}.gpx', gpxContent(flightNumber))
+                self.contents[f'/vsizip/{folder}/march.zip/z{flightNumber}.gpx'] = gpxContent(flightNumber)
+        # members stored out of name order, and one compressed on its own
+        with tarfile.open(os.path.join(folder, 'april.tar.gz'), 'w:gz') as tarArchive:
+            for flightNumber in (12, 10, 11):
+                name = f't{flightNumber}.gpx'
+                content = gpxContent(flightNumber)
+                if flightNumber == 11:
+                    name += '.gz'
+                    content = gzip.compress(content)
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tarArchive.addfile(info, io.BytesIO(content))
+        tarSources = [f'/vsitar/{folder}/april.tar.gz/t12.gpx', f'/vsitar/{folder}/april.tar.gz/t10.gpx',
+                      f'/vsigzip//vsitar/{folder}/april.tar.gz/t11.gpx.gz']
+        for source, flightNumber in zip(tarSources, (12, 10, 11)):
+            self.contents[source] = gpxContent(flightNumber)
+        self.tarSources = tarSources
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_sources_list_tar_members_in_archive_order(self):
+        sources = gpxSources(self.folder.name)
+        self.assertEqual(sorted(sources), sorted(self.contents))
+        tarOrder = [source for source in sources if '/vsitar/' in source]
+        self.assertEqual(tarOrder, self.tarSources)
+
+    def test_read_members(self):
+        for source in gpxSources(self.folder.name):
+            content = readFlightBytes(source)
+            self.assertEqual(content, self.contents[source])
+            self.assertEqual(parseFlight(content)['sha1'], hashlib.sha1(self.contents[source]).hexdigest())
+            self.assertEqual(sourceHash(source), hashlib.sha1(self.contents[source]).hexdigest())
+
+    def test_read_members_out_of_order(self):
+        for source in reversed(gpxSources(self.folder.name)):
+            self.assertEqual(readFlightBytes(source), self.contents[source])
+
+    def test_tar_opened_once_in_archive_order(self):
+        sources = gpxSources(self.folder.name)
+        with mock.patch.object(flightPathAnalysis_Function_GPX.tarfile, 'open', wraps=tarfile.open) as tarOpen:
+            for source in sources:
+                readFlightBytes(source)
+        self.assertEqual(tarOpen.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()